@@ -0,0 +1,98 @@
+"""Запуск клиента: каталог из JSON против скомпилированного кэша (mmap).
+
+Синтетический каталог пишется во временный каталог как rp_phrases.json и
+formats.json. Замеряется то, что клиент делает до показа окна: получить
+индекс и открыть первую категорию с подкатегориями. Память - прирост по
+tracemalloc (страницы mmap - это кэш файла ОС, в куче их нет). Печатает JSON.
+
+    python bench/catalog_cache.py --phrases 100000
+"""
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import catalog_cache  # noqa: E402
+from synthetic import make_catalog  # noqa: E402
+
+
+def first_screen(index):
+    # Как populate_phrases + клик: корень дерева и первая категория с фразами
+    path = ()
+    while True:
+        children = index.children.get(path, ())
+        if not children:
+            break
+        path += (children[0],)
+    return len(index.category(path))
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = load()
+    shown = first_screen(index)
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, shown, elapsed, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phrases", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    tree, formats = make_catalog(args.phrases, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        phrases_path = Path(tmp) / "rp_phrases.json"
+        formats_path = Path(tmp) / "formats.json"
+        cache_path = Path(tmp) / "rp_catalog.bin"
+        with open(phrases_path, "w", encoding="utf-8") as f:
+            json.dump(tree, f, ensure_ascii=False)
+        with open(formats_path, "w", encoding="utf-8") as f:
+            json.dump(formats, f, ensure_ascii=False)
+        del tree, formats
+
+        # Первый запуск: кэша нет - JSON, компиляция идёт в фоновом потоке
+        index, shown, json_s, json_bytes = measure(
+            lambda: catalog_cache.load(phrases_path, formats_path, cache_path)[0])
+        started = time.perf_counter()
+        cache_file = catalog_cache.compile_index(index, cache_path, catalog_cache.source_digest(phrases_path, formats_path),
+                                    catalog_cache.source_stamps(phrases_path, formats_path))
+        compile_s = time.perf_counter() - started
+        phrases = len(index)
+        del index
+
+        compiled, shown_cached, cache_s, cache_bytes = measure(
+            lambda: catalog_cache.load(phrases_path, formats_path, cache_path)[0])
+        assert isinstance(compiled, catalog_cache.CompiledCatalog) and shown_cached == shown
+
+        # Исходник тронули, содержимое то же: сверка по хэшу
+        phrases_path.touch()
+        _, _, touched_s, _ = measure(lambda: catalog_cache.load(phrases_path, formats_path, cache_path)[0])
+
+        print(json.dumps({
+            "phrases": phrases,
+            "json_mb": round((phrases_path.stat().st_size + formats_path.stat().st_size) / 2**20, 1),
+            "cache_mb": round(cache_file.stat().st_size / 2**20, 1),
+            "json_start_s": round(json_s, 3),
+            "json_heap_mb": round(json_bytes / 2**20, 1),
+            "compile_s": round(compile_s, 3),
+            "cache_start_ms": round(cache_s * 1000, 2),
+            "cache_heap_mb": round(cache_bytes / 2**20, 2),
+            "cache_touched_ms": round(touched_s * 1000, 2),
+        }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
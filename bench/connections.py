@@ -0,0 +1,98 @@
+"""Сравнение движков server.py по числу соединений, потокам и памяти.
+
+Запускает сервер отдельным процессом, открывает N приёмников с настоящим
+рукопожатием HELLO receiver и снимает VmRSS/Threads из /proc (только Linux).
+
+    python bench/connections.py --engine threaded asyncio --counts 100 500 2000
+"""
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import protocol  # noqa: E402
+
+
+def proc_status(pid):
+    status = {}
+    with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.strip()
+    return {
+        "rss_kb": int(status["VmRSS"].split()[0]),
+        "threads": int(status["Threads"]),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_listening(port, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"сервер не поднялся на порту {port}")
+
+
+def measure(engine, count, settle=1.0):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, str(ROOT / "server.py"), "--engine", engine, "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    clients = []
+    try:
+        wait_listening(port)
+        time.sleep(settle)
+        idle = proc_status(server.pid)
+        started = time.perf_counter()
+        for _ in range(count):
+            c = socket.create_connection(("127.0.0.1", port))
+            c.sendall(protocol.hello("receiver"))
+            clients.append(c)
+        connect_time = time.perf_counter() - started
+        time.sleep(settle)
+        loaded = proc_status(server.pid)
+        return {
+            "engine": engine,
+            "connections": count,
+            "connect_s": round(connect_time, 3),
+            "idle_rss_kb": idle["rss_kb"],
+            "rss_kb": loaded["rss_kb"],
+            "rss_per_conn_kb": round((loaded["rss_kb"] - idle["rss_kb"]) / count, 1),
+            "threads": loaded["threads"],
+        }
+    finally:
+        for c in clients:
+            c.close()
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", nargs="+", default=["threaded", "asyncio"])
+    parser.add_argument("--counts", nargs="+", type=int, default=[100, 500, 2000])
+    args = parser.parse_args(argv)
+
+    for engine in args.engine:
+        for count in args.counts:
+            print(json.dumps(measure(engine, count), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
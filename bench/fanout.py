@@ -0,0 +1,155 @@
+"""Запись рассылки приёмникам: вызовы send и выделения памяти на пачку.
+
+R приёмников - TCP-соединения через loopback, читающие потоки только
+считают байты (recv_into в заранее выделенный буфер, чтобы их выделения не
+попадали в замер). На
+каждом такте в очереди каждого приёмника M сообщений, и писатель отдаёт их
+тремя способами:
+- per_message: как до кадрового протокола - текст кодируется заново для
+  каждого приёмника и каждое сообщение уходит своим sendall;
+- join: пачка склеивается b"".join в один буфер на приёмника и sendall;
+- sendmsg: общие для всех кадры одним sendmsg (writev) без склейки;
+- send_batch: как в server.py - склейка до JOIN_MAX байт, дальше sendmsg.
+
+Вызовы send считает обёртка над сокетом. Выделения - пик tracemalloc на
+запись одной пачки. У пишущего сокета таймаут (неблокирующий режим внутри
+Python) и маленький SO_SNDBUF, так что sendmsg пишет и частями; в конце
+проверяется, что каждый приёмник получил все байты. Печатает JSON.
+
+    python bench/fanout.py --receivers 100 --messages 16
+"""
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import protocol  # noqa: E402
+import server  # noqa: E402
+
+TEXT = "Здравствуйте, я сотрудник полиции. Предъявите документы, пожалуйста. "
+
+
+class CountingSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def sendall(self, data):
+        self.calls += 1
+        self.sock.sendall(data)
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        return self.sock.sendmsg(buffers)
+
+
+def drain(sock, counter, index):
+    buf = bytearray(65536)
+    while True:
+        n = sock.recv_into(buf)
+        if not n:
+            return
+        counter[index] += n
+
+
+def tcp_pair(listener):
+    a = socket.create_connection(listener.getsockname())
+    b, _ = listener.accept()
+    return a, b
+
+
+def per_message(conn, texts):
+    for text in texts:
+        conn.sendall((text + "\n").encode("utf-8"))
+
+
+def joined(conn, frames):
+    conn.sendall(b"".join(frames))
+
+
+def run(mode, receivers, messages, ticks, sndbuf, length):
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(receivers)
+        pairs = [tcp_pair(listener) for _ in range(receivers)]
+    received = [0] * receivers
+    readers = []
+    for i, (a, b) in enumerate(pairs):
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        a.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        a.settimeout(10)
+        t = threading.Thread(target=drain, args=(b, received, i), daemon=True)
+        t.start()
+        readers.append(t)
+    conns = [CountingSocket(a) for a, _ in pairs]
+    texts = [f"{(TEXT * (length // len(TEXT) + 1))[:length]} [{n}]" for n in range(messages)]
+    # Кадры собираются один раз на сообщение и общие для всех приёмников
+    frames = [protocol.message(text, channel="general") for text in texts]
+    size = sum(map(len, frames))
+
+    expected = 0
+    peak_total = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(ticks):
+        for conn in conns:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            if mode == "per_message":
+                per_message(conn, texts)
+            elif mode == "join":
+                joined(conn, list(frames))
+            elif mode == "sendmsg":
+                server.send_batch(conn, list(frames), size, join_max=0)
+            else:
+                server.send_batch(conn, list(frames), size)
+            peak_total += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+    if mode == "per_message":
+        expected = ticks * sum(len((t + "\n").encode("utf-8")) for t in texts)
+    else:
+        expected = ticks * sum(map(len, frames))
+
+    for a, _ in pairs:
+        a.shutdown(socket.SHUT_WR)
+    for t in readers:
+        t.join()
+    for a, b in pairs:
+        a.close()
+        b.close()
+    assert all(n == expected for n in received), (mode, set(received), expected)
+    writes = receivers * ticks
+    return {
+        "send_calls_per_batch": round(sum(c.calls for c in conns) / writes, 2),
+        "alloc_peak_per_batch_b": round(peak_total / writes),
+        "batch_us": round(elapsed / writes * 1e6, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receivers", type=int, default=100)
+    parser.add_argument("--messages", type=int, nargs="+", default=[1, 16, 128], help="сообщений в пачке")
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--sndbuf", type=int, default=8192, help="SO_SNDBUF, байт")
+    parser.add_argument("--length", type=int, nargs="+", default=[70], help="символов в реплике")
+    args = parser.parse_args(argv)
+
+    for length in args.length:
+        for messages in args.messages:
+            result = {"receivers": args.receivers, "length": length, "messages": messages}
+            for mode in ("per_message", "join", "sendmsg", "send_batch"):
+                result[mode] = run(mode, args.receivers, messages, args.ticks, args.sndbuf, length)
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""Нагрузочный замер ретранслятора и пути ввода, результат - JSON.
+
+relay - server.py отдельным процессом, N отправителей повторяют фразы из
+rp.json с заданным темпом, M приёмников с настоящим рукопожатием читают
+рассылку. Задержка рассылки - от отметки ts.sent отправителя до прочтения
+кадра приёмником (всё на одной машине, часы общие). JSON разбирают только
+первые --probes приёмников, остальные лишь режут поток на кадры, чтобы
+замер не упирался в сам генератор нагрузки. CPU и RSS сервера - из /proc,
+с --workers - сумма по всем процессам сервера.
+
+typing - ввод в FakeKeys без экрана: main.py --backend fake (напрямую) и
+receiver_client.py --backend fake за ретранслятором. Отметки этапов
+приходят обратно в ACK (latency.py).
+
+compare - сравнить два JSON-результата, например до и после изменения.
+
+    python bench/load.py relay --scales 1x10 10x100 10x1000 --out relay.json
+    python bench/load.py relay --engine asyncio --workers 1 2 4 --scales 20x1000
+    python bench/load.py typing --lines 200 --out typing.json
+    python bench/load.py compare old.json new.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import catalog  # noqa: E402
+import latency  # noqa: E402
+import protocol  # noqa: E402
+from connections import free_port, proc_status, wait_listening  # noqa: E402
+
+CHANNEL = "bench"
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def load_phrases(path=ROOT / "rp.json"):
+    # (текст, вид) всех фраз и /me каталога, шаблоны не подставляются
+    with open(path, "r", encoding="utf-8") as f:
+        index = catalog.CatalogIndex(json.load(f))
+    return [(e.text, e.kind) for e in index.entries.values()]
+
+
+def process_tree(pid):
+    # Процесс и его потомки (воркеры server.py --workers)
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r", encoding="utf-8") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    for child in children:
+        pids += process_tree(int(child))
+    return pids
+
+
+def proc_cpu(pid):
+    # utime + stime процессов сервера, секунды
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat", "r", encoding="utf-8") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / CLK_TCK
+
+
+def tree_status(pid):
+    total = {"rss_kb": 0, "threads": 0}
+    for p in process_tree(pid):
+        try:
+            status = proc_status(p)
+        except (OSError, KeyError):  # процесс уже завершился
+            continue
+        for key in total:
+            total[key] += status[key]
+    return total
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    last = len(samples) - 1
+
+    def at(q):
+        return round(samples[min(last, int(q * len(samples)))], 3)
+
+    return {"p50": at(0.5), "p99": at(0.99), "p999": at(0.999), "max": round(samples[-1], 3)}
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start(args_list, port):
+    proc = subprocess.Popen([sys.executable, *args_list], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_listening(port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# --- relay -------------------------------------------------------------------
+
+class Receiver:
+    def __init__(self, probe):
+        self.probe = probe
+        self.frames = 0
+        self.latencies = []  # мс, только у пробных приёмников
+
+    async def run(self, port, ready):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(protocol.hello("receiver", channels=[CHANNEL]))
+        await writer.drain()
+        ready.release()
+        decoder = protocol.FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                for kind, payload in decoder.feed(data):
+                    if kind != protocol.MSG:
+                        continue
+                    self.frames += 1
+                    if self.probe:
+                        sent = protocol.decode_json(payload).get("ts", {}).get("sent")
+                        if sent is not None:
+                            self.latencies.append((time.time() - sent) * 1000)
+        finally:
+            writer.close()
+
+
+async def sender(port, number, phrases, rate, duration, counter):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(protocol.hello("sender", channel=CHANNEL))
+    interval = 1 / rate
+    deadline = time.monotonic() + duration
+    next_at = time.monotonic()
+    for n in itertools.count():
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+        next_at += interval
+        text, kind = phrases[(number + n) % len(phrases)]
+        writer.write(protocol.message(text, channel=CHANNEL, kind=kind, id=f"{number}-{n}",
+                                      ts={"sent": time.time()}))
+        await writer.drain()
+        counter[0] += 1
+    # Соединение закрывается после замера, вместе с приёмниками
+    return reader, writer
+
+
+async def relay_scale(port, pid, senders, receivers, args, phrases):
+    ready = asyncio.Semaphore(0)
+    clients = [Receiver(i < args.probes) for i in range(receivers)]
+    tasks = [asyncio.create_task(c.run(port, ready)) for c in clients]
+    for _ in clients:
+        await ready.acquire()
+    await asyncio.sleep(0.5)
+
+    cpu_before, wall_before = proc_cpu(pid), time.monotonic()
+    sent = [0]
+    rss_peak = 0
+    sending = asyncio.gather(*(sender(port, i, phrases, args.rate, args.duration, sent)
+                               for i in range(senders)))
+    while not sending.done():
+        rss_peak = max(rss_peak, tree_status(pid)["rss_kb"])
+        await asyncio.sleep(0.2)
+    connections = sending.result()
+    send_s = time.monotonic() - wall_before
+
+    # Ждём, пока рассылка не перестанет расти: всё доставлено или отброшено
+    expected = sent[0] * receivers
+    delivered, quiet_since = -1, time.monotonic()
+    while time.monotonic() - quiet_since < 0.5 and time.monotonic() - wall_before < send_s + args.drain:
+        total = sum(c.frames for c in clients)
+        if total != delivered:
+            delivered, quiet_since = total, time.monotonic()
+        if delivered >= expected:
+            break
+        rss_peak = max(rss_peak, tree_status(pid)["rss_kb"])
+        await asyncio.sleep(0.05)
+    wall = time.monotonic() - wall_before
+    cpu = proc_cpu(pid) - cpu_before
+    status = tree_status(pid)
+
+    for _, writer in connections:
+        writer.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    samples = [ms for c in clients for ms in c.latencies]
+    return {
+        "senders": senders,
+        "receivers": receivers,
+        "sent": sent[0],
+        "delivered": delivered,
+        "lost": expected - delivered,
+        "send_rate_msg_s": round(sent[0] / send_s, 1),
+        "fanout_msg_s": round(delivered / wall, 1),
+        "fanout_latency_ms": percentiles(samples),
+        "latency_samples": len(samples),
+        "server_cpu_s": round(cpu, 3),
+        "server_cpu_pct": round(cpu / wall * 100, 1),
+        "server_rss_kb": status["rss_kb"],
+        "server_rss_peak_kb": max(rss_peak, status["rss_kb"]),
+        "server_threads": status["threads"],
+    }
+
+
+def run_relay(args):
+    phrases = load_phrases()
+    results = []
+    for engine, workers, scale in itertools.product(args.engine, args.workers, args.scales):
+        senders, receivers = (int(x) for x in scale.split("x"))
+        port = free_port()
+        # Лимит частоты отправителя (ratelimit.py) выключен: замеряем сам ретранслятор
+        server = start(["server.py", "--engine", engine, "--host", "127.0.0.1", "--port", str(port),
+                        "--workers", str(workers), "--sender-rate", "0", *args.server_args], port)
+        try:
+            # Воркеры поднимаются не одновременно: ждём, пока слушают все
+            time.sleep(0.5 if workers > 1 else 0)
+            result = asyncio.run(relay_scale(port, server.pid, senders, receivers, args, phrases))
+        finally:
+            stop(server)
+        result = {"engine": engine, "workers": workers, **result}
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        results.append(result)
+    return {"rate_per_sender": args.rate, "duration_s": args.duration, "probes": args.probes,
+            "results": results}
+
+
+# --- typing ------------------------------------------------------------------
+
+async def typing_run(port, lines, phrases, window, warmup):
+    # Отправитель с id и ts.sent; ответные ACK несут отметки всех этапов
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(protocol.hello("sender", channel=CHANNEL))
+    decoder = protocol.FrameDecoder()
+    acks = {}
+    lines_acked = 0  # ACK на строки замера, без пробных
+    got = asyncio.Event()
+
+    async def read_acks():
+        nonlocal lines_acked
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            for kind, payload in decoder.feed(data):
+                if kind == protocol.ACK:
+                    ack = protocol.decode_json(payload)
+                    msg_id = str(ack.get("id"))
+                    if msg_id.isdigit() and msg_id not in acks:
+                        lines_acked += 1
+                    acks[msg_id] = ack
+                    got.set()
+
+    reading = asyncio.create_task(read_acks())
+
+    def send(msg_id, text, kind):
+        writer.write(protocol.message(text, channel=CHANNEL, kind=kind, id=msg_id, ts={"sent": time.time()}))
+
+    if warmup:
+        # Приёмник подписывается не мгновенно: шлём пробную строку, пока не придёт ACK.
+        # У каждой попытки свой id - повтор с тем же id ретранслятор отбросит как дубль
+        deadline = time.monotonic() + 10
+        attempt = 0
+        while not any(k.startswith("warmup") for k in acks):
+            if time.monotonic() > deadline:
+                raise RuntimeError("приёмник не ответил на пробную строку")
+            send(f"warmup-{attempt}", "warmup", "phrase")
+            attempt += 1
+            await writer.drain()
+            try:
+                await asyncio.wait_for(got.wait(), 0.3)
+            except asyncio.TimeoutError:
+                pass
+            got.clear()
+
+    started = time.monotonic()
+    for n in range(lines):
+        # Не больше window строк без ACK: очередь ввода не растёт бесконечно
+        while n - lines_acked >= window:
+            got.clear()
+            await got.wait()
+        text, kind = phrases[n % len(phrases)]
+        # Номер в конце, чтобы одинаковые фразы не склеивались в очереди ввода
+        send(str(n), f"{text} [{n}]", kind)
+        await writer.drain()
+    deadline = time.monotonic() + 30
+    while lines_acked < lines and time.monotonic() < deadline:
+        got.clear()
+        try:
+            await asyncio.wait_for(got.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+    elapsed = time.monotonic() - started
+    reading.cancel()
+    writer.close()
+
+    stages, statuses = {}, {}
+    for msg_id, ack in acks.items():
+        if not msg_id.isdigit():
+            continue
+        statuses[ack.get("status")] = statuses.get(ack.get("status"), 0) + 1
+        for name, ms in latency.stage_durations(ack.get("ts") or {}).items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        "lines": lines,
+        "acked": sum(statuses.values()),
+        "statuses": statuses,
+        "lines_per_s": round(sum(statuses.values()) / elapsed, 1),
+        "stages_ms": {name: percentiles(values) for name, values in stages.items()},
+    }
+
+
+def run_typing(args):
+    phrases = load_phrases()
+    fake = ["--backend", "fake", "--rate", str(args.rate)]
+    results = []
+    if "main" in args.target:
+        port = free_port()
+        proc = start(["main.py", "--host", "127.0.0.1", "--port", str(port), "--pause", "0", *fake], port)
+        try:
+            result = asyncio.run(typing_run(port, args.lines, phrases, args.window, warmup=False))
+        finally:
+            stop(proc)
+        results.append({"target": "main", **result})
+    if "receiver" in args.target:
+        port = free_port()
+        server = start(["server.py", "--engine", args.engine[0], "--host", "127.0.0.1", "--port", str(port),
+                        "--sender-rate", "0"], port)
+        receiver = subprocess.Popen(
+            [sys.executable, "receiver_client.py", "--host", "127.0.0.1", "--port", str(port),
+             "--channel", CHANNEL, "--enter-delay", "0", *fake],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            result = asyncio.run(typing_run(port, args.lines, phrases, args.window, warmup=True))
+        finally:
+            stop(receiver)
+            stop(server)
+        results.append({"target": "receiver", "engine": args.engine[0], **result})
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+    return {"rate": args.rate, "window": args.window, "results": results}
+
+
+# --- compare -----------------------------------------------------------------
+
+def _numbers(obj, prefix=""):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _numbers(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix, obj
+
+
+def _key(result):
+    # Результаты сопоставляются по параметрам прогона, а не по порядку
+    return "/".join(str(result[k]) for k in ("target", "engine", "workers", "senders", "receivers") if k in result)
+
+
+def run_compare(args):
+    with open(args.old, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('version')} -> {new.get('version')}")
+    old_results = {_key(r): r for r in old.get("results", [])}
+    for result in new.get("results", []):
+        key = _key(result)
+        before = dict(_numbers(old_results.get(key, {})))
+        print(key)
+        for name, value in _numbers(result):
+            if name in before and before[name] and name not in ("workers", "senders", "receivers", "lines"):
+                change = (value - before[name]) / before[name] * 100
+                print(f"  {name}: {before[name]:g} -> {value:g} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    relay = sub.add_parser("relay", help="рассылка через server.py")
+    relay.add_argument("--engine", nargs="+", default=["threaded", "asyncio"])
+    relay.add_argument("--workers", nargs="+", type=int, default=[1], help="server.py --workers")
+    relay.add_argument("--scales", nargs="+", default=["1x10", "10x100", "10x500"],
+                       help="ОТПРАВИТЕЛИxПРИЁМНИКИ")
+    relay.add_argument("--rate", type=float, default=20, help="сообщений в секунду на отправителя")
+    relay.add_argument("--duration", type=float, default=5, help="секунд отправки")
+    relay.add_argument("--drain", type=float, default=10, help="сколько ждать доставки после отправки, с")
+    relay.add_argument("--probes", type=int, default=20, help="приёмников, замеряющих задержку")
+    relay.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                       help="остальные аргументы - server.py (например --queue-size 1024)")
+
+    typing = sub.add_parser("typing", help="ввод через main.py и receiver_client.py с --backend fake")
+    typing.add_argument("--target", nargs="+", choices=["main", "receiver"], default=["main", "receiver"])
+    typing.add_argument("--engine", nargs=1, default=["asyncio"])
+    typing.add_argument("--lines", type=int, default=200)
+    typing.add_argument("--rate", type=float, default=0, help="символов в секунду, 0 - без ограничения")
+    typing.add_argument("--window", type=int, default=20, help="строк без ACK одновременно")
+
+    compare = sub.add_parser("compare", help="сравнить два результата")
+    compare.add_argument("old")
+    compare.add_argument("new")
+
+    for p in (relay, typing):
+        p.add_argument("--out", help="записать JSON в файл, а не в stdout")
+    args = parser.parse_args(argv)
+
+    if args.mode == "compare":
+        run_compare(args)
+        return
+    report = run_relay(args) if args.mode == "relay" else run_typing(args)
+    report = {
+        "mode": args.mode,
+        "version": version(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **report,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
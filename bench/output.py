@@ -0,0 +1,65 @@
+"""Бэкенды вывода: сколько длится ввод одной реплики.
+
+Ввод идёт в FakeKeys/FakeClipboard, поэтому замер работает без окна и
+прав на ввод. Старый посимвольный ввод (main.py: пауза 0.5 с и 30 мс на
+символ) повторён для сравнения. Печатает JSON.
+
+    python bench/output.py --length 200
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import output  # noqa: E402
+
+
+def per_char(keys, text):
+    # Как было в main.py до бэкендов, без паузы 0.5 с перед вводом
+    for ch in text:
+        keys.write(ch)
+        time.sleep(0.03)
+    keys.send("enter")
+
+
+def measure(type_line, keys, text, lines):
+    started = time.perf_counter()
+    for _ in range(lines):
+        type_line(text)
+    elapsed = time.perf_counter() - started
+    assert keys.typed() in ("", text * lines)
+    return {
+        "line_ms": round(elapsed / lines * 1000, 1),
+        "chars_per_s": round(len(text) * lines / elapsed),
+        "key_calls_per_line": len(keys.events) // lines,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--length", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    text = ("Здравствуйте, я сотрудник полиции. Предъявите документы, пожалуйста. " * 10)[:args.length]
+    results = {}
+    keys = output.FakeKeys()
+    results["per_char_30ms"] = measure(lambda t: per_char(keys, t), keys, text, 1)
+    for rate in (output.RATE, 1000, 0):
+        keys = output.FakeKeys()
+        backend = output.KeystrokeBackend(keys, rate=rate)
+        results[f"keys_rate_{rate}"] = measure(backend.type_line, keys, text, args.lines)
+    keys = output.FakeKeys()
+    clipboard = output.FakeClipboard("старое")
+    backend = output.PasteBackend(keys, clipboard)
+    results["paste"] = measure(backend.type_line, keys, text, args.lines)
+    assert clipboard.paste() == "старое"
+    print(json.dumps({"length": len(text), **results}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Перезагрузка каталога на лету: правка одной категории в большом каталоге.
+
+Меняется первая фраза одной категории в середине дерева. Замеряется то,
+что делает фоновый поток CatalogWatcher: разбор JSON, затем либо сборка
+индекса целиком и catalog.diff (первая перезагрузка, форматы поменялись),
+либо CatalogIndex.patched по сохранённому дереву. Печатает JSON.
+
+    python bench/reload.py --phrases 100000
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import catalog  # noqa: E402
+from synthetic import make_catalog  # noqa: E402
+
+
+def categories(node):
+    if node.get(catalog.PHRASES_KEY):
+        yield node
+    for key, value in node.items():
+        if key not in catalog.LEAF_KEYS and isinstance(value, dict):
+            yield from categories(value)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phrases", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    tree, formats = make_catalog(args.phrases, seed=args.seed)
+    index = catalog.CatalogIndex(tree, formats)
+    edited = json.loads(json.dumps(tree))
+    nodes = list(categories(edited))
+    nodes[len(nodes) // 2][catalog.PHRASES_KEY][0] += " (правка)"
+    text = json.dumps(edited, ensure_ascii=False)
+
+    parsed, parse_s = timed(lambda: json.loads(text), args.repeat)
+    _, full_s = timed(lambda: catalog.diff(index, catalog.CatalogIndex(parsed, formats)), args.repeat)
+    (_, changes), patch_s = timed(lambda: index.patched(tree, parsed, formats), args.repeat)
+
+    print(json.dumps({
+        "phrases": len(index),
+        "json_mb": round(len(text.encode("utf-8")) / 2**20, 1),
+        "changed_categories": len(changes.categories),
+        "parse_ms": round(parse_s * 1000, 1),
+        "full_rebuild_diff_ms": round(full_s * 1000, 1),
+        "patched_ms": round(patch_s * 1000, 1),
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Поиск по каталогу: построение индекса, время на нажатие клавиши, обновление.
+
+Запрос набирается по буквам (как в поле поиска), на каждом префиксе
+замеряется SearchIndex.search. Печатает JSON.
+
+    python bench/search.py --phrases 100000
+"""
+import argparse
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import catalog  # noqa: E402
+import search  # noqa: E402
+from synthetic import make_catalog  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phrases", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    tree, formats = make_catalog(args.phrases, seed=args.seed)
+    index = catalog.CatalogIndex(tree, formats)
+
+    started = time.perf_counter()
+    engine = search.SearchIndex()
+    for entry in index.entries.values():
+        engine.add(entry.id, entry.text)
+    build_s = time.perf_counter() - started
+    # Как в клиенте: объекты загруженного каталога убираем из-под сборщика мусора
+    gc.freeze()
+
+    rng = random.Random(args.seed)
+    entries = list(index.entries.values())
+    keystrokes = []
+    for _ in range(args.queries):
+        text = rng.choice(entries).text
+        start = rng.randrange(0, max(1, len(text) - 12))
+        query = text[start:start + 12]
+        for i in range(1, len(query) + 1):
+            t = time.perf_counter()
+            engine.search(query[:i])
+            keystrokes.append(time.perf_counter() - t)
+
+    # Инкрементальное обновление: правим одну категорию из 20 фраз
+    path = next(p for p, ids in index.categories.items() if ids)
+    texts = {e.id: e.text for e in index.entries.values()}
+    changed = dict(texts)
+    for entry in index.category(path):
+        del changed[entry.id]
+        changed[entry.id + "-new"] = entry.text + " изменено"
+    removed = texts.keys() - changed.keys()
+    added = changed.keys() - texts.keys()
+    started = time.perf_counter()
+    for doc_id in removed:
+        engine.remove(doc_id)
+    for doc_id in added:
+        engine.add(doc_id, changed[doc_id])
+    update_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({
+        "phrases": len(engine),
+        "build_s": round(build_s, 2),
+        "keystrokes": len(keystrokes),
+        "keystroke_p50_ms": round(statistics.median(keystrokes) * 1000, 3),
+        "keystroke_p99_ms": round(percentile(keystrokes, 0.99) * 1000, 3),
+        "keystroke_max_ms": round(max(keystrokes) * 1000, 3),
+        "update_category_ms": round(update_ms, 3),
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
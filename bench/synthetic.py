@@ -0,0 +1,81 @@
+"""Синтетический каталог реплик для замеров.
+
+Словарь - слова из rp.json плюс псевдослова, склеенные из их начал и концов,
+частоты по закону Ципфа, как в живом тексте. Дерево - четыре уровня
+категорий, как в настоящем каталоге, в листьях "Фразы" и "/me".
+"""
+import itertools
+import json
+import random
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PHRASES_PER_CATEGORY = 20
+VOCABULARY_SIZE = 30000
+
+
+def _words(node, out):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            _words(key, out)
+            _words(value, out)
+    elif isinstance(node, list):
+        for value in node:
+            _words(value, out)
+    elif isinstance(node, str):
+        out.extend(w.strip(".,!?—:") for w in node.split() if not w.startswith("{"))
+    return out
+
+
+def base_words(path=ROOT / "rp.json"):
+    with open(path, "r", encoding="utf-8") as f:
+        words = _words(json.load(f), [])
+    return sorted({w for w in words if len(w) > 1})
+
+
+def vocabulary(size=VOCABULARY_SIZE, seed=1):
+    rng = random.Random(seed)
+    base = base_words()
+    words = list(base)
+    seen = set(words)
+    while len(words) < size:
+        a, b = rng.choice(base), rng.choice(base)
+        word = a[:rng.randint(2, max(2, len(a) - 1))] + b[rng.randint(1, max(1, len(b) - 2)):]
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    rng.shuffle(words)
+    return words
+
+
+def make_catalog(phrases, seed=1, fanout=10, per_category=PHRASES_PER_CATEGORY):
+    # Возвращает (дерево фраз, дерево форматов) примерно на `phrases` фраз
+    rng = random.Random(seed)
+    words = vocabulary(seed=seed)
+    # Частота слова обратно пропорциональна его рангу
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+
+    def sentence(low, high):
+        return " ".join(rng.choices(words, cum_weights=weights, k=rng.randint(low, high)))
+
+    categories = max(1, phrases // per_category)
+    tree = {}
+    formats = {}
+    for n in range(categories):
+        path = []
+        rest = n
+        for _ in range(4):
+            path.append(f"Категория {rest % fanout}")
+            rest //= fanout
+        path[-1] = f"{path[-1]} #{n}"
+        node = tree
+        fmt = formats
+        for key in path:
+            node = node.setdefault(key, {})
+            fmt = fmt.setdefault(key, {})
+        node["Фразы"] = [sentence(3, 9) + "." for _ in range(per_category * 3 // 4)]
+        node["/me"] = [sentence(2, 6) for _ in range(per_category // 4)]
+        fmt["prefix"] = ""
+        fmt["suffix"] = ""
+        fmt["/me"] = {"prefix": "*", "suffix": "*"}
+    return tree, formats
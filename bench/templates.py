@@ -0,0 +1,104 @@
+"""Микробенчмарк отрисовки всего каталога фраз.
+
+Сравнивает старую подстановку из flet.py (цепочка str.replace + цикл по всем
+ключам конфига) с компилированными шаблонами templates.py: без кэша
+(каждый раз проход по токенам) и с кэшем Renderer (профиль не менялся).
+
+    python bench/templates.py --catalog rp.json --copies 100
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import templates  # noqa: E402
+
+PROFILE = {
+    "org": "Полиция",
+    "rang": "Офицер",
+    "name": "Анна",
+    "server_ip": "109.73.204.176",
+    "channel": "general",
+    "declension": "nominative",
+}
+
+
+def collect(node, out):
+    if isinstance(node, dict):
+        for value in node.values():
+            collect(value, out)
+    elif isinstance(node, list):
+        for value in node:
+            collect(value, out)
+    elif isinstance(node, str):
+        out.append(node)
+    return out
+
+
+def render_replace(text, config):
+    # Как было в flet.py до компиляции шаблонов
+    text = text.replace("{org}", config["org"]).replace("{rang}", config["rang"]).replace("{name}", config["name"])
+    for key, val in config.items():
+        text = text.replace("{" + key + "}", val)
+    return text
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", default=str(ROOT / "rp.json"))
+    parser.add_argument("--copies", type=int, default=100,
+                        help="во сколько раз размножить каталог (фразы делаются уникальными)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with open(args.catalog, "r", encoding="utf-8") as f:
+        base = collect(json.load(f), [])
+    phrases = [f"{text} #{i}" for i in range(args.copies) for text in base]
+
+    started = time.perf_counter()
+    renderer = templates.Renderer(PROFILE)
+    for text in phrases:
+        renderer.compile(text)
+    compile_s = time.perf_counter() - started
+    lookup = renderer.lookup
+    compiled = [renderer.compile(text) for text in phrases]
+
+    def replace_all():
+        for text in phrases:
+            render_replace(text, PROFILE)
+
+    def compiled_all():
+        for template in compiled:
+            template.render(lookup)
+
+    def cached_all():
+        for text in phrases:
+            renderer.render(text)
+
+    cached_all()  # прогрев кэша под текущий профиль
+    results = {
+        "phrases": len(phrases),
+        "compile_ms": round(compile_s * 1000, 2),
+        "replace_ms": round(best_of(replace_all, args.repeat) * 1000, 2),
+        "compiled_ms": round(best_of(compiled_all, args.repeat) * 1000, 2),
+        "cached_ms": round(best_of(cached_all, args.repeat) * 1000, 2),
+    }
+    print(json.dumps(results, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
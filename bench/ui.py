@@ -0,0 +1,125 @@
+"""Вкладка реплик клиента на большом каталоге: запуск и переключение категорий.
+
+Клиент (flet.py или его старая версия через --client) запускается без экрана
+(QT_QPA_PLATFORM=offscreen) в temp-каталоге с синтетическими rp_phrases.json
+и formats.json. Запуск - от конструктора RPClient до первой отрисовки окна, отдельно -
+populate_phrases (заполнение дерева); переключение - клик по категории и
+обработка событий до отрисовки списка.
+Печатает JSON.
+
+    python bench/ui.py --phrases 100000
+    git show HEAD~1:flet.py > /tmp/flet_old.py && python bench/ui.py --client /tmp/flet_old.py
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QModelIndex  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from synthetic import make_catalog  # noqa: E402
+
+
+def load_client(path):
+    spec = importlib.util.spec_from_file_location("flet", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_index(model, path):
+    # Одинаково для QTreeWidget и ленивой модели: идём по строкам, дотягивая детей
+    index = QModelIndex()
+    for key in path:
+        while model.canFetchMore(index):
+            model.fetchMore(index)
+        for row in range(model.rowCount(index)):
+            child = model.index(row, 0, index)
+            if child.data() == key:
+                index = child
+                break
+        else:
+            raise KeyError(path)
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--client", default=str(ROOT / "flet.py"))
+    parser.add_argument("--phrases", type=int, default=100000)
+    parser.add_argument("--per-category", type=int, default=20)
+    parser.add_argument("--switches", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    client_path = Path(args.client).resolve()
+    tree, formats = make_catalog(args.phrases, seed=args.seed, per_category=args.per_category)
+    workdir = tempfile.mkdtemp(prefix="rp-ui-")
+    os.chdir(workdir)
+    with open("rp_phrases.json", "w", encoding="utf-8") as f:
+        json.dump(tree, f, ensure_ascii=False)
+    with open("formats.json", "w", encoding="utf-8") as f:
+        json.dump(formats, f, ensure_ascii=False)
+    # Недоступный адрес: автоподключение сразу получает отказ
+    with open("rp_config.json", "w", encoding="utf-8") as f:
+        json.dump({"org": "Полиция", "rang": "Офицер", "name": "Анна",
+                   "server_ip": "127.0.0.1", "server_port": 1}, f, ensure_ascii=False)
+
+    app = QApplication.instance() or QApplication([])
+    flet = load_client(client_path)
+
+    started = time.perf_counter()
+    client = flet.RPClient()
+    client.send_message = lambda text: None
+    client.show()
+    app.processEvents()
+    startup_s = time.perf_counter() - started
+
+    # Отдельно - только заполнение дерева и списка, без загрузки каталога
+    started = time.perf_counter()
+    client.populate_phrases()
+    app.processEvents()
+    populate_ms = (time.perf_counter() - started) * 1000
+
+    # Поисковый индекс строится в фоне; ждём, чтобы он не делил с замером GIL
+    while getattr(client, "search_index", True) is None:
+        time.sleep(0.05)
+
+    rng = random.Random(args.seed)
+    paths = [p for p, ids in client.catalog.categories.items() if ids]
+    view = client.phrases_tree
+    switches = []
+    for _ in range(args.switches):
+        index = find_index(view.model(), rng.choice(paths))
+        app.processEvents()
+        started = time.perf_counter()
+        view.clicked.emit(index)
+        app.processEvents()
+        switches.append(time.perf_counter() - started)
+    # Как при закрытии окна пользователем: поток сети останавливается
+    client.close()
+
+    print(json.dumps({
+        "client": Path(args.client).name,
+        "phrases": len(client.catalog),
+        "categories": len(paths),
+        "startup_s": round(startup_s, 3),
+        "populate_ms": round(populate_ms, 1),
+        "switch_p50_ms": round(statistics.median(switches) * 1000, 2),
+        "switch_max_ms": round(max(switches) * 1000, 2),
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Шина между процессами-воркерами ретранслятора.
+
+В многопроцессном режиме воркеры принимают соединения на одном порту
+(SO_REUSEPORT), и отправитель может оказаться в одном процессе, а его
+приёмники - в другом. Каждый воркер слушает Unix-сокет SOCK_DGRAM в общем
+каталоге. Кадр, разосланный своим подписчикам, уходит и остальным
+воркерам, а они раскладывают его по своим. Датаграмма Unix-сокета приходит
+целиком, в порядке отправки и без потерь, поэтому разбор - просто нарезка
+записей.
+
+Рассылка только кладёт запись в очередь; отдельный поток склеивает
+накопившиеся записи в датаграммы до MAX_DATAGRAM байт, по одной на воркера,
+так что при нагрузке системный вызов приходится на пачку сообщений.
+
+ACK возвращается адресно: у пересланной записи есть номер воркера-источника,
+и маршрут ACK в другом воркере указывает на него (WorkerPeer).
+"""
+import os
+import socket
+import struct
+import threading
+from collections import deque
+
+# Запись: тип, воркер-источник, длина канала, длина id, длина кадра
+RECORD = struct.Struct(">BHBBI")
+PUB = 1  # кадр для подписчиков канала
+ACK = 2  # кадр ACK для отправителя в воркере-получателе
+
+MAX_DATAGRAM = 64 * 1024
+QUEUE_SIZE = 10000  # записей в очереди на отправку; сверх - выбрасываются самые старые
+SOCKET_BUFFER = 4 * 1024 * 1024
+
+
+def socket_path(directory, index):
+    return os.path.join(directory, f"worker-{index}.sock")
+
+
+def encode_record(kind, origin, channel, msg_id, frame):
+    channel = channel.encode("utf-8")
+    msg_id = (msg_id or "").encode("utf-8")
+    if len(channel) > 255 or len(msg_id) > 255:
+        # Канал длиннее не пропустит channel_name, id без маршрута - просто без ACK
+        msg_id = b""
+    return RECORD.pack(kind, origin, len(channel), len(msg_id), len(frame)) + channel + msg_id + frame
+
+
+def decode_records(data):
+    pos = 0
+    while pos < len(data):
+        kind, origin, channel_len, id_len, frame_len = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        channel = data[pos:pos + channel_len].decode("utf-8")
+        pos += channel_len
+        msg_id = data[pos:pos + id_len].decode("utf-8") or None
+        pos += id_len
+        frame = data[pos:pos + frame_len]
+        pos += frame_len
+        yield kind, origin, channel, msg_id, frame
+
+
+class Bus:
+    def __init__(self, directory, index, count, deliver):
+        # deliver(тип, воркер-источник, канал, id, кадр) вызывается из читателя шины
+        self.index = index
+        self.paths = [socket_path(directory, i) for i in range(count)]
+        self.deliver = deliver
+        self.pending = deque()  # (номер воркера или None - всем, запись)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.stats = {"records_out": 0, "records_in": 0, "datagrams_out": 0, "dropped": 0}
+
+        path = self.paths[index]
+        if os.path.exists(path):
+            os.unlink(path)  # остался от упавшего воркера с тем же номером
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        self.sock.bind(path)
+        self.out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.out.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def publish(self, channel, frame, msg_id=None):
+        self._put(None, encode_record(PUB, self.index, channel, msg_id, frame))
+
+    def send_ack(self, worker, msg_id, frame):
+        self._put(worker, encode_record(ACK, self.index, "", msg_id, frame))
+
+    def _put(self, target, record):
+        if len(record) > MAX_DATAGRAM:
+            # Обычная реплика - сотни байт; такой кадр остаётся в своём воркере
+            self.stats["dropped"] += 1
+            return
+        with self.cond:
+            if len(self.pending) >= QUEUE_SIZE:
+                self.pending.popleft()
+                self.stats["dropped"] += 1
+            self.pending.append((target, record))
+            self.cond.notify()
+
+    def write_loop(self):
+        peers = [i for i in range(len(self.paths)) if i != self.index]
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                batch = list(self.pending)
+                self.pending.clear()
+            outgoing = {}
+            for target, record in batch:
+                for peer in (peers if target is None else (target,)):
+                    outgoing.setdefault(peer, []).append(record)
+            for peer, records in outgoing.items():
+                self._send(peer, records)
+
+    def _send(self, peer, records):
+        datagram = []
+        size = 0
+        for record in records + [None]:
+            if record is None or size + len(record) > MAX_DATAGRAM:
+                if datagram:
+                    try:
+                        # Блокирующая отправка: если воркер не успевает читать,
+                        # ждём его, а копится очередь шины, а не память ядра
+                        self.out.sendto(b"".join(datagram), self.paths[peer])
+                        self.stats["datagrams_out"] += 1
+                        self.stats["records_out"] += len(datagram)
+                    except OSError:
+                        # Воркер перезапускается: его подписчики всё равно отключились
+                        self.stats["dropped"] += len(datagram)
+                datagram, size = [], 0
+            if record is not None:
+                datagram.append(record)
+                size += len(record)
+
+    def _dispatch(self, data):
+        for record in decode_records(data):
+            self.stats["records_in"] += 1
+            self.deliver(*record)
+
+    def start_reader(self, loop=None):
+        # С циклом asyncio читаем в нём же (приёмники asyncio не потокобезопасны),
+        # иначе - в своём потоке
+        if loop is not None:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock.fileno(), self.read_ready)
+        else:
+            threading.Thread(target=self.read_loop, daemon=True).start()
+
+    def read_ready(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            self._dispatch(data)
+
+    def read_loop(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except OSError:
+                return
+            self._dispatch(data)
+
+    def depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.sock.close()
+        self.out.close()
+
+
+class WorkerPeer:
+    # Отправитель в другом воркере, как его видит AckRouter: push() шлёт ACK по шине
+    __slots__ = ("bus", "worker", "msg_id")
+
+    def __init__(self, bus, worker, msg_id):
+        self.bus = bus
+        self.worker = worker
+        self.msg_id = msg_id
+
+    def push(self, data) -> bool:
+        self.bus.send_ack(self.worker, self.msg_id, data)
+        return True
@@ -0,0 +1,249 @@
+"""Плоский индекс каталога реплик.
+
+Строится один раз из дерева фраз (rp.json) и дерева форматов (format.json).
+Каждая фраза получает стабильный ID, вид (phrase или me) и уже разрешённые
+prefix/suffix, так что выбор категории и отправка - это поиск в словаре,
+а не обход деревьев на каждый клик.
+
+Наследование форматов: prefix и suffix берутся из самого глубокого узла
+format.json на пути фразы, где они заданы. Для /me ищется ключ "/me" на
+любом уровне пути, поэтому "/me" из "Работа/РП остановка" действует и на
+/me всех её подкатегорий. Обычные форматы на /me не распространяются.
+
+diff() сравнивает старый и новый индекс при перезагрузке файлов: какие
+категории и списки подкатегорий поменялись и какие ID фраз появились или
+исчезли - чтобы обновить только их.
+"""
+import hashlib
+
+PHRASES_KEY = "Фразы"
+ME_KEY = "/me"
+LEAF_KEYS = (PHRASES_KEY, ME_KEY)
+
+KIND_PHRASE = "phrase"
+KIND_ME = "me"
+
+
+class Entry:
+    __slots__ = ("id", "path", "kind", "text", "prefix", "suffix")
+
+    def __init__(self, id, path, kind, text, prefix, suffix):
+        self.id = id
+        self.path = path
+        self.kind = kind
+        self.text = text
+        self.prefix = prefix
+        self.suffix = suffix
+
+
+def phrase_id(path, kind, text, n=0):
+    key = "\x1f".join((*path, kind, text, str(n)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _merge_format(current, node):
+    if not isinstance(node, dict):
+        return current
+    prefix = node.get("prefix")
+    suffix = node.get("suffix")
+    return (
+        prefix if isinstance(prefix, str) else current[0],
+        suffix if isinstance(suffix, str) else current[1],
+    )
+
+
+def resolve_formats(formats, path):
+    # (prefix, suffix) для обычных фраз и для /me по пути категории
+    speech = ("", "")
+    me = ("", "")
+    node = formats
+    for key in path:
+        if not isinstance(node, dict):
+            node = None
+            break
+        me = _merge_format(me, node.get(ME_KEY))
+        node = node.get(key)
+        speech = _merge_format(speech, node)
+    if isinstance(node, dict):
+        me = _merge_format(me, node.get(ME_KEY))
+    return speech, me
+
+
+class CatalogIndex:
+    def __init__(self, phrases=None, formats=None):
+        self.entries = {}  # id -> Entry
+        self.categories = {}  # путь категории -> [id фраз]
+        self.children = {(): []}  # путь категории -> [имена подкатегорий]
+        self.build(phrases or {}, formats or {})
+
+    def build(self, phrases, formats):
+        self.entries.clear()
+        self.categories.clear()
+        self.children = {(): []}
+        self._add_node(phrases, (), formats)
+
+    def _add_node(self, node, path, formats):
+        if not isinstance(node, dict):
+            return
+        self._add_entries(node, path, formats)
+        self.children[path] = []
+        for key, value in node.items():
+            if key in LEAF_KEYS or not isinstance(value, dict):
+                continue
+            self.children[path].append(key)
+            self._add_node(value, path + (key,), formats)
+
+    def _add_entries(self, node, path, formats):
+        ids = []
+        speech, me = resolve_formats(formats, path)
+        for kind, key, fmt in ((KIND_PHRASE, PHRASES_KEY, speech), (KIND_ME, ME_KEY, me)):
+            texts = node.get(key)
+            if not isinstance(texts, list):
+                continue
+            seen = {}
+            for text in texts:
+                if not isinstance(text, str):
+                    continue
+                # Одинаковые строки в одной категории различаем порядковым номером
+                n = seen[text] = seen.get(text, -1) + 1
+                entry = Entry(phrase_id(path, kind, text, n), path, kind, text, fmt[0], fmt[1])
+                self.entries[entry.id] = entry
+                ids.append(entry.id)
+        self.categories[path] = ids
+
+    def patched(self, old_phrases, phrases, formats):
+        # Индекс для изменённого дерева фраз при тех же форматах: поддеревья,
+        # равные в old_phrases и phrases, не пересобираются. Возвращает
+        # (индекс, CatalogDiff); этот индекс не меняется - его читает окно,
+        # поэтому списки в новом заменяются, а не правятся на месте
+        if not isinstance(old_phrases, dict) or not isinstance(phrases, dict):
+            index = CatalogIndex(phrases, formats)
+            return index, diff(self, index)
+        index = CatalogIndex()
+        index.entries = dict(self.entries)
+        index.categories = dict(self.categories)
+        index.children = dict(self.children)
+        changes = CatalogDiff()
+        index._patch_node(old_phrases, phrases, (), formats, changes)
+        return index, changes
+
+    def _patch_node(self, old, node, path, formats, changes):
+        if old == node:
+            return
+        if any(old.get(key) != node.get(key) for key in LEAF_KEYS):
+            old_ids = self.categories.get(path, ())
+            for entry_id in old_ids:
+                del self.entries[entry_id]
+            self._add_entries(node, path, formats)
+            before = set(old_ids)
+            after = set(self.categories[path])
+            changes.categories.add(path)
+            changes.added.extend(i for i in self.categories[path] if i not in before)
+            changes.removed.extend(i for i in old_ids if i not in after)
+        old_names = _child_names(old)
+        names = _child_names(node)
+        if old_names != names:
+            self.children[path] = names
+            changes.children.append(path)
+            kept = set(names)
+            for name in old_names:
+                if name not in kept:
+                    self._remove_node(path + (name,), changes)
+        known = set(old_names)
+        for name in names:
+            child = path + (name,)
+            if name in known:
+                self._patch_node(old[name], node[name], child, formats, changes)
+            else:
+                self._add_node(node[name], child, formats)
+                self._collect(child, changes)
+
+    def _remove_node(self, path, changes):
+        changes.removed.extend(self.categories.get(path, ()))
+        for entry_id in self.categories.pop(path, ()):
+            del self.entries[entry_id]
+        for name in self.children.pop(path, ()):
+            self._remove_node(path + (name,), changes)
+
+    def _collect(self, path, changes):
+        # Новое поддерево: все его категории и фразы - в разницу
+        ids = self.categories.get(path, ())
+        if ids:
+            changes.categories.add(path)
+            changes.added.extend(ids)
+        for name in self.children.get(path, ()):
+            self._collect(path + (name,), changes)
+
+    def category(self, path):
+        return [self.entries[i] for i in self.categories.get(tuple(path), ())]
+
+    def get(self, entry_id):
+        return self.entries.get(entry_id)
+
+    def texts(self):
+        # (ID, текст) всех фраз - для поискового индекса
+        return ((entry.id, entry.text) for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _child_names(node):
+    return [key for key, value in node.items() if key not in LEAF_KEYS and isinstance(value, dict)]
+
+
+class CatalogDiff:
+    def __init__(self):
+        self.children = []  # пути, у которых поменялся список подкатегорий, сверху вниз
+        self.categories = set()  # пути, где поменялись фразы или их prefix/suffix
+        self.added = []  # ID новых фраз
+        self.removed = []  # ID исчезнувших фраз
+
+    def __bool__(self):
+        return bool(self.children or self.categories)
+
+
+def _walk(index):
+    # Все пути категорий в порядке обхода в ширину
+    paths = [()]
+    for path in paths:
+        paths.extend(path + (name,) for name in index.children.get(path, ()))
+    return paths
+
+
+def _same_formats(old, new, ids):
+    # prefix/suffix общие на категорию и вид: фразы идут первыми, /me последними
+    for entry_id in {ids[0], ids[-1]}:
+        a, b = old.get(entry_id), new.get(entry_id)
+        if (a.prefix, a.suffix) != (b.prefix, b.suffix):
+            return False
+    return True
+
+
+def diff(old, new) -> CatalogDiff:
+    # Разница двух индексов (CatalogIndex или скомпилированного кэша). ID фразы
+    # зависит от пути и текста, поэтому сравниваются списки ID по категориям
+    changes = CatalogDiff()
+    old_paths = _walk(old)
+    known = set(old_paths)
+    new_paths = _walk(new)
+    for path in new_paths:
+        new_ids = list(new.categories.get(path, ()))
+        old_ids = []
+        if path in known:
+            if list(old.children.get(path, ())) != list(new.children.get(path, ())):
+                changes.children.append(path)
+            old_ids = list(old.categories.get(path, ()))
+        if old_ids != new_ids:
+            changes.categories.add(path)
+            before = set(old_ids)
+            after = set(new_ids)
+            changes.added.extend(i for i in new_ids if i not in before)
+            changes.removed.extend(i for i in old_ids if i not in after)
+        elif new_ids and not _same_formats(old, new, new_ids):
+            changes.categories.add(path)
+    alive = set(new_paths)
+    for path in old_paths:
+        if path not in alive:
+            changes.removed.extend(old.categories.get(path, ()))
+    return changes
@@ -0,0 +1,398 @@
+"""Скомпилированный каталог реплик: бинарный файл, который читается через mmap.
+
+Разбор большого rp_phrases.json и сборка CatalogIndex занимают при запуске
+секунды. Здесь тот же индекс (ID, вид, уже разрешённые prefix/suffix)
+сохраняется в компактном виде, а запуск сводится к mmap файла: записи
+читаются по запросу, объекты Entry создаются только для показанных фраз.
+
+Раскладка (числа - в порядке байт машины, файл локальный):
+- заголовок HEADER: версия, порядок байт, SHA-256 обоих исходников вместе,
+  их размер и mtime, число строк/фраз/категорий и смещения секций;
+- таблица строк: смещения u32 и байты UTF-8 всех строк подряд;
+- фразы: по ENTRY_FIELDS u32 - текст, prefix, suffix (номера строк),
+  категория, вид; фразы категории идут подряд, в порядке каталога;
+- ID фраз u64 (16 hex-знаков phrase_id) в порядке фраз и отдельно
+  отсортированные ID с номерами фраз - для поиска двоичным делением;
+- категории в порядке обхода в ширину, по CATEGORY_FIELDS u32: родитель,
+  имя, первая фраза, число фраз, первая подкатегория, число подкатегорий.
+  Дети одной категории при таком обходе идут подряд.
+
+Файл пишется каждый раз под новым именем (rp_catalog.<время>.<pid>.bin),
+а читается самый новый: прежний может быть открыт через mmap окном, и в
+Windows его нельзя ни заменить, ни удалить. Старые версии удаляются после
+записи новой, а занятые - при следующей записи.
+
+Кэш действителен, если размер и mtime исходников совпадают с записанными,
+а если нет - если совпадает их хэш (файл скопировали или тронули). Иначе
+load() строит CatalogIndex из JSON, как раньше, а файл пересобирает в
+фоновом потоке - к следующему запуску. Так же, через read_sources() и
+compile_later(), каталог перечитывается при правке на лету (catalog_watch.py).
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import catalog
+
+CACHE_PATH = Path("rp_catalog.bin")
+MAGIC = b"RPCATLG\0"
+VERSION = 1
+BYTEORDER = {"little": 1, "big": 2}[sys.byteorder]
+# magic, версия, порядок байт, sha256, (размер, mtime_ns) фраз и форматов,
+# строк, фраз, категорий, смещения: таблица строк, байты строк, фразы, ID,
+# отсортированные ID, их номера фраз, категории
+HEADER = struct.Struct("=8sHH32s4q3I7Q")
+STAMPS_OFFSET = struct.calcsize("=8sHH32s")
+ENTRY_FIELDS = 5
+CATEGORY_FIELDS = 6
+KINDS = (catalog.KIND_PHRASE, catalog.KIND_ME)
+NO_PARENT = 0xFFFFFFFF
+
+
+def source_stamps(*paths):
+    # (размер, mtime_ns) каждого исходника; нет файла - (-1, -1)
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps += [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            stamps += [-1, -1]
+    return stamps
+
+
+def source_digest(*paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        # Длина перед содержимым: граница между файлами однозначна
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.digest()
+
+
+def cache_versions(cache_path=CACHE_PATH):
+    # Версии кэша рядом с cache_path, от новой к старой: [(путь, (время, pid))].
+    # Сам cache_path (файл до версий) - самый старый
+    cache_path = Path(cache_path)
+    versions = []
+    for path in cache_path.parent.glob(f"{cache_path.stem}.*{cache_path.suffix}"):
+        parts = path.name[len(cache_path.stem) + 1:-len(cache_path.suffix)].split(".")
+        if len(parts) == 2 and all(part.isdigit() for part in parts):
+            versions.append((path, tuple(map(int, parts))))
+    if cache_path.exists():
+        versions.append((cache_path, (-1, -1)))
+    versions.sort(key=lambda item: item[1], reverse=True)
+    return versions
+
+
+def remove_old_versions(cache_path, current):
+    # Версии старше current. Открытые через mmap в Windows не удаляются -
+    # уберутся после следующей записи
+    for path, version in cache_versions(cache_path):
+        if version < current:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def compile_index(index: catalog.CatalogIndex, cache_path, digest, stamps):
+    # Пишет индекс в новую версию кэша атомарно: сначала во временный файл,
+    # затем os.replace на ещё не занятое имя. Возвращает путь версии
+    strings = {}
+    table = array("I", [0])
+    data = bytearray()
+
+    def string(text):
+        number = strings.get(text)
+        if number is None:
+            number = strings[text] = len(strings)
+            data.extend(text.encode("utf-8"))
+            table.append(len(data))
+        return number
+
+    # Категории в порядке обхода в ширину: дети одного родителя подряд
+    order = [()]
+    parents = [NO_PARENT]
+    first_child = []
+    position = 0
+    while position < len(order):
+        parent = order[position]
+        first_child.append(len(order))
+        for name in index.children.get(parent, ()):
+            order.append(parent + (name,))
+            parents.append(position)
+        position += 1
+
+    entries = array("I")
+    ids = array("Q")
+    categories = array("I")
+    for n, path in enumerate(order):
+        members = index.categories.get(path, ())
+        children = index.children.get(path, ())
+        categories.extend((parents[n], string(path[-1] if path else ""), len(ids), len(members),
+                           first_child[n], len(children)))
+        for entry_id in members:
+            entry = index.entries[entry_id]
+            entries.extend((string(entry.text), string(entry.prefix), string(entry.suffix), n,
+                            KINDS.index(entry.kind)))
+            ids.append(int(entry.id, 16))
+    ranked = sorted(range(len(ids)), key=ids.__getitem__)
+    sorted_ids = array("Q", (ids[i] for i in ranked))
+    sorted_pos = array("I", ranked)
+
+    sections = [table.tobytes(), bytes(data), entries.tobytes(), ids.tobytes(),
+                sorted_ids.tobytes(), sorted_pos.tobytes(), categories.tobytes()]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        # Выравнивание по 8: memoryview.cast требует кратного смещения для Q
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+    header = HEADER.pack(MAGIC, VERSION, BYTEORDER, digest, *stamps,
+                         len(strings), len(ids), len(order), *offsets)
+
+    cache_path = Path(cache_path)
+    # Своё имя у каждого писателя: два клиента, запущенные разом, не пишут в один файл
+    tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    version = (time.time_ns(), os.getpid())
+    target = cache_path.with_name(f"{cache_path.stem}.{version[0]}.{version[1]}{cache_path.suffix}")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for offset, section in zip(offsets, sections):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(section)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+    remove_old_versions(cache_path, version)
+    return target
+
+
+class _LazyMap:
+    # Только get(): так индекс читают модели и окно (categories, children)
+    __slots__ = ("load", "cache")
+
+    def __init__(self, load):
+        self.load = load
+        self.cache = {}
+
+    def get(self, key, default=None):
+        value = self.cache.get(key)
+        if value is None:
+            value = self.load(key)
+            if value is None:
+                return default
+            self.cache[key] = value
+        return value
+
+
+class CompiledCatalog:
+    # Тот же интерфейс, что у catalog.CatalogIndex для окна и моделей:
+    # get, category, categories.get, children.get, texts, len
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (struct.error, ValueError, TypeError, IndexError):
+            self.mm.close()
+            raise ValueError(f"Повреждённый кэш каталога: {path}")
+        self._entries = {}  # номер фразы -> Entry, только для уже прочитанных
+        self._paths = {0: ()}
+        self._numbers = {(): 0}
+        self.categories = _LazyMap(self._category_ids)
+        self.children = _LazyMap(self._children)
+
+    def _parse(self):
+        (magic, version, byteorder, self.digest, *rest) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION or byteorder != BYTEORDER:
+            raise ValueError("чужой формат")
+        self.stamps = rest[:4]
+        n_strings, self.size, n_categories = rest[4:7]
+        offsets = rest[7:]
+        view = memoryview(self.mm)
+
+        def section(n, fmt, count):
+            size = array(fmt).itemsize * count
+            if offsets[n] + size > len(self.mm):
+                raise ValueError("обрезанный файл")
+            return view[offsets[n]:offsets[n] + size].cast(fmt)
+
+        self.table = section(0, "I", n_strings + 1)
+        self.data = view[offsets[1]:offsets[1] + self.table[n_strings]]
+        self.entry_fields = section(2, "I", self.size * ENTRY_FIELDS)
+        self.ids = section(3, "Q", self.size)
+        self.sorted_ids = section(4, "Q", self.size)
+        self.sorted_pos = section(5, "I", self.size)
+        self.category_fields = section(6, "I", n_categories * CATEGORY_FIELDS)
+
+    def string(self, n):
+        return str(self.data[self.table[n]:self.table[n + 1]], "utf-8")
+
+    def _category(self, n):
+        base = n * CATEGORY_FIELDS
+        return self.category_fields[base:base + CATEGORY_FIELDS]
+
+    def _path(self, n):
+        path = self._paths.get(n)
+        if path is None:
+            parent, name = self._category(n)[:2]
+            path = self._paths[n] = self._path(parent) + (self.string(name),)
+            self._numbers[path] = n
+        return path
+
+    def _number(self, path):
+        # Номер категории по пути: спускаемся от корня по именам детей
+        path = tuple(path)
+        n = self._numbers.get(path)
+        if n is None and path:
+            parent = self._number(path[:-1])
+            if parent is None:
+                return None
+            _, _, _, _, first, count = self._category(parent)
+            for child in range(first, first + count):
+                self._path(child)
+            n = self._numbers.get(path)
+        return n
+
+    def _entry(self, i):
+        entry = self._entries.get(i)
+        if entry is None:
+            base = i * ENTRY_FIELDS
+            text, prefix, suffix, category, kind = self.entry_fields[base:base + ENTRY_FIELDS]
+            entry = self._entries[i] = catalog.Entry(
+                f"{self.ids[i]:016x}", self._path(category), KINDS[kind],
+                self.string(text), self.string(prefix), self.string(suffix))
+        return entry
+
+    def _category_ids(self, path):
+        n = self._number(path)
+        if n is None:
+            return None
+        _, _, first, count, _, _ = self._category(n)
+        return [f"{self.ids[i]:016x}" for i in range(first, first + count)]
+
+    def _children(self, path):
+        n = self._number(path)
+        if n is None:
+            return None
+        _, _, _, _, first, count = self._category(n)
+        return [self._path(child)[-1] for child in range(first, first + count)]
+
+    def get(self, entry_id):
+        try:
+            key = int(entry_id, 16)
+        except (TypeError, ValueError):
+            return None
+        pos = bisect.bisect_left(self.sorted_ids, key)
+        if pos == self.size or self.sorted_ids[pos] != key:
+            return None
+        return self._entry(self.sorted_pos[pos])
+
+    def category(self, path):
+        n = self._number(path)
+        if n is None:
+            return []
+        _, _, first, count, _, _ = self._category(n)
+        return [self._entry(i) for i in range(first, first + count)]
+
+    def texts(self):
+        # (ID, текст) всех фраз - для поискового индекса; Entry не создаются
+        fields = self.entry_fields
+        for i in range(self.size):
+            yield f"{self.ids[i]:016x}", self.string(fields[i * ENTRY_FIELDS])
+
+    def __len__(self):
+        return self.size
+
+
+def _read_json(path, strict):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        if strict:
+            raise
+        print(f"Ошибка загрузки {path}: {e}")
+        return {}
+
+
+def open_cache(phrases_path, formats_path, cache_path=CACHE_PATH):
+    # CompiledCatalog из самой новой версии кэша, если она совпадает с
+    # исходниками, иначе None
+    versions = cache_versions(cache_path)
+    if not versions:
+        return None
+    cache_path = versions[0][0]
+    try:
+        compiled = CompiledCatalog(cache_path)
+    except (OSError, ValueError):
+        return None
+    stamps = source_stamps(phrases_path, formats_path)
+    if list(compiled.stamps) == stamps:
+        return compiled
+    if source_digest(phrases_path, formats_path) != compiled.digest:
+        return None
+    # Содержимое то же (файл скопировали или тронули): обновляем отметки,
+    # чтобы следующий запуск обошёлся без хэша
+    try:
+        with open(cache_path, "r+b") as f:
+            f.seek(STAMPS_OFFSET)
+            f.write(struct.pack("=4q", *stamps))
+    except OSError:
+        pass
+    return compiled
+
+
+def load(phrases_path, formats_path, cache_path=CACHE_PATH):
+    # Каталог для окна: из кэша или, если он устарел, из JSON - тогда кэш
+    # пересобирается в фоне. Возвращает (каталог, из кэша ли)
+    compiled = open_cache(phrases_path, formats_path, cache_path)
+    if compiled is not None:
+        return compiled, True
+    stamps, phrases, formats = read_sources(phrases_path, formats_path)
+    index = catalog.CatalogIndex(phrases, formats)
+    compile_later(index, phrases_path, formats_path, stamps, cache_path)
+    return index, False
+
+
+def read_sources(phrases_path, formats_path, strict=False):
+    # (отметки, дерево фраз, дерево форматов). strict - ошибка чтения или
+    # разбора (файл сохранён наполовину) бросает исключение, а не даёт пустой
+    # каталог: так перезагрузка на лету оставляет прежний.
+    # Отметки - до чтения JSON: если файл поменяют, пока читаем, кэш не совпадёт
+    stamps = source_stamps(phrases_path, formats_path)
+    return stamps, _read_json(phrases_path, strict), _read_json(formats_path, strict)
+
+
+def compile_later(index, phrases_path, formats_path, stamps, cache_path=CACHE_PATH):
+    # Запись кэша в фоновом потоке; index построен из исходников с этими отметками
+    def run():
+        digest = source_digest(phrases_path, formats_path)
+        if source_stamps(phrases_path, formats_path) != stamps:
+            return  # исходники поменялись во время сборки - соберём в следующий раз
+        try:
+            compile_index(index, cache_path, digest, stamps)
+        except OSError as e:
+            print(f"Не удалось записать кэш каталога {cache_path}: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,234 @@
+"""Qt-модели поверх CatalogIndex для дерева категорий и списка реплик.
+
+Элементы не создаются заранее: дерево отдаёт детей узла только когда вид
+их запросил (раскрытие узла, fetchMore), список отдаёт строки по запросу
+вида порциями по FETCH_BATCH. Данные берутся прямо из индекса каталога.
+
+При перезагрузке каталога дерево не сбрасывается: patch() переставляет
+только строки узлов, у которых поменялись подкатегории, поэтому раскрытые
+ветки и выделение остаются на месте.
+"""
+import difflib
+
+from PySide6.QtCore import QAbstractItemModel, QAbstractListModel, QModelIndex, Qt
+
+import catalog
+
+FETCH_BATCH = 500
+
+
+class CategoryTreeModel(QAbstractItemModel):
+    def __init__(self, index: catalog.CatalogIndex, parent=None):
+        super().__init__(parent)
+        self.catalog = index
+        self._patching = {}  # путь -> список подкатегорий, пока его правит patch
+        self.reset()
+
+    def reset(self):
+        self.beginResetModel()
+        # Узлу дерева нужен целочисленный id для QModelIndex; выдаём его при первой выдаче узла
+        self._paths = [()]
+        self._ids = {(): 0}
+        self._rows = {0: 0}  # id узла -> его номер строки у родителя
+        self._fetched = {}  # id узла -> сколько детей уже отдано виду
+        self.endResetModel()
+
+    def _children(self, path):
+        children = self._patching.get(path)
+        if children is None:
+            children = self.catalog.children.get(path, ())
+        return children
+
+    def _node_id(self, path):
+        node_id = self._ids.get(path)
+        if node_id is None:
+            node_id = self._ids[path] = len(self._paths)
+            self._paths.append(path)
+        return node_id
+
+    def path(self, index: QModelIndex):
+        if not index.isValid():
+            return ()
+        return self._paths[index.internalId()]
+
+    def index_for_path(self, path):
+        # Обратный поиск для восстановления выделения; дотягивает детей по пути
+        index = QModelIndex()
+        for depth in range(1, len(path) + 1):
+            parent_path = path[:depth - 1]
+            children = self._children(parent_path)
+            try:
+                row = children.index(path[depth - 1])
+            except ValueError:
+                return QModelIndex()
+            while self._fetched.get(self._ids[parent_path], 0) <= row:
+                self.fetchMore(index)
+            index = self.index(row, 0, index)
+        return index
+
+    def index(self, row, column, parent=QModelIndex()):
+        if column != 0 or row < 0:
+            return QModelIndex()
+        parent_path = self.path(parent)
+        children = self._children(parent_path)
+        if row >= len(children):
+            return QModelIndex()
+        node_id = self._node_id(parent_path + (children[row],))
+        self._rows[node_id] = row
+        return self.createIndex(row, 0, node_id)
+
+    def parent(self, index=QModelIndex()):
+        path = self.path(index)
+        if len(path) <= 1:
+            return QModelIndex()
+        parent_id = self._ids[path[:-1]]
+        return self.createIndex(self._rows[parent_id], 0, parent_id)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self._fetched.get(self._node_id(self.path(parent)), 0)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        return bool(self._children(self.path(parent)))
+
+    def canFetchMore(self, parent):
+        path = self.path(parent)
+        return self._fetched.get(self._node_id(path), 0) < len(self._children(path))
+
+    def fetchMore(self, parent):
+        path = self.path(parent)
+        node_id = self._node_id(path)
+        done = self._fetched.get(node_id, 0)
+        total = len(self._children(path))
+        count = min(FETCH_BATCH, total - done)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, done, done + count - 1)
+        self._fetched[node_id] = done + count
+        self.endInsertRows()
+
+    def patch(self, index, parents):
+        # Переход на новый индекс каталога; parents - пути, у которых поменялся
+        # список подкатегорий (catalog.diff), сверху вниз
+        self._patching = {path: list(self.catalog.children.get(path, ())) for path in parents}
+        self.catalog = index
+        for path in parents:
+            node_id = self._ids.get(path)
+            if node_id is not None:
+                # Узел уже отдан виду - сообщаем ему о вставленных и удалённых строках
+                self._patch_children(path, node_id, list(index.children.get(path, ())))
+            del self._patching[path]
+
+    def _patch_children(self, path, node_id, new):
+        # Список в _patching меняется шаг за шагом, чтобы между begin/end вид
+        # видел согласованное дерево. Строки дальше отданных виду (fetchMore)
+        # меняются молча - вид их ещё не знает
+        current = self._patching[path]
+        parent = QModelIndex() if not path else self.createIndex(self._rows[node_id], 0, node_id)
+        opcodes = difflib.SequenceMatcher(None, current, new, autojunk=False).get_opcodes()
+        # С конца: правки не сдвигают номера строк ещё не обработанных участков
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag in ("delete", "replace"):
+                shown = self._fetched.get(node_id, 0)
+                last = min(i2, shown)
+                if i1 < last:
+                    self.beginRemoveRows(parent, i1, last - 1)
+                self._forget(path, current[i1:i2])
+                del current[i1:i2]
+                if i1 < last:
+                    self._fetched[node_id] = shown - (last - i1)
+                    self._renumber(path, current)
+                    self.endRemoveRows()
+            if tag in ("insert", "replace"):
+                shown = self._fetched.get(node_id, 0)
+                visible = i1 < shown or shown == len(current)
+                if visible:
+                    self.beginInsertRows(parent, i1, i1 + j2 - j1 - 1)
+                current[i1:i1] = new[j1:j2]
+                if visible:
+                    self._fetched[node_id] = shown + j2 - j1
+                    self._renumber(path, current)
+                    self.endInsertRows()
+
+    def _renumber(self, path, children):
+        for row, name in enumerate(children):
+            node_id = self._ids.get(path + (name,))
+            if node_id is not None:
+                self._rows[node_id] = row
+
+    def _forget(self, parent, names):
+        # Удалённые узлы и их потомки больше не раскрыты: если путь вернётся,
+        # вид получит его детей заново через fetchMore
+        gone = {parent + (name,) for name in names}
+        depth = len(parent) + 1
+        for path, node_id in self._ids.items():
+            if path[:depth] in gone:
+                self._fetched.pop(node_id, None)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.path(index)[-1]
+        if role == Qt.UserRole:
+            return self.path(index)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return "Категории"
+        return None
+
+
+class PhraseListModel(QAbstractListModel):
+    def __init__(self, index: catalog.CatalogIndex, parent=None):
+        super().__init__(parent)
+        self.catalog = index
+        self._ids = []
+        self._shown = 0
+        self.with_path = False
+
+    def set_entries(self, ids, with_path=False):
+        # Меняется только список ID, элементы строк не создаются
+        self.beginResetModel()
+        self._ids = list(ids)
+        self._shown = min(FETCH_BATCH, len(self._ids))
+        self.with_path = with_path
+        self.endResetModel()
+
+    def entry_id(self, row):
+        return self._ids[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._shown
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._shown < len(self._ids)
+
+    def fetchMore(self, parent):
+        count = min(FETCH_BATCH, len(self._ids) - self._shown)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._shown, self._shown + count - 1)
+        self._shown += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.catalog.get(self._ids[index.row()])
+        if entry is None:
+            return None
+        if role == Qt.DisplayRole:
+            if self.with_path and entry.kind == catalog.KIND_ME:
+                return f"/me {entry.text}"
+            return entry.text
+        if role == Qt.UserRole:
+            return entry.id
+        if role == Qt.ToolTipRole and self.with_path:
+            return " / ".join(entry.path)
+        return None
@@ -0,0 +1,114 @@
+"""Перезагрузка каталога реплик на лету при правке rp_phrases.json и formats.json.
+
+QFileSystemWatcher следит за файлами (в Linux - через inotify) и за их
+каталогом: редакторы часто сохраняют через временный файл и rename, и
+слежение за самим файлом после этого пропадает - событие каталога
+возвращает его. Если файл следить не удалось (его нет, сетевой диск),
+раз в POLL_INTERVAL секунд сверяются размер и mtime.
+
+События сглаживаются на DEBOUNCE секунд: сохранение бывает в несколько
+записей. Чтение JSON и сборка индекса идут в фоновом потоке, окну уходит
+сигнал loaded с новым индексом и разницей - соединение и выделение в нём
+не трогаются. Файл с ошибкой (сохранён наполовину) не ломает каталог:
+сигнал failed, остаётся прежний.
+
+Первая перезагрузка собирает индекс целиком и сравнивает со стартовым
+(catalog.diff). Дальше прочитанное дерево фраз хранится, и при тех же
+форматах пересобираются только поддеревья, которые в нём поменялись
+(CatalogIndex.patched).
+"""
+import threading
+import time
+from pathlib import Path
+
+from PySide6.QtCore import QFileSystemWatcher, QObject, QTimer, Signal
+
+import catalog
+import catalog_cache
+
+DEBOUNCE = 0.2
+POLL_INTERVAL = 2.0
+
+
+class CatalogWatcher(QObject):
+    loaded = Signal(object, object, float)  # индекс, catalog.CatalogDiff, секунд на чтение
+    failed = Signal(str)
+
+    def __init__(self, phrases_path, formats_path, index, parent=None):
+        super().__init__(parent)
+        self.paths = (Path(phrases_path).resolve(), Path(formats_path).resolve())
+        self.index = index  # индекс, от которого считается следующая разница
+        self.sources = None  # (дерево фраз, дерево форматов), из которых собран self.index
+        self.stamps = catalog_cache.source_stamps(*self.paths)
+        # Одна перезагрузка за раз; правка во время неё - ещё один проход
+        self.lock = threading.Lock()
+        self.busy = False
+        self.again = False
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.on_event)
+        self.watcher.directoryChanged.connect(self.on_event)
+        self.debounce = QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(int(DEBOUNCE * 1000))
+        self.debounce.timeout.connect(self.check)
+        self.poll = QTimer(self)
+        self.poll.setInterval(int(POLL_INTERVAL * 1000))
+        self.poll.timeout.connect(self.check)
+        self.watch()
+
+    def watch(self):
+        # После rename файл выпадает из слежения - добавляем заново
+        watched = set(self.watcher.files()) | set(self.watcher.directories())
+        wanted = [str(p) for p in self.paths if p.exists()] + \
+                 [str(d) for d in {p.parent for p in self.paths} if d.exists()]
+        missing = [p for p in wanted if p not in watched]
+        if missing:
+            self.watcher.addPaths(missing)
+        files = set(self.watcher.files())
+        if all(str(p) in files for p in self.paths):
+            self.poll.stop()
+        elif not self.poll.isActive():
+            self.poll.start()
+
+    def on_event(self, path):
+        self.watch()
+        self.debounce.start()
+
+    def check(self):
+        # Событие каталога бывает и от соседних файлов (rp_config.json) -
+        # перечитываем, только если отметки наших файлов поменялись
+        stamps = catalog_cache.source_stamps(*self.paths)
+        if stamps == self.stamps:
+            return
+        self.stamps = stamps
+        with self.lock:
+            if self.busy:
+                self.again = True
+                return
+            self.busy = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                stamps, phrases, formats = catalog_cache.read_sources(*self.paths, strict=True)
+            except (OSError, ValueError) as e:
+                self.failed.emit(f"Каталог не перезагружен, остаётся прежний: {e}")
+            else:
+                if self.sources is not None and self.sources[1] == formats:
+                    index, changes = self.index.patched(self.sources[0], phrases, formats)
+                else:
+                    index = catalog.CatalogIndex(phrases, formats)
+                    changes = catalog.diff(self.index, index)
+                self.index = index
+                self.sources = (phrases, formats)
+                catalog_cache.compile_later(index, *self.paths, stamps)
+                if changes:
+                    self.loaded.emit(index, changes, time.perf_counter() - started)
+            with self.lock:
+                if not self.again:
+                    self.busy = False
+                    return
+                self.again = False
@@ -0,0 +1,155 @@
+"""Хранилище rp_config.json с отложенной атомарной записью.
+
+Изменения копятся в памяти: save() только запоминает снимок конфига, а
+фоновый поток пишет последний снимок через DEBOUNCE секунд после последнего
+изменения - набор имени по буквам даёт одну запись, а не запись на букву.
+Запись атомарная: временный файл рядом, fsync и os.replace, так что при
+падении на диске остаётся либо старый, либо новый файл целиком. Если текст
+файла не изменился, он не переписывается.
+
+В файле хранится номер схемы SCHEMA_KEY. Старые файлы при загрузке
+прогоняются через MIGRATIONS (версия -> функция, поднимающая на следующую),
+незнакомые ключи сохраняются как есть.
+"""
+import atexit
+import copy
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+SCHEMA_KEY = "schema"
+SCHEMA_VERSION = 1
+DEBOUNCE = 0.5
+
+
+def _v0_to_v1(data):
+    # Файлы до появления версии: поля те же, добавляется только номер схемы
+    return data
+
+
+MIGRATIONS = {
+    0: _v0_to_v1,
+}
+
+
+def migrate(data):
+    # Возвращает (данные, изменились ли они)
+    version = data.get(SCHEMA_KEY, 0)
+    if not isinstance(version, int) or version > SCHEMA_VERSION:
+        # Файл от более новой версии клиента: ничего не трогаем
+        return data, False
+    changed = False
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version += 1
+        data[SCHEMA_KEY] = version
+        changed = True
+    return data, changed
+
+
+class ConfigStore:
+    def __init__(self, path, defaults=None, debounce=DEBOUNCE, indent=4):
+        self.path = Path(path)
+        self.debounce = debounce
+        self.indent = indent
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self._pending = None  # (номер, снимок), который ещё не записан
+        self._seq = 0
+        self._deadline = 0.0
+        self._written = None  # текст последней записи
+        self._written_seq = 0
+        self._closed = False
+        self.data, dirty = self._load(defaults or {})
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        # Отложенная запись не должна потеряться при обычном выходе
+        atexit.register(self.close)
+        if dirty:
+            self.save()
+
+    def _load(self, defaults):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+            data = json.loads(text)
+            if not isinstance(data, dict):
+                raise ValueError("ожидался JSON-объект")
+        except FileNotFoundError:
+            data = {SCHEMA_KEY: SCHEMA_VERSION, **copy.deepcopy(defaults)}
+            return data, True
+        except (OSError, ValueError) as e:
+            print(f"Ошибка загрузки {self.path}: {e}")
+            return {SCHEMA_KEY: SCHEMA_VERSION, **copy.deepcopy(defaults)}, False
+        self._written = text
+        data, migrated = migrate(data)
+        missing = {k: copy.deepcopy(v) for k, v in defaults.items() if k not in data}
+        data.update(missing)
+        return data, migrated or bool(missing)
+
+    def save(self):
+        # Снимок берётся в потоке вызывающего: фоновый поток не видит
+        # словарь, который в это время меняют
+        snapshot = copy.deepcopy(self.data)
+        with self.cond:
+            self._seq += 1
+            self._pending = (self._seq, snapshot)
+            self._deadline = time.monotonic() + self.debounce
+            self.cond.notify()
+
+    def update(self, values) -> bool:
+        changed = {k: v for k, v in values.items() if self.data.get(k) != v}
+        if changed:
+            self.data.update(changed)
+            self.save()
+        return bool(changed)
+
+    def flush(self):
+        # Записать отложенный снимок сейчас, не дожидаясь паузы
+        with self.cond:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self._write(*pending)
+
+    def close(self):
+        with self.cond:
+            self._closed = True
+            self.cond.notify()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self._closed:
+                    if self._pending is None:
+                        self.cond.wait()
+                        continue
+                    delay = self._deadline - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                if self._closed:
+                    return
+                pending, self._pending = self._pending, None
+            self._write(*pending)
+
+    def _write(self, seq, snapshot):
+        text = json.dumps(snapshot, ensure_ascii=False, indent=self.indent)
+        with self.write_lock:
+            # flush() и фоновый поток могут писать одновременно: старый снимок
+            # не должен лечь поверх нового
+            if seq < self._written_seq or text == self._written:
+                return
+            tmp = self.path.with_name(f"{self.path.name}.tmp")
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._written = text
+                self._written_seq = seq
+            except OSError as e:
+                print(f"Ошибка сохранения конфигурации: {e}")
@@ -0,0 +1,201 @@
+"""Соединение отправителя с сервером в фоновом потоке.
+
+Подключение, приём и отправка идут в потоке ConnectionManager, окно только
+кладёт кадры в очередь и получает события через колбэки on_log, on_status
+и on_frame (вызываются из фонового потока - GUI пробрасывает их в свой
+поток сигналами). При обрыве соединение восстанавливается с растущей
+паузой; кадры, отправленные во время обрыва, ждут в очереди и уходят после
+переподключения, если не успели устареть.
+"""
+import random
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+import protocol
+
+CONNECT_TIMEOUT = 5
+RECV_SIZE = 4096
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30.0
+# Очередь на время обрыва: не больше OUTBOX_SIZE кадров не старше OUTBOX_TTL секунд
+OUTBOX_SIZE = 100
+OUTBOX_TTL = 60.0
+# Сколько ждать фоновый поток при закрытии окна
+CLOSE_TIMEOUT = 1.0
+# Сервер, приславший PING, молчащий дольше RELAY_MISSED его интервалов, считаем мёртвым
+RELAY_MISSED = 3
+
+
+class ConnectionManager:
+    def __init__(self, on_log=None, on_status=None, on_frame=None):
+        self.on_log = on_log or (lambda text: None)
+        self.on_status = on_status or (lambda connected, text: None)
+        self.on_frame = on_frame or (lambda kind, payload: None)
+        self.outbox = deque()  # (время постановки, кадр)
+        self.lock = threading.Lock()
+        self.connected = False
+        self.address = None
+        self._stop = None
+        self._sock = None
+        self._thread = None
+        # Пара сокетов будит фоновый поток, когда в очереди появился кадр
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+    @property
+    def active(self):
+        # Соединение установлено или восстанавливается
+        return self._stop is not None and not self._stop.is_set()
+
+    def start(self, host, port, hello: bytes):
+        self.stop()
+        self.address = f"{host}:{port}"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(host, port, hello, self._stop), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop is None:
+            return
+        self._stop.set()
+        self._stop = None
+        self.connected = False
+        self._wake()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with self.lock:
+            self.outbox.clear()
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        # Выход из программы: останавливаем и ждём поток, затем глушим
+        # обратные вызовы - поток, застрявший в connect дольше timeout,
+        # не должен дёргать уже удалённые объекты окна
+        thread = self._thread
+        self.stop()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.on_log = lambda text: None
+        self.on_status = lambda connected, text: None
+        self.on_frame = lambda kind, payload: None
+
+    def send(self, frame: bytes) -> bool:
+        # Кладёт кадр в очередь. False - менеджер остановлен, кадр не принят
+        if not self.active:
+            return False
+        with self.lock:
+            if len(self.outbox) >= OUTBOX_SIZE:
+                self.outbox.popleft()
+                self.on_log("Очередь отправки переполнена, самая старая реплика выброшена")
+            self.outbox.append((time.monotonic(), frame))
+        self._wake()
+        return True
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run(self, host, port, hello, stop):
+        delay = BACKOFF_MIN
+        while not stop.is_set():
+            self.on_status(False, f"Статус: Подключение к {host}:{port}...")
+            try:
+                sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+            except OSError as e:
+                self.on_log(f"Ошибка подключения: {e}. Повтор через {delay:.1f} с")
+                self.on_status(False, "Статус: Нет связи, переподключение...")
+                # Случайная добавка, чтобы клиенты после сбоя сервера не шли толпой
+                if stop.wait(delay * random.uniform(1.0, 1.25)):
+                    break
+                delay = min(delay * 2, BACKOFF_MAX)
+                continue
+            delay = BACKOFF_MIN
+            if stop.is_set():
+                sock.close()
+                break
+            self._sock = sock
+            try:
+                self._session(sock, hello, stop, f"{host}:{port}")
+            except (OSError, protocol.ProtocolError) as e:
+                if not stop.is_set():
+                    self.on_log(f"Соединение с сервером разорвано: {e}")
+            finally:
+                sock.close()
+                # После stop()+start() здесь может уже работать новый поток
+                if not stop.is_set():
+                    self.connected = False
+                    self._sock = None
+            if not stop.is_set() and stop.wait(BACKOFF_MIN):
+                break
+        if self._stop is None:
+            # Остановлены, а не перезапущены с другим адресом
+            self.connected = False
+            self.on_status(False, "Статус: Отключено")
+            self.on_log("Отключено от сервера.")
+
+    def _session(self, sock, hello, stop, address):
+        sock.settimeout(None)
+        sock.sendall(hello)
+        self.connected = True
+        self.on_status(True, f"Статус: Подключено к {address}")
+        self.on_log("Подключение успешно.")
+        decoder = protocol.FrameDecoder()
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ, "sock")
+        selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+        # Пока сервер не прислал PING, он мог и не включать пульс - ждём без срока
+        silence = None
+        last_data = time.monotonic()
+        try:
+            while not stop.is_set():
+                self._flush(sock)
+                events = selector.select(silence)
+                if silence is not None and time.monotonic() - last_data > silence:
+                    raise ConnectionError(f"сервер не отвечает {silence:g} с")
+                for key, _ in events:
+                    if key.data == "wake":
+                        try:
+                            while self._wake_r.recv(RECV_SIZE):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    data = sock.recv(RECV_SIZE)
+                    if not data:
+                        raise ConnectionError("сервер закрыл соединение")
+                    last_data = time.monotonic()
+                    for kind, payload in decoder.feed(data):
+                        if kind == protocol.PING:
+                            ping = protocol.decode_json(payload)
+                            if isinstance(ping.get("interval"), (int, float)) and ping["interval"] > 0:
+                                silence = ping["interval"] * RELAY_MISSED
+                            sock.sendall(protocol.pong(ping.get("t")))
+                            continue
+                        self.on_frame(kind, payload)
+        finally:
+            selector.close()
+
+    def _flush(self, sock):
+        # Кадр убираем из очереди только после успешной отправки: при обрыве
+        # он уйдёт заново по новому соединению
+        while True:
+            with self.lock:
+                if not self.outbox:
+                    return
+                queued_at, frame = self.outbox[0]
+            if time.monotonic() - queued_at > OUTBOX_TTL:
+                self.on_log("Реплика устарела за время обрыва и не отправлена")
+            else:
+                sock.sendall(frame)
+            with self.lock:
+                if self.outbox and self.outbox[0][1] is frame:
+                    self.outbox.popleft()
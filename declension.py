@@ -0,0 +1,148 @@
+"""Склонение организации, звания и имени из профиля по падежам.
+
+Работает без сети и внешних словарей: небольшой набор правил для
+существительных и прилагательных плюс словарь исключений. Все шесть форм
+считаются один раз при смене профиля и кладутся в rp_config.json, при
+отправке реплики остаётся только взять готовую строку из таблицы.
+"""
+from functools import lru_cache
+
+from templates import CASES
+
+CACHE_SIZE = 256
+
+# Одушевлённость поля: у одушевлённых винительный мужского рода совпадает с родительным
+FIELDS = {
+    "org": False,
+    "rang": True,
+    "name": True,
+}
+
+# Готовые формы для слов, которые правила склоняют неверно (nomn, gent, datv, accs, ablt, loct)
+EXCEPTIONS = {
+    "любовь": ("любовь", "любови", "любови", "любовь", "любовью", "любови"),
+    "павел": ("павел", "павла", "павлу", "павла", "павлом", "павле"),
+    "лев": ("лев", "льва", "льву", "льва", "львом", "льве"),
+    "пётр": ("пётр", "петра", "петру", "петра", "петром", "петре"),
+    "петр": ("петр", "петра", "петру", "петра", "петром", "петре"),
+    "герой": ("герой", "героя", "герою", "героя", "героем", "герое"),
+    "часть": ("часть", "части", "части", "часть", "частью", "части"),
+}
+
+# Субстантивированные прилагательные: склоняются как прилагательные, даже стоя одни
+ADJECTIVE_NOUNS = {"рядовой", "дежурный", "постовой", "участковый", "городовой", "конвойный", "понятой"}
+
+VOWELS = set("аеёиоуыэюя")
+HUSHING = set("жшчщц")
+VELAR_HUSHING = set("гкхжшчщ")
+
+
+def _adjective(word, animate):
+    stem, end = word[:-2], word[-2:]
+    if end in ("ая", "яя"):
+        soft = end == "яя"
+        o = "е" if soft or stem[-1:] in HUSHING else "о"
+        return (word, stem + o + "й", stem + o + "й", stem + ("юю" if soft else "ую"), stem + o + "й", stem + o + "й")
+    soft = end == "ий" and stem[-1:] not in VELAR_HUSHING
+    hushing = stem[-1:] in VELAR_HUSHING or end == "ий"
+    gent = stem + ("его" if soft or stem[-1:] in HUSHING and end != "ой" else "ого")
+    datv = stem + ("ему" if soft or stem[-1:] in HUSHING and end != "ой" else "ому")
+    ablt = stem + ("им" if hushing or soft else "ым")
+    loct = stem + ("ем" if soft or stem[-1:] in HUSHING and end != "ой" else "ом")
+    return (word, gent, datv, gent if animate else word, ablt, loct)
+
+
+def _noun(word, animate):
+    last = word[-1]
+    stem = word[:-1]
+    if last == "а":
+        gent = stem + ("и" if stem[-1:] in VELAR_HUSHING else "ы")
+        ablt = stem + ("ей" if stem[-1:] in HUSHING else "ой")
+        return (word, gent, stem + "е", stem + "у", ablt, stem + "е")
+    if last == "я":
+        if stem.endswith("и"):
+            return (word, stem + "и", stem + "и", stem + "ю", stem + "ей", stem + "и")
+        return (word, stem + "и", stem + "е", stem + "ю", stem + "ей", stem + "е")
+    if last == "й":
+        loct = stem + ("и" if stem.endswith("и") else "е")
+        return (word, stem + "я", stem + "ю", stem + "я" if animate else word, stem + "ем", loct)
+    if last == "ь":
+        # Мужской род (Игорь, секретарь); женский на -ь заносится в исключения
+        return (word, stem + "я", stem + "ю", stem + "я" if animate else word, stem + "ем", stem + "е")
+    if last in VOWELS:
+        # -о, -е, -и, -у и т.п.: несклоняемые (Пьеро, Мари)
+        return (word,) * 6
+    gent = word + "а"
+    ablt = word + ("ем" if last in HUSHING else "ом")
+    return (word, gent, word + "у", gent if animate else word, ablt, word + "е")
+
+
+def _match_case(form, original):
+    if original.isupper() and len(original) > 1:
+        return form.upper()
+    if original[:1].isupper():
+        return form[:1].upper() + form[1:]
+    return form
+
+
+def _decline_word(word, animate, adjective):
+    lower = word.lower()
+    if len(lower) < 2 or (word.isupper() and len(word) > 1):
+        # Аббревиатуры (ДПС, ФСБ) не склоняются
+        return (word,) * 6
+    if "-" in lower:
+        # Кошко-полиция: склоняется последняя часть
+        head, _, tail = word.rpartition("-")
+        return tuple(f"{head}-{form}" for form in _decline_word(tail, animate, adjective))
+    if lower in EXCEPTIONS:
+        forms = EXCEPTIONS[lower]
+    elif adjective or lower in ADJECTIVE_NOUNS:
+        forms = _adjective(lower, animate)
+    else:
+        forms = _noun(lower, animate)
+    return tuple(_match_case(form, word) for form in forms)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def decline(text: str, animate: bool = True):
+    # Все падежные формы фразы в порядке CASES. Прилагательные перед последним
+    # словом (Младший сержант) согласуются с ним, последнее слово - существительное.
+    words = text.split()
+    if not words:
+        return ("",) * len(CASES)
+    declined = []
+    for i, word in enumerate(words):
+        is_last = i == len(words) - 1
+        adjective = not is_last and word.lower()[-2:] in ("ый", "ий", "ой", "ая", "яя")
+        declined.append(_decline_word(word, animate, adjective))
+    return tuple(" ".join(forms) for forms in zip(*declined))
+
+
+def profile_forms(profile):
+    # Таблица {поле: {падеж: форма}} для org/rang/name профиля
+    table = {}
+    for field, animate in FIELDS.items():
+        value = profile.get(field)
+        if isinstance(value, str):
+            table[field] = dict(zip(CASES, decline(value.strip(), animate)))
+    return table
+
+
+def forms_are_current(profile):
+    # Сохранённые в конфиге формы годятся, если посчитаны от текущих значений
+    forms = profile.get("forms")
+    if not isinstance(forms, dict):
+        return False
+    for field in FIELDS:
+        value = profile.get(field)
+        if isinstance(value, str) and forms.get(field, {}).get("nomn") != value.strip():
+            return False
+    return True
+
+
+def update_profile(profile) -> bool:
+    # Пересчитывает profile["forms"], только если изменились исходные значения
+    if forms_are_current(profile):
+        return False
+    profile["forms"] = profile_forms(profile)
+    return True
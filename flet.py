@@ -1,62 +1,121 @@
+import gc
 import sys
-import socket
 import threading
-import json
+import time
+import uuid
+from collections import OrderedDict
 from pathlib import Path
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
-    QTextEdit, QLabel, QTabWidget, QListWidget, QListWidgetItem,
+    QTextEdit, QLabel, QTabWidget, QListView, QTreeView, QListWidget,
     QComboBox, QLineEdit, QGroupBox, QFormLayout, QMessageBox,
-    QTreeWidget, QTreeWidgetItem
+    QDoubleSpinBox, QInputDialog
 )
-from PySide6.QtCore import Qt, Slot
+from PySide6.QtCore import QModelIndex, QObject, Qt, Signal, Slot
+
+import catalog
+import catalog_cache
+import catalog_model
+import catalog_watch
+import config_store
+import connection
+import declension
+import latency
+import protocol
+import search
+import templates
 
 CONFIG_PATH = Path("rp_config.json")
+# Сколько отправленных реплик помнить в ожидании подтверждения ввода
+PENDING_ACKS = 1000
+# Та же реплика повторно за столько секунд - случайный повторный клик: она
+# уходит с прежним id, и ретранслятор её не рассылает
+REPEAT_WINDOW = 1.0
+# Пауза перед шагом сценария по умолчанию, с
+SCENARIO_DELAY = 2.0
+NEW_SCENARIO = "(новый сценарий)"
 PHRASES_PATH = Path("rp_phrases.json")
 FORMATS_PATH = Path("formats.json")
 
 
+class NetSignals(QObject):
+    # Колбэки ConnectionManager приходят из фонового потока, сигналы
+    # доставляют их в поток окна - виджеты трогаем только оттуда
+    log = Signal(str)
+    status = Signal(bool, str)
+    frame = Signal(int, object)
+
+
 class RPClient(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("RP Client - Отправка реплик")
         self.resize(1000, 700)
 
-        self.socket = None
-        self.receive_thread = None
+        # Сеть целиком в фоновом потоке: подключение, приём, переподключение
+        self.signals = NetSignals(self)
+        self.net = connection.ConnectionManager(
+            on_log=self.signals.log.emit,
+            on_status=self.signals.status.emit,
+            on_frame=self.signals.frame.emit,
+        )
         self.connected = False
-
-        # Загружаем конфиги
-        self.config = self.load_json(CONFIG_PATH, default={
+        # id отправленной реплики -> текст, пока приёмник не подтвердил ввод
+        self.pending_acks = OrderedDict()
+        # id клиента в HELLO: по нему ретранслятор отбрасывает повторы и после переподключения
+        self.client_id = uuid.uuid4().hex[:16]
+        self.last_sent = None  # (текст, id, time.monotonic()) последней реплики
+        self.scenario = []  # черновик сценария: [{"id", "delay"}]
+        self.latency = latency.StageStats()
+
+        # Загружаем конфиги. Профиль пишется на диск в фоне, с задержкой и атомарно
+        self.store = config_store.ConfigStore(CONFIG_PATH, defaults={
             "org": "Полиция",
             "rang": "Офицер",
             "name": "Анна",
             "server_ip": "109.73.204.176",
             "server_port": 12345,
-            "declension": "nominative"
+            "channel": "general",
+            "declension": "nominative",
+            "scenario_delay": SCENARIO_DELAY,
+            # имя -> [{"id": ID фразы, "delay": пауза перед шагом}]
+            "scenarios": {}
         })
-        self.phrases = self.load_json(PHRASES_PATH, default={})
-        self.formats = self.load_json(FORMATS_PATH, default={})
+        self.config = self.store.data
+        # Падежные формы лежат в конфиге; пересчитываем, только если они устарели
+        if declension.update_profile(self.config):
+            self.save_config()
+
+        # Плоский индекс: ID фразы -> текст, вид и готовые prefix/suffix.
+        # Берётся из скомпилированного кэша через mmap; если исходники
+        # поменялись - из JSON, а кэш пересобирается в фоне
+        self.catalog, cached = catalog_cache.load(PHRASES_PATH, FORMATS_PATH)
+        print(f"Каталог: {len(self.catalog)} фраз{' из кэша' if cached else ''}")
+        # Поисковый индекс большого каталога строится секунды - делаем это в фоне.
+        # search_lock: индекс и каталог, из которого он строится, меняются вместе
+        self.search_index = None
+        self.search_lock = threading.Lock()
+        threading.Thread(target=self.build_search_index, daemon=True).start()
+
+        # Шаблоны компилируются при первой подстановке и дальше берутся из
+        # кэша рендерера: разбирать весь каталог при запуске не нужно
+        self.renderer = templates.Renderer(self.config)
 
         self.init_ui()
+        self.signals.log.connect(self.log)
+        self.signals.status.connect(self.on_net_status)
+        self.signals.frame.connect(self.on_net_frame)
         self.populate_settings()
         self.populate_phrases()
+        # Правки файлов каталога подхватываются без перезапуска и переподключения
+        self.catalog_watcher = catalog_watch.CatalogWatcher(PHRASES_PATH, FORMATS_PATH, self.catalog, self)
+        self.catalog_watcher.loaded.connect(self.on_catalog_reloaded)
+        self.catalog_watcher.failed.connect(self.log)
         self.connect_to_server_auto()
 
-    def load_json(self, path: Path, default=None):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Ошибка загрузки {path}: {e}")
-            return default or {}
-
     def save_config(self):
-        try:
-            with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"Ошибка сохранения конфигурации: {e}")
+        # Не пишет сразу: изменения за DEBOUNCE секунд уходят на диск одной записью
+        self.store.save()
 
     def init_ui(self):
         self.setStyleSheet("""
@@ -84,16 +143,16 @@ class RPClient(QWidget):
                 border-bottom-color: white;
                 font-weight: 600;
             }
-            QTreeWidget, QListWidget {
+            QTreeView, QListView {
                 background: white;
                 border: 1px solid #ccc;
                 border-radius: 6px;
                 padding: 4px;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 6px 8px;
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #3399ff;
                 color: white;
             }
@@ -158,19 +217,18 @@ class RPClient(QWidget):
         self.create_server_tab()
 
         self.tabs.currentChanged.connect(self.on_tab_changed)
-    def replace_placeholders(self, text: str) -> str:
-        # Заменяем в тексте все вхождения ключей из self.config в фигурных скобках
-        for key, val in self.config.items():
-            placeholder = "{" + key + "}"
-            text = text.replace(placeholder, val)
-        return text
-
     def create_phrases_tab(self):
         layout = QHBoxLayout(self.tab_phrases)
 
         # Слева дерево категорий и подкатегорий (4 уровня)
-        self.phrases_tree = QTreeWidget()
-        self.phrases_tree.setHeaderLabel("Категории")
+        # Модели не создают элементы заранее: дети узла и строки списка
+        # отдаются виду по запросу, поэтому размер каталога не влияет на запуск
+        self.tree_model = catalog_model.CategoryTreeModel(self.catalog, self)
+        self.phrase_model = catalog_model.PhraseListModel(self.catalog, self)
+
+        self.phrases_tree = QTreeView()
+        self.phrases_tree.setModel(self.tree_model)
+        self.phrases_tree.setUniformRowHeights(True)
         self.phrases_tree.setMaximumWidth(400)
         layout.addWidget(self.phrases_tree)
 
@@ -178,17 +236,74 @@ class RPClient(QWidget):
         right_layout = QVBoxLayout()
         layout.addLayout(right_layout)
 
-        self.phrases_list = QListWidget()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Поиск по всем репликам и /me")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.on_search_changed)
+        right_layout.addWidget(self.search_edit)
+
+        self.phrases_list = QListView()
+        self.phrases_list.setModel(self.phrase_model)
+        self.phrases_list.setUniformItemSizes(True)
         right_layout.addWidget(self.phrases_list)
 
-        self.phrases_list.itemDoubleClicked.connect(self.on_phrase_double_clicked)
-        self.phrases_tree.itemClicked.connect(self.on_category_selected)
+        self.phrases_list.doubleClicked.connect(self.on_phrase_double_clicked)
+        self.phrases_tree.clicked.connect(self.on_category_selected)
+
+        # Прерывает строку, которую сейчас вводит приёмник, и чистит его очередь
+        self.btn_cancel = QPushButton("Остановить ввод")
+        self.btn_cancel.clicked.connect(lambda: self.send_control("cancel"))
+        right_layout.addWidget(self.btn_cancel)
+
+        right_layout.addWidget(self.create_scenario_group())
 
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setMaximumHeight(150)
         right_layout.addWidget(self.log_text)
 
+    def create_scenario_group(self):
+        # Сценарий уходит одним кадром, паузы между шагами выдерживает приёмник
+        group = QGroupBox("Сценарий")
+        layout = QVBoxLayout(group)
+
+        self.scenario_combo = QComboBox()
+        self.scenario_combo.addItem(NEW_SCENARIO)
+        self.scenario_combo.addItems(sorted(self.config.get("scenarios", {})))
+        self.scenario_combo.currentTextChanged.connect(self.on_scenario_selected)
+        layout.addWidget(self.scenario_combo)
+
+        self.scenario_list = QListWidget()
+        self.scenario_list.setMaximumHeight(120)
+        layout.addWidget(self.scenario_list)
+
+        row = QHBoxLayout()
+        self.scenario_delay = QDoubleSpinBox()
+        self.scenario_delay.setRange(0, protocol.MAX_STEP_DELAY)
+        self.scenario_delay.setSingleStep(0.5)
+        self.scenario_delay.setSuffix(" с")
+        self.scenario_delay.setToolTip("Пауза перед добавляемым шагом")
+        self.scenario_delay.setValue(float(self.config.get("scenario_delay", SCENARIO_DELAY)))
+        self.scenario_delay.valueChanged.connect(lambda value: self.store.update({"scenario_delay": value}))
+        row.addWidget(self.scenario_delay)
+        for title, slot in (("+ фраза", self.on_scenario_add),
+                            ("Из категории", self.on_scenario_from_category),
+                            ("Очистить", self.on_scenario_clear)):
+            button = QPushButton(title)
+            button.clicked.connect(slot)
+            row.addWidget(button)
+        layout.addLayout(row)
+
+        row = QHBoxLayout()
+        for title, slot in (("Сохранить", self.on_scenario_save),
+                            ("Удалить", self.on_scenario_delete),
+                            ("Проиграть", self.on_scenario_play)):
+            button = QPushButton(title)
+            button.clicked.connect(slot)
+            row.addWidget(button)
+        layout.addLayout(row)
+        return group
+
     def create_settings_tab(self):
         layout = QVBoxLayout(self.tab_settings)
 
@@ -236,6 +351,10 @@ class RPClient(QWidget):
         self.edit_port.setText(str(self.config.get("server_port", 12345)))
         form.addRow("Порт сервера:", self.edit_port)
 
+        self.edit_channel = QLineEdit()
+        self.edit_channel.setText(self.config.get("channel", "general"))
+        form.addRow("Канал:", self.edit_channel)
+
         self.edit_access_code = QLineEdit()
         self.edit_access_code.setPlaceholderText("Введите код доступа")
         self.edit_access_code.setEchoMode(QLineEdit.Password)
@@ -247,6 +366,11 @@ class RPClient(QWidget):
         self.btn_connect.clicked.connect(self.on_connect_clicked)
         layout.addWidget(self.btn_connect)
 
+        # Гистограммы задержек по этапам из подтверждений приёмников
+        self.btn_latency = QPushButton("Задержки доставки")
+        self.btn_latency.clicked.connect(self.on_latency_clicked)
+        layout.addWidget(self.btn_latency)
+
         self.label_status = QLabel("Статус: Отключено")
         layout.addWidget(self.label_status)
 
@@ -269,6 +393,7 @@ class RPClient(QWidget):
 
         self.config["server_ip"] = ip
         self.config["server_port"] = port
+        self.config["channel"] = self.edit_channel.text().strip() or "general"
         self.save_config()
 
         self.disconnect_from_server()
@@ -280,10 +405,12 @@ class RPClient(QWidget):
             self.edit_access_code.clear()
             self.edit_ip.setEnabled(False)
             self.edit_port.setEnabled(False)
+            self.edit_channel.setEnabled(False)
             self.btn_connect.setEnabled(False)
         else:
             self.edit_ip.setEnabled(True)
             self.edit_port.setEnabled(True)
+            self.edit_channel.setEnabled(True)
             self.btn_connect.setEnabled(True)
 
     def log(self, message: str):
@@ -291,6 +418,18 @@ class RPClient(QWidget):
         self.log_server.append(message)
 
     def populate_settings(self):
+        # Пока виджеты заполняются из конфига, on_setting_changed не нужен: иначе
+        # первый же setCurrentText запишет в конфиг ещё не заполненные поля
+        widgets = (self.combo_org, self.combo_rang, self.edit_name, self.combo_declension)
+        for widget in widgets:
+            widget.blockSignals(True)
+        try:
+            self._fill_settings()
+        finally:
+            for widget in widgets:
+                widget.blockSignals(False)
+
+    def _fill_settings(self):
         self.combo_org.setCurrentText(self.config.get("org", "Полиция"))
         self.combo_rang.setCurrentText(self.config.get("rang", "Офицер"))
         self.edit_name.setText(self.config.get("name", "Анна"))
@@ -319,6 +458,10 @@ class RPClient(QWidget):
             "Предложный": "prepositional"
         }
         self.config["declension"] = decl_map_rev.get(self.combo_declension.currentText(), "nominative")
+        # Формы склоняются один раз здесь, а не при каждой отправке;
+        # кэш готовых реплик сбрасывается только если профиль действительно изменился
+        declension.update_profile(self.config)
+        self.renderer.set_profile(self.config)
         self.save_config()
 
     def connect_to_server_auto(self):
@@ -327,176 +470,288 @@ class RPClient(QWidget):
         self.connect_to_server(ip, port)
 
     def connect_to_server(self, ip, port):
-        if self.connected:
-            self.log("Уже подключены к серверу.")
-            return
-        try:
-            self.log(f"Подключение к серверу {ip}:{port}...")
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(10)
-            self.socket.connect((ip, port))
-            self.socket.settimeout(None)
-
-            self.socket.sendall(b"sender\n")
-
-            self.connected = True
-            self.label_status.setText(f"Статус: Подключено к {ip}:{port}")
-            self.log("Подключение успешно.")
-
-            self.receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
-            self.receive_thread.start()
-        except Exception as e:
-            self.log(f"Ошибка подключения: {e}")
-            self.label_status.setText("Статус: Отключено")
-            self.connected = False
-            if self.socket:
-                try:
-                    self.socket.close()
-                except:
-                    pass
-                self.socket = None
+        # Не ждёт сети: подключение и повторы идут в фоне, о результате сообщат сигналы
+        self.log(f"Подключение к серверу {ip}:{port}...")
+        self.net.start(ip, port, protocol.hello("sender", channel=self.config.get("channel", "general"),
+                                                client=self.client_id, heartbeat=True))
 
     def disconnect_from_server(self):
-        if not self.connected:
-            return
-        self.connected = False
-        try:
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
-        except Exception as e:
-            self.log(f"Ошибка при отключении: {e}")
-        self.socket = None
-        self.label_status.setText("Статус: Отключено")
-        self.log("Отключено от сервера.")
-
-    def receive_messages(self):
+        self.net.stop()
+
+    def closeEvent(self, event):
+        # Поток сети шлёт сигналы в NetSignals окна - останавливаем его до
+        # того, как окно и сигналы будут удалены
+        self.net.close()
+        super().closeEvent(event)
+
+    @Slot(bool, str)
+    def on_net_status(self, connected: bool, text: str):
+        self.connected = connected
+        self.label_status.setText(text)
+
+    @Slot(int, object)
+    def on_net_frame(self, kind: int, payload: bytes):
         try:
-            while self.connected:
-                data = self.socket.recv(4096)
-                if not data:
-                    self.log("Соединение с сервером разорвано.")
-                    break
-                msg = data.decode("utf-8").strip()
-                self.log(f"Получено: {msg}")
-        except Exception as e:
-            if self.connected:
-                self.log(f"Ошибка приема данных: {e}")
-        finally:
-            self.connected = False
-            if self.socket:
-                try:
-                    self.socket.shutdown(socket.SHUT_RDWR)
-                    self.socket.close()
-                except:
-                    pass
-                self.socket = None
-            self.label_status.setText("Статус: Отключено")
-            self.log("Отключено от сервера.")
+            if kind == protocol.MSG:
+                self.log(f"Получено: {protocol.decode_json(payload).get('text', '')}")
+            elif kind == protocol.ACK:
+                self.on_ack(protocol.decode_json(payload))
+            elif kind == protocol.STATUS:
+                # Приёмник сообщает, сколько строк ждут ввода
+                depth = protocol.decode_json(payload).get("depth", 0)
+                self.label_status.setText(
+                    f"Статус: Подключено к {self.net.address}, в очереди ввода: {depth}")
+        except protocol.ProtocolError as e:
+            self.log(f"Ошибка приема данных: {e}")
 
     def populate_phrases(self):
-        self.phrases_tree.clear()
-        self.phrases_list.clear()
-
-        def add_phrases_recursive(parent, data, path):
-            if isinstance(data, dict):
-                for key, value in data.items():
-                    if key in ("Фразы", "/me"):
-                        # не добавляем в дерево, это листовые элементы
-                        continue
-                    cat_item = QTreeWidgetItem(parent, [key])
-                    add_phrases_recursive(cat_item, value, path + [key])
-            elif isinstance(data, list):
-                # Списки фраз не добавляем в дерево
-                pass
-
-        add_phrases_recursive(self.phrases_tree.invisibleRootItem(), self.phrases, [])
-
+        self.tree_model.reset()
+        self.phrase_model.set_entries(())
         self.phrases_tree.expandToDepth(0)
 
     @Slot()
-    def on_category_selected(self, item: QTreeWidgetItem, column: int):
-        # Собираем путь до выбранного узла
-        path = []
-        cur = item
-        while cur:
-            path.insert(0, cur.text(0))
-            cur = cur.parent()
-
-        # По пути ищем узел с фразами
-        def get_node_by_path(data, keys):
-            for k in keys:
-                if isinstance(data, dict) and k in data:
-                    data = data[k]
-                else:
-                    return None
-            return data
-
-        node = get_node_by_path(self.phrases, path)
-        self.phrases_list.clear()
-        if not node:
+    def on_category_selected(self, index: QModelIndex):
+        path = self.tree_model.path(index)
+        if self.search_edit.text():
+            # Выбор категории сбрасывает поиск; сигнал сам покажет категорию
+            self.search_edit.clear()
+            return
+        # Сначала "Фразы", затем "/me"
+        self.show_category(path)
+
+    def build_search_index(self):
+        index = search.SearchIndex()
+        source = None
+        while True:
+            # Каталог перезагрузили, пока строили, - догоняем его разницей
+            with self.search_lock:
+                if source is self.catalog:
+                    self.search_index = index
+                    break
+                source = self.catalog
+            index.sync(dict(source.texts()))
+        # Каталог и индекс поиска - миллионы долгоживущих объектов: полный
+        # проход сборщика мусора по ним останавливал ввод в поиске на 0.7 с
+        # (bench/search.py, 100 000 фраз). Раз они собраны, убираем всё
+        # созданное при запуске из-под сборщика; память по-прежнему
+        # освобождается по счётчику ссылок
+        gc.freeze()
+
+    @Slot(object, object, float)
+    def on_catalog_reloaded(self, index, changes, load_s):
+        # Дерево и поиск правятся только в изменившихся местах: раскрытые
+        # ветки, выбранная категория и фраза остаются
+        started = time.perf_counter()
+        path = self.tree_model.path(self.phrases_tree.currentIndex())
+        entry_id = self.phrases_list.currentIndex().data(Qt.UserRole)
+        with self.search_lock:
+            self.catalog = index
+            search_index = self.search_index
+        self.tree_model.patch(index, changes.children)
+        self.phrase_model.catalog = index
+        if search_index is not None:
+            for doc_id in changes.removed:
+                search_index.remove(doc_id)
+            for doc_id in changes.added:
+                search_index.add(doc_id, index.get(doc_id).text)
+
+        text = self.search_edit.text()
+        current = self.tree_model.path(self.phrases_tree.currentIndex())
+        if text.strip():
+            if changes.added or changes.removed:
+                self.on_search_changed(text)
+                self.select_entry(entry_id)
+        elif current != path or current in changes.categories:
+            self.show_category(current)
+            self.select_entry(entry_id)
+        self.show_scenario()
+        self.log(f"Каталог перезагружен: категорий изменено {len(changes.categories)}, "
+                 f"фраз +{len(changes.added)} -{len(changes.removed)}; чтение {load_s:.2f} с, "
+                 f"обновление окна {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    def select_entry(self, entry_id):
+        # Возвращает выделение на фразу после обновления списка, если она осталась
+        for row in range(self.phrase_model.rowCount()):
+            if self.phrase_model.entry_id(row) == entry_id:
+                self.phrases_list.setCurrentIndex(self.phrase_model.index(row))
+                return
+
+    @Slot()
+    def on_search_changed(self, text: str):
+        if not text.strip() or self.search_index is None:
+            self.show_category(self.tree_model.path(self.phrases_tree.currentIndex()))
             return
+        self.phrase_model.set_entries(self.search_index.search(text), with_path=True)
 
-        # Добавляем все "Фразы" и "/me" в список с метаданными
-        def add_phrases_to_list(lst_widget, phrases, me=False):
-            for phrase in phrases:
-                list_item = QListWidgetItem(phrase)
-                list_item.setData(Qt.UserRole, {
-                    "path": path + (["/me"] if me else []),
-                    "me": me,
-                    "text": phrase
-                })
-                lst_widget.addItem(list_item)
-
-        if isinstance(node, dict):
-            if "Фразы" in node and isinstance(node["Фразы"], list):
-                add_phrases_to_list(self.phrases_list, node["Фразы"], me=False)
-            if "/me" in node and isinstance(node["/me"], list):
-                add_phrases_to_list(self.phrases_list, node["/me"], me=True)
+    def show_category(self, path):
+        # В модель уходит только список ID; строки рисуются из индекса по запросу вида
+        self.phrase_model.set_entries(self.catalog.categories.get(path, ()) if path else ())
 
     @Slot()
-    def on_phrase_double_clicked(self, item: QListWidgetItem):
-        data = item.data(Qt.UserRole)
-        if not data:
+    def on_phrase_double_clicked(self, index: QModelIndex):
+        entry = self.catalog.get(index.data(Qt.UserRole))
+        if not entry:
             return
-        text = data["text"]
-        path = data["path"]  # путь для формата
 
-        org = self.config.get("org", "Полиция")
-        rang = self.config.get("rang", "Офицер")
-        name = self.config.get("name", "Анна")
-        decl = self.config.get("declension", "nominative")
+        # Уходит одна строка: голый текст без обёртки приёмник вводил лишний раз
+        self.send_message(self.render_entry(entry), entry.kind)
 
-        # Получаем формат по пути
-        def get_format_by_path(formats, keys):
-            for k in keys:
-                if isinstance(formats, dict) and k in formats:
-                    formats = formats[k]
-                else:
-                    return {"prefix": "", "suffix": ""}
-            if isinstance(formats, dict) and "prefix" in formats and "suffix" in formats:
-                return formats
-            return {"prefix": "", "suffix": ""}
-
-        fmt = get_format_by_path(self.formats, path)
-
-        # Подставляем переменные
-        text = text.replace("{org}", org).replace("{rang}", rang).replace("{name}", name)
-        text = self.replace_placeholders(text)
-        self.send_message(text)
-        # Оборачиваем с prefix и suffix
-        full_text = f"{fmt['prefix']}{text}{fmt['suffix']}"
-
-        self.send_message(full_text)
-
-    def send_message(self, text: str):
-        if not self.connected:
+    def render_entry(self, entry):
+        # Подставляем переменные за один проход по скомпилированному шаблону и
+        # оборачиваем с prefix и suffix, уже разрешёнными в индексе с учётом наследования
+        text = self.renderer.render(entry.text)
+        return f"{self.renderer.render(entry.prefix)}{text}{self.renderer.render(entry.suffix)}"
+
+    def show_scenario(self):
+        self.scenario_list.clear()
+        for step in self.scenario:
+            entry = self.catalog.get(step["id"])
+            text = entry.text if entry else "(фразы больше нет в каталоге)"
+            self.scenario_list.addItem(f"+{step['delay']:g} с  {text}")
+
+    def add_scenario_step(self, entry_id):
+        # У первого шага паузы нет: сценарий начинается сразу
+        self.scenario.append({"id": entry_id, "delay": self.scenario_delay.value() if self.scenario else 0.0})
+
+    @Slot()
+    def on_scenario_add(self):
+        entry_id = self.phrases_list.currentIndex().data(Qt.UserRole)
+        if not entry_id:
+            self.log("Выберите фразу в списке, чтобы добавить её в сценарий")
+            return
+        self.add_scenario_step(entry_id)
+        self.show_scenario()
+
+    @Slot()
+    def on_scenario_from_category(self):
+        # Подкатегории по порядку - шаги: первая фраза и первое /me каждой
+        # ("РП остановка": Инициирование -> ... -> Возврат документов)
+        path = self.tree_model.path(self.phrases_tree.currentIndex())
+        children = self.catalog.children.get(path, []) if path else []
+        if not children:
+            self.log("Выберите категорию с подкатегориями-шагами")
+            return
+        self.scenario = []
+        for name in children:
+            entries = self.catalog.category(path + (name,))
+            for kind in (catalog.KIND_PHRASE, catalog.KIND_ME):
+                first = next((e for e in entries if e.kind == kind), None)
+                if first is not None:
+                    self.add_scenario_step(first.id)
+        self.show_scenario()
+
+    @Slot()
+    def on_scenario_clear(self):
+        self.scenario = []
+        self.show_scenario()
+
+    @Slot()
+    def on_scenario_selected(self, name: str):
+        self.scenario = [dict(step) for step in self.config.get("scenarios", {}).get(name, [])]
+        self.show_scenario()
+
+    @Slot()
+    def on_scenario_save(self):
+        if not self.scenario:
+            return
+        current = self.scenario_combo.currentText()
+        name, ok = QInputDialog.getText(self, "Сценарий", "Название:",
+                                        text="" if current == NEW_SCENARIO else current)
+        name = name.strip()
+        if not ok or not name or name == NEW_SCENARIO:
+            return
+        scenarios = dict(self.config.get("scenarios", {}))
+        scenarios[name] = [dict(step) for step in self.scenario]
+        self.store.update({"scenarios": scenarios})
+        if self.scenario_combo.findText(name) < 0:
+            self.scenario_combo.addItem(name)
+        self.scenario_combo.setCurrentText(name)
+
+    @Slot()
+    def on_scenario_delete(self):
+        name = self.scenario_combo.currentText()
+        scenarios = dict(self.config.get("scenarios", {}))
+        if scenarios.pop(name, None) is None:
+            return
+        self.store.update({"scenarios": scenarios})
+        self.scenario_combo.removeItem(self.scenario_combo.findText(name))
+
+    @Slot()
+    def on_scenario_play(self):
+        # Текст шагов рендерится сейчас, с текущим профилем
+        steps = []
+        for step in self.scenario:
+            entry = self.catalog.get(step["id"])
+            if entry is not None:
+                steps.append({"text": self.render_entry(entry), "kind": entry.kind, "delay": step["delay"]})
+        if not steps:
+            self.log("Сценарий пуст")
+            return
+        self.send_scenario(steps)
+
+    def on_ack(self, ack):
+        text = self.pending_acks.get(ack.get("id"))
+        if text is None:
+            return
+        status = ack.get("status")
+        if status == "limited":
+            self.log(f"Сервер отбросил реплику: слишком частая отправка: {text}")
+            return
+        if status != "typed":
+            self.log(f"Приёмник не ввёл реплику ({status}): {text}")
+            return
+        # Подтверждений может быть несколько (по одному от каждого приёмника)
+        stages = self.latency.observe_stamps(ack.get("ts") or {})
+        details = ", ".join(f"{name} {ms:.0f}" for name, ms in stages.items() if name != "total")
+        self.log(f"Введено за {stages.get('total', 0):.0f} мс ({details}): {text}")
+
+    @Slot()
+    def on_latency_clicked(self):
+        for line in self.latency.report() or ["Подтверждений ещё не было"]:
+            self.log(f"Задержка {line}")
+
+    def send_message(self, text: str, kind: str = catalog.KIND_PHRASE):
+        # Вид фразы нужен приёмнику: речь вводится раньше /me.
+        # Во время обрыва реплика ждёт в очереди и уйдёт после переподключения.
+        # id и отметка времени - чтобы приёмник подтвердил ввод (ACK).
+        # Переотправка после обрыва идёт тем же кадром, то есть с тем же id
+        now = time.monotonic()
+        last = self.last_sent
+        repeat = last is not None and last[0] == text and now - last[2] < REPEAT_WINDOW
+        msg_id = last[1] if repeat else uuid.uuid4().hex[:16]
+        self.last_sent = (text, msg_id, now)
+        frame = protocol.message(text, kind=kind, id=msg_id, ts={"sent": time.time()})
+        if not self.net.send(frame):
             self.log("Не подключены к серверу. Невозможно отправить сообщение.")
             return
-        try:
-            self.socket.sendall((text + "\n").encode("utf-8"))
+        self.pending_acks[msg_id] = text
+        if len(self.pending_acks) > PENDING_ACKS:
+            self.pending_acks.popitem(last=False)
+        if repeat:
+            self.log(f"Повторный клик, ретранслятор не разошлёт реплику ещё раз: {text}")
+        elif self.connected:
             self.log(f"Отправлено: {text}")
-        except Exception as e:
-            self.log(f"Ошибка отправки: {e}")
+        else:
+            self.log(f"Нет связи, реплика отправится после переподключения: {text}")
+
+    def send_scenario(self, steps):
+        # Один кадр на весь сценарий; ACK придёт, когда приёмник введёт все шаги
+        msg_id = uuid.uuid4().hex[:16]
+        frame = protocol.scenario(steps, id=msg_id, ts={"sent": time.time()})
+        if not self.net.send(frame):
+            self.log("Не подключены к серверу. Невозможно отправить сценарий.")
+            return
+        description = f"сценарий из {len(steps)} шагов"
+        self.pending_acks[msg_id] = description
+        if len(self.pending_acks) > PENDING_ACKS:
+            self.pending_acks.popitem(last=False)
+        self.log(f"Отправлен {description}, займёт не меньше {sum(s['delay'] for s in steps):g} с")
+
+    def send_control(self, command: str):
+        if not self.net.send(protocol.control(command)):
+            self.log("Не подключены к серверу.")
+        else:
+            self.log(f"Команда приёмнику: {command}")
 
 
 def main():
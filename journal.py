@@ -0,0 +1,274 @@
+"""Журнал сообщений ретранслятора: сегменты JSON Lines со сквозными номерами.
+
+Каждая реплика и сценарий для приёмников получают номер seq и дописываются
+в журнал строкой {"seq": N, "t": время, "ch": канал, "k": тип кадра,
+"p": тело кадра}. Запись не стоит рассылке диска: append только кладёт
+строку в буфер, фоновый поток раз в fsync_interval секунд дописывает
+накопленное одним write и делает fsync. При падении сервера теряется не
+больше последнего интервала.
+
+Сегмент - файл <seq первой записи>.jsonl. Новый начинается, когда текущий
+больше segment_bytes или старше segment_seconds; старые удаляются, когда
+журнал больше retention_bytes или сегмент старше retention_seconds.
+
+Номер журнала (файл log.id) отличает его от журнала другого сервера или
+удалённого каталога: приёмник продолжает с сохранённого seq, только если
+номер совпал (replay).
+"""
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+import protocol
+
+SEGMENT_BYTES = 16 * 1024 * 1024
+SEGMENT_SECONDS = 3600
+RETENTION_BYTES = 256 * 1024 * 1024
+RETENTION_SECONDS = 24 * 3600
+FSYNC_INTERVAL = 0.2
+SUFFIX = ".jsonl"
+
+
+def _line_seq(line):
+    # Строка всегда начинается с {"seq":N, - номер без разбора всей строки
+    return int(line[7:line.index(b",")])
+
+
+class _Replay:
+    # Курсор досылки: до какого seq и места в каком сегменте уже прочитано
+    def __init__(self, after, channels, limit):
+        self.after = after
+        self.channels = channels
+        self.frames = deque(maxlen=limit)
+        self.total = 0
+        self.segment = None
+        self.offset = 0
+
+    def take(self, line):
+        seq = _line_seq(line)
+        if seq <= self.after:
+            return
+        self.after = seq  # строка и в файле, и ещё в writing - берём один раз
+        record = json.loads(line)
+        if record["ch"] not in self.channels:
+            return
+        payload = record["p"]
+        # Отметки доставки устарели - не портим ими гистограммы задержек
+        payload.pop("ts", None)
+        self.frames.append(protocol.encode_json(record["k"], payload))
+        self.total += 1
+
+
+class MessageLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, segment_seconds=SEGMENT_SECONDS,
+                 retention_bytes=RETENTION_BYTES, retention_seconds=RETENTION_SECONDS,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.fsync_interval = fsync_interval
+        # lock - номера и буфер; ретранслятор держит его и на время рассылки,
+        # чтобы порядок seq совпадал с порядком в очередях приёмников.
+        # io_lock - файлы: запись буфера и чтение при досылке
+        self.lock = threading.RLock()
+        self.io_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.buffer = []  # (seq, строка) ещё не записанные
+        self.writing = []  # пачка, которую сейчас пишет поток
+        self.closed = False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        id_path = self.directory / "log.id"
+        if id_path.exists():
+            self.log_id = id_path.read_text(encoding="utf-8").strip()
+        else:
+            self.log_id = uuid.uuid4().hex[:16]
+            id_path.write_text(self.log_id, encoding="utf-8")
+        self.segments = sorted(int(p.name[:-len(SUFFIX)]) for p in self.directory.glob(f"*{SUFFIX}")
+                               if p.name[:-len(SUFFIX)].isdigit())
+        self.last_seq = self._recover()
+        self.file = None
+        self.file_started = 0.0
+        self.dirty = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _path(self, first_seq):
+        return self.directory / f"{first_seq:020d}{SUFFIX}"
+
+    def _recover(self):
+        # Номер последней записи; недописанный при падении хвост обрезается
+        if not self.segments:
+            return 0
+        path = self._path(self.segments[-1])
+        with open(path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        lines = data[:end].splitlines()
+        return _line_seq(lines[-1]) if lines else self.segments[-1] - 1
+
+    def append(self, channel, kind, make_frame):
+        # make_frame(seq) -> кадр с этим номером; возвращает кадр
+        with self.lock:
+            seq = self.last_seq + 1
+            frame = make_frame(seq)
+            payload = frame[protocol.HEADER.size:]
+            line = b'{"seq":%d,"t":%.3f,"ch":%s,"k":%d,"p":%s}\n' % (
+                seq, time.time(), json.dumps(channel, ensure_ascii=False).encode("utf-8"), kind, payload)
+            self.buffer.append((seq, line))
+            self.last_seq = seq
+        return frame
+
+    def replay(self, log_id, after, channels, limit):
+        # Первая часть досылки, без self.lock: файлы журнала читаются и
+        # разбираются, пока ретранслятор рассылает. Возвращает курсор для
+        # replay_tail или None, если журнал чужой
+        if log_id != self.log_id or not isinstance(after, int):
+            return None
+        # Размер под io_lock - граница целой строки; last_seq после него: всё,
+        # что до этого размера, имеет номер не больше last
+        with self.io_lock:
+            segments = list(self.segments)
+            try:
+                size = self.file.tell() if self.file is not None else \
+                    os.path.getsize(self._path(segments[-1])) if segments else 0
+            except OSError:
+                size = 0
+        last = self.last_seq
+        cursor = _Replay(min(after, last), channels, limit)
+        if after >= last:
+            # Приёмник не отстал: файлы не читаем, только то, что допишут до подписки
+            if segments:
+                cursor.segment, cursor.offset = segments[-1], size
+            return cursor
+        self._read_files(cursor)
+        return cursor
+
+    def replay_tail(self, cursor):
+        # Вторая часть, под self.lock, чтобы между досылкой и подпиской ничего
+        # не проскочило: дописанное в файлы после replay (обычно доли секунды
+        # записей), пачка в записи и буфер. Возвращает (кадры, сколько
+        # пропущено сверх limit)
+        if cursor is None:
+            return [], 0
+        self._read_files(cursor)
+        for _, line in self.writing + self.buffer:
+            cursor.take(line)
+        return list(cursor.frames), cursor.total - len(cursor.frames)
+
+    def _read_files(self, cursor):
+        # Только целые строки: хвост последнего сегмента могут дописывать
+        # прямо сейчас, его прочтёт следующий вызов с того же места
+        segments = list(self.segments)
+        start = max(0, bisect.bisect_right(segments, cursor.after + 1) - 1)
+        for first in segments[start:]:
+            offset = cursor.offset if first == cursor.segment else 0
+            try:
+                with open(self._path(first), "rb") as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        offset += len(line)
+                        cursor.take(line)
+            except FileNotFoundError:
+                continue  # удалён по сроку хранения, пока читали
+            cursor.segment, cursor.offset = first, offset
+
+    def _write_pending(self, sync):
+        # Порядок блокировок: write_lock, затем lock и io_lock по отдельности -
+        # replay держит lock и ждёт io_lock, поэтому здесь они не вкладываются
+        with self.write_lock:
+            with self.lock:
+                pending, self.buffer = self.buffer, []
+                self.writing = pending
+            with self.io_lock:
+                self._write(pending, sync)
+            with self.lock:
+                self.writing = []
+
+    def _write(self, pending, sync):
+        if pending:
+            now = time.time()
+            if self.file is None or self.file.tell() >= self.segment_bytes or \
+                    now - self.file_started >= self.segment_seconds:
+                self._roll(pending[0][0], now)
+            self.file.write(b"".join(line for _, line in pending))
+            self.file.flush()
+            self.dirty = True
+        if sync and self.dirty:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def _roll(self, first_seq, now):
+        # Под io_lock: закрываем сегмент и начинаем новый с записи first_seq
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+            self.file.close()
+        if self.segments and self.segments[-1] >= first_seq:
+            # Пустой последний сегмент после перезапуска: дописываем его же
+            first_seq = self.segments[-1]
+        else:
+            self.segments.append(first_seq)
+        self.file = open(self._path(first_seq), "ab")
+        self.file_started = now
+        self._retain(now)
+
+    def _retain(self, now):
+        # Под io_lock; текущий сегмент не удаляется
+        sizes = []
+        for first in self.segments:
+            try:
+                stat = self._path(first).stat()
+            except FileNotFoundError:
+                stat = None
+            sizes.append(stat)
+        total = sum(s.st_size for s in sizes if s is not None)
+        while len(self.segments) > 1:
+            stat = sizes[0]
+            if stat is not None and total <= self.retention_bytes and \
+                    now - stat.st_mtime <= self.retention_seconds:
+                break
+            try:
+                self._path(self.segments[0]).unlink()
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size if stat is not None else 0
+            del self.segments[0]
+            del sizes[0]
+
+    def _run(self):
+        while not self.closed:
+            time.sleep(self.fsync_interval)
+            try:
+                self._write_pending(sync=True)
+            except OSError as e:
+                print(f"[Журнал] Ошибка записи: {e}")
+
+    def stats(self):
+        with self.io_lock:
+            size = 0
+            for first in self.segments:
+                try:
+                    size += self._path(first).stat().st_size
+                except FileNotFoundError:
+                    pass
+            segments = len(self.segments)
+        return {"last_seq": self.last_seq, "pending": len(self.buffer), "segments": segments, "bytes": size}
+
+    def close(self):
+        self.closed = True
+        self._write_pending(sync=True)
+        with self.write_lock, self.io_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,123 @@
+"""Задержки доставки реплик по этапам.
+
+Сообщение с "id" несёт словарь отметок времени "ts" (time.time(), секунды):
+sent - отправитель, relay_in / relay_out - ретранслятор приняло и собрало
+кадр для подписчиков, recv - приёмник прочитал, dequeue - планировщик взял
+строку в ввод, typed - ввод закончен. Приёмник возвращает отметки в ACK,
+ретранслятор доставляет ACK отправителю.
+
+Этап - разность двух отметок. Отметки ставят разные машины, так что сетевые
+этапы включают расхождение их часов; этапы внутри одного процесса точные.
+"""
+import bisect
+import math
+import threading
+
+# (этап, начальная отметка, конечная отметка)
+STAGES = (
+    ("network_in", "sent", "relay_in"),
+    ("relay", "relay_in", "relay_out"),
+    ("network_out", "relay_out", "recv"),
+    ("network", "sent", "recv"),  # напрямую в main.py, без ретранслятора
+    ("queue", "recv", "dequeue"),
+    ("typing", "dequeue", "typed"),
+    ("total", "sent", "typed"),
+)
+
+# Отметки в порядке этапов
+STAMPS = ("sent", "relay_in", "relay_out", "recv", "dequeue", "typed")
+
+# Верхние границы корзин, мс
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+def is_stamp(value):
+    # Отметка - конечное число; bool в Python тоже int, но отметкой не считается
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def clean_stamps(ts):
+    # Отметки от клиента: только известные и числовые, остальное выбрасываем
+    if not isinstance(ts, dict):
+        return {}
+    return {name: value for name, value in ts.items() if name in STAMPS and is_stamp(value)}
+
+
+def stage_durations(ts):
+    # {этап: мс} для этапов, у которых есть обе отметки; нечисловые пропускаются
+    result = {}
+    if not isinstance(ts, dict):
+        return result
+    for name, start, end in STAGES:
+        if name == "network" and "relay_in" in ts:
+            continue
+        if is_stamp(ts.get(start)) and is_stamp(ts.get(end)):
+            result[name] = max(0.0, (ts[end] - ts[start]) * 1000)
+    return result
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - больше всех границ
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, ms):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.sum += ms
+            if ms > self.max:
+                self.max = ms
+
+    def percentile(self, q):
+        # Оценка сверху: граница корзины, в которую попал q-й процентиль
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return float(self.buckets[i]) if i < len(self.buckets) else self.max
+            return self.max
+
+    def summary(self):
+        if not self.count:
+            return "нет данных"
+        return (f"n={self.count}, среднее {self.sum / self.count:.1f} мс, "
+                f"p50<={self.percentile(0.5):g} мс, p99<={self.percentile(0.99):g} мс, "
+                f"max {self.max:.1f} мс")
+
+
+class StageStats:
+    # Гистограммы по этапам; наполняется отметками из ACK или локальными замерами
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            return hist
+
+    def observe(self, name, ms):
+        self.histogram(name).observe(ms)
+
+    def observe_stamps(self, ts):
+        durations = stage_durations(ts)
+        for name, ms in durations.items():
+            self.observe(name, ms)
+        return durations
+
+    def report(self):
+        order = [name for name, _, _ in STAGES]
+        with self.lock:
+            names = sorted(self.histograms, key=lambda n: (order.index(n) if n in order else len(order), n))
+        return [f"{name}: {self.histograms[name].summary()}" for name in names]
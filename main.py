@@ -1,42 +1,72 @@
+import argparse
+import logging
 import socket
-import keyboard
-import time
+
+import output
+import protocol
 
 HOST = '0.0.0.0'
 PORT = 12345
+PAUSE = 0.5  # пауза перед вводом строки
 
-def simulate_typing(text):
-    time.sleep(0.5)
-    print(f"[DEBUG] Вводим символы:")
-    for ch in text:
-        print(f"[DEBUG] '{ch}'", end=' ', flush=True)
-        keyboard.write(ch)
-        time.sleep(0.03)
-    print()
-    keyboard.send('enter')
-
-def start_server():
-    print(f"[Сервер] Ожидание подключения на {HOST}:{PORT}...")
+def start_server(scheduler, host=HOST, port=PORT):
+    # Клавиатурой владеет планировщик в своём потоке; цикл ниже только читает
+    # сокет и кладёт строки в очередь, так что приём не ждёт ввода
+    print(f"[Сервер] Ожидание подключения на {host}:{port}...")
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
+        s.bind((host, port))
         s.listen()
         while True:
             conn, addr = s.accept()
             print(f"[Сервер] Подключён клиент: {addr}")
             with conn:
-                buffer = ""
-                while True:
-                    data = conn.recv(1024)
-                    if not data:
-                        print(f"[Сервер] Клиент {addr} отключился")
-                        break
-                    buffer += data.decode('utf-8')
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.rstrip()
-                        if line:
-                            print(f"[Сервер] Вводим: '{line}'")
-                            simulate_typing(line)
+                decoder = protocol.FrameDecoder()
+                # Глубина очереди и подтверждения ввода - обратно отправителю
+                output.Uplink(conn).attach(scheduler)
+                try:
+                    while True:
+                        data = conn.recv(4096)
+                        if not data:
+                            print(f"[Сервер] Клиент {addr} отключился")
+                            break
+                        # Все кадры, завершившиеся в этом куске, разбираются за один проход
+                        for kind, payload in decoder.feed(data):
+                            line = output.dispatch_frame(scheduler, kind, payload)
+                            if line:
+                                print(f"[Сервер] В очередь ввода ({scheduler.depth()}): '{line}'")
+                except protocol.ProtocolError as e:
+                    print(f"[Сервер] Ошибка протокола от {addr}: {e}")
+                except OSError as e:
+                    print(f"[Сервер] Ошибка соединения с {addr}: {e}")
+                finally:
+                    output.Uplink.detach(scheduler)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ввод принятых реплик в окно игры")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backend", choices=output.BACKENDS, default="keys",
+                        help="keys - эмуляция клавиатуры, paste - вставка через буфер обмена, "
+                             "fake - ввод в память без клавиатуры")
+    parser.add_argument("--rate", type=float, default=output.RATE,
+                        help="для keys: символов в секунду, 0 - без ограничения")
+    parser.add_argument("--batch", type=int, default=output.BATCH,
+                        help="для keys: символов за одно нажатие")
+    parser.add_argument("--pause", type=float, default=PAUSE,
+                        help="пауза перед вводом строки, с")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG - печатать каждый введённый кусок текста")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    start_server()
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format="%(message)s")
+    scheduler = output.OutputScheduler(output.make_backend(args.backend, args.rate, args.batch), args.pause)
+    try:
+        start_server(scheduler, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for line in scheduler.latency.report():
+            print(f"[Сервер] Задержка {line}")
@@ -0,0 +1,191 @@
+"""Метрики ретранслятора в текстовом формате Prometheus.
+
+Счётчики клиента (ClientStats) меняет только поток или задача, которая этим
+клиентом владеет: чтение - обработчик соединения, запись - писатель
+приёмника, поэтому на горячем пути нет блокировок, только сложение.
+Реестр знает живых клиентов и суммы по отключившимся; глубины очередей и
+число соединений не ведутся на каждом сообщении, а считаются при запросе
+метрик. Режим выборки (sample_every > 1) замеряет время рассылки и этапы
+доставки только у каждого N-го сообщения.
+
+Метрики отдаются только локально: TCP на 127.0.0.1 или Unix-сокет.
+Ответ - HTTP/1.0 с телом text/plain, подходит и для Prometheus, и для curl.
+"""
+import os
+import socket
+import threading
+
+import latency
+
+PREFIX = "rp"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+COUNTERS = ("messages_in", "bytes_in", "messages_out", "bytes_out", "send_errors")
+
+
+class ClientStats:
+    __slots__ = ("addr", "role") + COUNTERS
+
+    def __init__(self, addr, role):
+        self.addr = addr
+        self.role = role
+        for name in COUNTERS:
+            setattr(self, name, 0)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_label(v)}"' for k, v in labels.items()) + "}"
+
+
+class Registry:
+    def __init__(self, sample_every=1):
+        self.sample_every = max(1, sample_every)
+        self.clients = set()
+        self.retired = dict.fromkeys(COUNTERS, 0)  # суммы по отключившимся
+        self.events = {"receivers_removed": 0, "protocol_errors": 0, "dedup_hits": 0, "replayed": 0, "reaped": 0,
+                       "rate_limited": 0}
+        self.fanout = latency.Histogram()
+        self.gauges = []  # функции () -> [(имя, метки, значение)], вызываются при запросе
+        self.lock = threading.Lock()
+        self._tick = 0
+
+    def sample(self) -> bool:
+        # Счётчик выборки без блокировки: потерянный под гонкой тик не страшен
+        if self.sample_every == 1:
+            return True
+        self._tick += 1
+        return self._tick % self.sample_every == 0
+
+    def client(self, addr, role):
+        stats = ClientStats(addr, role)
+        with self.lock:
+            self.clients.add(stats)
+        return stats
+
+    def release(self, stats):
+        with self.lock:
+            if stats not in self.clients:
+                return
+            self.clients.discard(stats)
+            for name in COUNTERS:
+                self.retired[name] += getattr(stats, name)
+
+    def event(self, name, n=1):
+        # Редкие события (отключение медленного приёмника, ошибка протокола)
+        with self.lock:
+            self.events[name] = self.events.get(name, 0) + n
+
+    def add_gauges(self, func):
+        self.gauges.append(func)
+
+    def render(self, stages=None):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{full}{suffix}{_labels(**labels)} {value:g}")
+
+        with self.lock:
+            clients = sorted(self.clients, key=lambda c: (c.role, str(c.addr)))
+            totals = dict(self.retired)
+            events = dict(self.events)
+        for stats in clients:
+            for name in COUNTERS:
+                totals[name] += getattr(stats, name)
+
+        roles = {}
+        for stats in clients:
+            roles[stats.role] = roles.get(stats.role, 0) + 1
+        metric("clients", "gauge", "Подключённые клиенты по ролям",
+               [("", {"role": role}, roles.get(role, 0)) for role in ("sender", "receiver")])
+        for name in COUNTERS:
+            metric(f"{name}_total", "counter", f"{name} по всем клиентам, включая отключившихся",
+                   [("", {}, totals[name])])
+            metric(f"client_{name}_total", "counter", f"{name} по подключённым клиентам",
+                   [("", {"client": f"{c.addr[0]}:{c.addr[1]}" if isinstance(c.addr, tuple) else c.addr,
+                          "role": c.role}, getattr(c, name)) for c in clients])
+        for name, value in sorted(events.items()):
+            metric(f"{name}_total", "counter", name, [("", {}, value)])
+        metric("sample_every", "gauge", "Замеряется каждое N-е сообщение", [("", {}, self.sample_every)])
+        self._histogram(metric, "fanout_ms", "Время рассылки сообщения по очередям подписчиков",
+                        {"": self.fanout})
+        if stages is not None:
+            self._histogram(metric, "delivery_stage_ms", "Этапы доставки по ACK (latency.STAGES)",
+                            dict(stages.histograms), label="stage")
+        for func in self.gauges:
+            by_name = {}
+            for name, labels, value in func():
+                by_name.setdefault(name, []).append(("", labels, value))
+            for name, samples in by_name.items():
+                metric(name, "gauge", name, samples)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram(metric, name, help_text, histograms, label=None):
+        samples = []
+        for key, hist in sorted(histograms.items()):
+            base = {label: key} if label else {}
+            with hist.lock:
+                counts = list(hist.counts)
+                count, total = hist.count, hist.sum
+            seen = 0
+            for bound, n in zip(list(hist.buckets) + ["+Inf"], counts):
+                seen += n
+                samples.append(("_bucket", {**base, "le": bound}, seen))
+            samples.append(("_sum", base, total))
+            samples.append(("_count", base, count))
+        metric(name, "histogram", help_text, samples)
+
+
+registry = Registry()
+
+
+def _respond(conn, body_func):
+    try:
+        conn.settimeout(2)
+        conn.recv(4096)  # запрос не разбираем: любой путь отдаёт метрики
+        body = body_func().encode("utf-8")
+        conn.sendall(
+            f"HTTP/1.0 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+        )
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+
+def serve(body_func, port=None, unix_path=None):
+    # Поток, отдающий метрики; адрес только локальный
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.unlink(unix_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(unix_path)
+        os.chmod(unix_path, 0o600)
+        where = unix_path
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", port))
+        where = f"127.0.0.1:{port}"
+    sock.listen(16)
+
+    def loop():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            _respond(conn, body_func)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return where
@@ -0,0 +1,456 @@
+"""Вывод реплик в окно игры.
+
+Бэкенды с одним методом type_line(text): текст и Enter.
+- keys: эмуляция клавиатуры кусками по `batch` символов с заданной
+  скоростью (символов в секунду), а не по символу со sleep;
+- paste: строка целиком через буфер обмена и Ctrl+V, прежнее содержимое
+  буфера возвращается;
+- fake: та же нарезка и темп, но нажатия пишутся в память (FakeKeys) -
+  для замеров и проверки без окна и прав на ввод, в том числе на Linux.
+
+Библиотеки keyboard и pyperclip нужны только выбранному бэкенду и
+импортируются при его создании.
+
+OutputScheduler - единственный владелец клавиатуры: сетевой поток только
+кладёт строки в его очередь и сразу читает дальше, ввод идёт в отдельном
+потоке. Очередь с приоритетами (речь раньше /me), одинаковые ждущие
+строки склеиваются, flush и cancel чистят очередь, об изменении глубины
+очереди сообщается через on_depth. Для строк с "id" планировщик ставит
+отметки dequeue/typed и отдаёт итог в on_done - приёмник шлёт по нему ACK.
+
+Сценарий (play) проигрывается здесь же, без сети: в очереди всегда только
+его текущий шаг, следующий встаёт в неё через свою паузу после ввода
+предыдущего. Между шагами успевают вводиться другие строки, flush и cancel
+выбрасывают и остаток сценария, ACK - один на весь сценарий.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import latency
+import protocol
+
+log = logging.getLogger("output")
+
+BACKENDS = ("keys", "paste", "fake")
+RATE = 400  # символов в секунду, 0 - без ограничения
+BATCH = 20  # символов за одно обращение к клавиатуре
+ENTER_DELAY = 0.05  # пауза перед Enter, чтобы игра успела принять текст
+
+# Меньше - раньше. Речь - ответ собеседнику, /me может подождать
+PRIORITIES = {"phrase": 0, "me": 1}
+DEFAULT_PRIORITY = 0
+
+
+class Playback:
+    # Сценарий на приёмнике: шаги, номер текущего и отметки для общего ACK.
+    # aborted - сценарий выброшен flush/cancel, пока вводился его шаг
+    __slots__ = ("steps", "index", "msg_id", "ts", "aborted")
+
+    def __init__(self, steps, msg_id, ts):
+        self.steps = steps
+        self.index = 0
+        self.msg_id = msg_id
+        self.ts = ts
+        self.aborted = False
+
+
+def _wait(cancel, delay):
+    # Пауза, которую прерывает отмена; True - ввод отменён
+    if cancel is None:
+        time.sleep(delay)
+        return False
+    return cancel.wait(delay)
+
+
+class FakeKeys:
+    # Клавиатура в памяти: (время, "write" или "send", текст)
+    def __init__(self):
+        self.events = []
+
+    def write(self, text, delay=0):
+        self.events.append((time.monotonic(), "write", text))
+
+    def send(self, hotkey):
+        self.events.append((time.monotonic(), "send", hotkey))
+
+    def typed(self):
+        return "".join(text for _, kind, text in self.events if kind == "write")
+
+
+class FakeClipboard:
+    def __init__(self, text=""):
+        self.text = text
+
+    def copy(self, text):
+        self.text = text
+
+    def paste(self):
+        return self.text
+
+
+class KeystrokeBackend:
+    def __init__(self, keys, rate=RATE, batch=BATCH, enter_delay=ENTER_DELAY):
+        self.keys = keys
+        self.rate = rate
+        self.batch = max(1, batch)
+        self.enter_delay = enter_delay
+
+    def type_line(self, text, cancel=None):
+        # Темп держим по общему сроку, а не sleep после каждого куска:
+        # время самого ввода тоже идёт в счёт. Отмена проверяется между
+        # кусками; отменённая строка остаётся без Enter
+        deadline = time.monotonic()
+        for i in range(0, len(text), self.batch):
+            if cancel is not None and cancel.is_set():
+                return False
+            chunk = text[i:i + self.batch]
+            log.debug("[Ввод] %r", chunk)
+            self.keys.write(chunk)
+            if self.rate > 0:
+                deadline += len(chunk) / self.rate
+                delay = deadline - time.monotonic()
+                if delay > 0 and _wait(cancel, delay):
+                    return False
+        if self.enter_delay > 0 and _wait(cancel, self.enter_delay):
+            return False
+        self.keys.send("enter")
+        return True
+
+
+class PasteBackend:
+    def __init__(self, keys, clipboard, enter_delay=ENTER_DELAY):
+        self.keys = keys
+        self.clipboard = clipboard
+        self.enter_delay = enter_delay
+
+    def type_line(self, text, cancel=None):
+        if cancel is not None and cancel.is_set():
+            return False
+        try:
+            saved = self.clipboard.paste()
+        except Exception:
+            saved = None
+        log.debug("[Ввод] вставка %d символов", len(text))
+        self.clipboard.copy(text)
+        self.keys.send("ctrl+v")
+        done = not (self.enter_delay > 0 and _wait(cancel, self.enter_delay))
+        if done:
+            self.keys.send("enter")
+        if saved is not None:
+            self.clipboard.copy(saved)
+        return done
+
+
+def make_backend(name, rate=RATE, batch=BATCH, enter_delay=ENTER_DELAY):
+    if name == "keys":
+        import keyboard
+        return KeystrokeBackend(keyboard, rate, batch, enter_delay)
+    if name == "paste":
+        import keyboard
+        import pyperclip
+        return PasteBackend(keyboard, pyperclip, enter_delay)
+    if name == "fake":
+        return KeystrokeBackend(FakeKeys(), rate, batch, enter_delay)
+    raise ValueError(f"неизвестный бэкенд вывода: {name}")
+
+
+class OutputScheduler:
+    def __init__(self, backend, pause=0.0, on_depth=None, on_done=None):
+        self.backend = backend
+        self.pause = pause
+        self.on_depth = on_depth  # on_depth(глубина, идёт ли ввод); вызывается из любого потока
+        self.on_done = on_done  # on_done(id, итог, отметки) для строк с id
+        self.heap = []  # (приоритет, порядковый номер, текст, id, отметки, Playback или None)
+        self.delayed = []  # (срок time.monotonic(), порядковый номер, запись heap) - шаги сценариев в паузе
+        self.queued = set()  # тексты в очереди - для склейки повторов
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.cancel_event = threading.Event()
+        self.typing = False
+        self.current = None  # Playback, шаг которого сейчас вводится
+        self.closed = False
+        self.stats = {"typed": 0, "coalesced": 0, "flushed": 0, "cancelled": 0, "scenarios": 0}
+        self.latency = latency.StageStats()  # queue и typing по всем строкам
+        self._reported = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def depth(self):
+        with self.cond:
+            return len(self.heap) + len(self.delayed)
+
+    def put(self, text, kind=None, priority=None, msg_id=None, ts=None) -> bool:
+        # False - такая строка уже ждёт ввода, повтор не добавлен
+        if priority is None:
+            priority = PRIORITIES.get(kind, DEFAULT_PRIORITY)
+        ts = dict(ts or {})
+        ts.setdefault("recv", time.time())
+        with self.cond:
+            coalesced = text in self.queued
+            if coalesced:
+                self.stats["coalesced"] += 1
+            else:
+                heapq.heappush(self.heap, (priority, next(self.order), text, msg_id, ts, None))
+                self.queued.add(text)
+                self.cond.notify()
+        if coalesced:
+            self._done(msg_id, "coalesced", ts)
+            return False
+        self._report()
+        return True
+
+    def play(self, steps, msg_id=None, ts=None) -> bool:
+        # steps - [{"text", "kind", "delay"}] после protocol.scenario_steps
+        if not steps:
+            return False
+        ts = dict(ts or {})
+        ts.setdefault("recv", time.time())
+        with self.cond:
+            self.stats["scenarios"] += 1
+            self._schedule_step(Playback(steps, msg_id, ts))
+        self._report()
+        return True
+
+    def _schedule_step(self, playback):
+        # Под self.cond. Шаги не склеиваются с одинаковыми строками в очереди:
+        # пропавший шаг оборвал бы сценарий
+        step = playback.steps[playback.index]
+        entry = (PRIORITIES.get(step["kind"], DEFAULT_PRIORITY), next(self.order), step["text"], None, {}, playback)
+        if step["delay"] > 0:
+            heapq.heappush(self.delayed, (time.monotonic() + step["delay"], entry[1], entry))
+        else:
+            entry[4]["recv"] = time.time()
+            heapq.heappush(self.heap, entry)
+        self.cond.notify()
+
+    def _promote(self):
+        # Под self.cond: шаги, у которых кончилась пауза, - в очередь ввода
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            entry = heapq.heappop(self.delayed)[2]
+            entry[4]["recv"] = time.time()
+            heapq.heappush(self.heap, entry)
+
+    def flush(self, current_status="flushed"):
+        # Выбрасывает очередь и остаток сценария, шаг которого сейчас вводится:
+        # run() не поставит его следующий шаг, ACK сценария уходит отсюда
+        with self.cond:
+            dropped = self.heap + [entry for _, _, entry in self.delayed]
+            self.heap = []
+            self.delayed = []
+            self.queued.clear()
+            current = self.current
+            if current is not None and not current.aborted:
+                current.aborted = True
+            else:
+                current = None
+            self.stats["flushed"] += len(dropped) + (current is not None)
+        if current is not None:
+            self._done(current.msg_id, current_status, current.ts)
+        for _, _, _, msg_id, ts, playback in dropped:
+            if playback is not None:
+                self._done(playback.msg_id, "flushed", playback.ts)
+            else:
+                self._done(msg_id, "flushed", ts)
+        self._report()
+        return len(dropped) + (current is not None)
+
+    def cancel(self):
+        # Чистим очередь и прерываем текущую строку; сценарий с ней - cancelled
+        self.cancel_event.set()
+        return self.flush("cancelled")
+
+    def control(self, command):
+        if command == "flush":
+            return self.flush()
+        if command == "cancel":
+            return self.cancel()
+        raise ValueError(f"неизвестная команда очереди ввода: {command}")
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.cancel_event.set()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    self._promote()
+                    if self.heap:
+                        break
+                    self.cond.wait(self.delayed[0][0] - time.monotonic() if self.delayed else None)
+                if self.closed:
+                    return
+                _, _, text, msg_id, ts, playback = heapq.heappop(self.heap)
+                if playback is None:
+                    self.queued.discard(text)
+                self.current = playback
+                self.typing = True
+                self.cancel_event.clear()
+            ts["dequeue"] = time.time()
+            self._report()
+            done = False
+            try:
+                if not (self.pause > 0 and self.cancel_event.wait(self.pause)):
+                    done = self.backend.type_line(text, self.cancel_event)
+            except Exception as e:
+                print(f"[Ввод] Ошибка ввода: {e}")
+            if done:
+                ts["typed"] = time.time()
+                self.latency.observe_stamps({k: ts[k] for k in ("recv", "dequeue", "typed")})
+            finished = False
+            with self.cond:
+                self.typing = False
+                self.current = None
+                self.stats["typed" if done else "cancelled"] += 1
+                aborted = playback is not None and playback.aborted
+                if playback is not None and done and not aborted:
+                    # Отметки сценария - по первому шагу: паузы между шагами
+                    # задал отправитель, в задержку доставки они не входят
+                    playback.ts.setdefault("dequeue", ts["dequeue"])
+                    playback.ts.setdefault("typed", ts["typed"])
+                    playback.index += 1
+                    finished = playback.index >= len(playback.steps)
+                    if not finished:
+                        self._schedule_step(playback)
+            if playback is None:
+                self._done(msg_id, "typed" if done else "cancelled", ts)
+            elif aborted:
+                # Сценарий выброшен во время шага - ACK уже отдал flush/cancel
+                pass
+            elif not done:
+                # Прерванный шаг обрывает и весь сценарий
+                self._done(playback.msg_id, "cancelled", playback.ts)
+            elif finished:
+                self._done(playback.msg_id, "typed", playback.ts)
+            self._report()
+
+    def _done(self, msg_id, status, ts):
+        callback = self.on_done
+        if msg_id is None or callback is None:
+            return
+        try:
+            callback(msg_id, status, ts)
+        except Exception as e:
+            log.debug("[Ввод] Не удалось отправить подтверждение: %s", e)
+
+    def _report(self):
+        callback = self.on_depth
+        if callback is None:
+            return
+        with self.cond:
+            state = (len(self.heap) + len(self.delayed), self.typing)
+            if state == self._reported:
+                return
+            self._reported = state
+        try:
+            callback(*state)
+        except Exception as e:
+            log.debug("[Ввод] Не удалось сообщить глубину очереди: %s", e)
+
+
+class Cursor:
+    # Место приёмника в журнале ретранслятора (journal.py): номер журнала и
+    # последний принятый seq. Переживает переподключение и уходит в HELLO
+    def __init__(self):
+        self.log = None
+        self.seq = 0
+
+    def resume(self):
+        return {"resume": {"log": self.log, "seq": self.seq}} if self.log else {}
+
+    def relay_hello(self, info):
+        # HELLO ретранслятора идёт после досылки: дальше - живые реплики
+        seq = info.get("seq") if isinstance(info.get("seq"), int) else 0
+        if info.get("log") != self.log:
+            self.log = info.get("log")
+            self.seq = seq
+        else:
+            self.seq = max(self.seq, seq)
+
+    def accept(self, msg) -> bool:
+        # False - реплика уже была (seq не больше принятого)
+        seq = msg.get("seq")
+        if not isinstance(seq, int):
+            return True
+        if seq <= self.seq and self.log is not None:
+            return False
+        self.seq = seq
+        return True
+
+
+def dispatch_frame(scheduler, kind, payload, cursor=None):
+    # Кадр от отправителя или ретранслятора -> очередь ввода. Возвращает
+    # принятый текст или None; разбор и постановка в очередь, без ввода
+    if kind == protocol.HELLO:
+        if cursor is not None:
+            cursor.relay_hello(protocol.decode_json(payload))
+        return None
+    if kind == protocol.MSG:
+        received = time.time()
+        msg = protocol.decode_json(payload)
+        if cursor is not None and not cursor.accept(msg):
+            return None
+        text = str(msg.get("text", "")).strip()
+        if not text:
+            return None
+        priority = msg.get("priority")
+        msg_id = msg.get("id") if isinstance(msg.get("id"), str) else None
+        ts = msg.get("ts") if isinstance(msg.get("ts"), dict) else {}
+        ts["recv"] = received
+        scheduler.put(text, msg.get("kind"), priority if isinstance(priority, int) else None, msg_id, ts)
+        return text
+    if kind == protocol.SCENARIO:
+        received = time.time()
+        msg = protocol.decode_json(payload)
+        if cursor is not None and not cursor.accept(msg):
+            return None
+        steps = protocol.scenario_steps(msg)
+        if not steps:
+            return None
+        msg_id = msg.get("id") if isinstance(msg.get("id"), str) else None
+        ts = msg.get("ts") if isinstance(msg.get("ts"), dict) else {}
+        ts["recv"] = received
+        scheduler.play(steps, msg_id, ts)
+        return f"сценарий из {len(steps)} шагов"
+    if kind == protocol.CONTROL:
+        command = protocol.decode_json(payload).get("command")
+        if command in protocol.COMMANDS:
+            dropped = scheduler.control(command)
+            print(f"[Ввод] Команда {command}: убрано из очереди {dropped}")
+    return None
+
+
+class Uplink:
+    # Кадры наверх по тому же сокету: STATUS (on_depth) и ACK (on_done).
+    # Шлют и сетевой поток, и поток ввода, поэтому под своей блокировкой
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def _send(self, frame):
+        with self.lock:
+            self.sock.sendall(frame)
+
+    def status(self, depth, typing):
+        self._send(protocol.status(depth, typing=typing))
+
+    def ack(self, msg_id, status, ts):
+        self._send(protocol.ack(msg_id, status, ts))
+
+    def pong(self, t):
+        self._send(protocol.pong(t))
+
+    def attach(self, scheduler):
+        scheduler.on_depth = self.status
+        scheduler.on_done = self.ack
+
+    @staticmethod
+    def detach(scheduler):
+        scheduler.on_depth = None
+        scheduler.on_done = None
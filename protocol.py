@@ -0,0 +1,166 @@
+"""Кадровый протокол между отправителями, ретранслятором и приёмниками.
+
+Кадр: заголовок ">BBBI" (MAGIC, VERSION, тип, длина) + тело длиной `длина` байт.
+MAGIC - байт 0xA7: в UTF-8 он не может начинать символ, так что старый
+текстовый клиент сразу отличается от нового. Тела кадров - JSON в UTF-8,
+тело целиком декодируется только после того, как пришло полностью, поэтому
+русский символ, разрезанный границей recv, больше не ломает декодирование.
+"""
+import json
+import struct
+
+MAGIC = 0xA7
+VERSION = 1
+HEADER = struct.Struct(">BBBI")
+MAX_PAYLOAD = 1 << 20
+
+# Типы кадров
+# HELLO отправителя: "client" - его постоянный id на время работы клиента.
+# По нему ретранслятор узнаёт повторно присланные id сообщений, в том числе
+# после переподключения.
+# HELLO приёмника: "resume" - номер журнала (journal.py) и последний
+# полученный seq, с них приёмник продолжает после обрыва.
+# HELLO ретранслятора - ответ приёмнику, когда журнал ведётся: номер журнала
+# и seq, после которого идут живые сообщения; пропущенное до него дослано.
+HELLO = 1  # {"role": "sender", "channel": "...", "client": "...", "heartbeat": true} | {"role": "receiver", "channels": [...], "resume": {"log": "...", "seq": N}, "heartbeat": true} | {"role": "relay", "log": "...", "seq": N}
+MSG = 2  # {"text": "...", "channel": "...", "kind": "phrase" | "me", "id": "...", "ts": {...}, "seq": N} - всё, кроме text, необязательно
+# Команда очереди ввода приёмника: flush - выбросить ждущие строки,
+# cancel - то же и прервать строку, которая вводится сейчас
+CONTROL = 3  # {"command": "flush" | "cancel", "channel": "..."}
+STATUS = 4  # {"depth": N, "typing": true} - приёмник сообщает наверх глубину очереди ввода
+# Подтверждение ввода строки с "id" (см. latency.py): приёмник -> ретранслятор -> отправитель.
+# Ретранслятор рассылает сообщение под своим id, а в ACK отправителю
+# возвращает его собственный: чужой отправитель с тем же id ACK не перехватит.
+# "limited" шлёт сам ретранслятор: очередь лимита отправителя полна (ratelimit.py)
+ACK = 5  # {"id": "...", "status": "typed" | "cancelled" | "flushed" | "coalesced" | "limited", "ts": {...}}
+# Сценарий: шаги по порядку, "delay" - пауза в секундах перед шагом (после
+# ввода предыдущего). Проигрывает приёмник сам, ACK - один на весь сценарий
+SCENARIO = 6  # {"steps": [{"text": "...", "kind": "phrase" | "me", "delay": 1.5}, ...], "channel": "...", "id": "...", "ts": {...}}
+# Пульс: ретранслятор шлёт PING каждому клиенту раз в "interval" секунд,
+# даже активному, клиент отвечает PONG с тем же "t". Клиент с "heartbeat": true в HELLO
+# обещает отвечать - если он молчит дольше тайм-аута, ретранслятор его
+# отключает. Клиент, получивший PING, может так же считать ретранслятор
+# мёртвым, если от него ничего не приходит несколько интервалов
+PING = 7  # {"t": время отправки, "interval": N}
+PONG = 8  # {"t": "t" из PING}
+
+COMMANDS = ("flush", "cancel")
+MAX_STEPS = 100
+MAX_STEP_DELAY = 600.0
+
+KIND_NAMES = {
+    HELLO: "HELLO",
+    MSG: "MSG",
+    CONTROL: "CONTROL",
+    STATUS: "STATUS",
+    ACK: "ACK",
+    SCENARIO: "SCENARIO",
+    PING: "PING",
+    PONG: "PONG",
+}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(kind: int, payload: bytes) -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Слишком большой кадр: {len(payload)} байт")
+    return HEADER.pack(MAGIC, VERSION, kind, len(payload)) + payload
+
+
+def encode_json(kind: int, obj) -> bytes:
+    return encode_frame(kind, json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_json(payload: bytes):
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ProtocolError(f"Некорректное тело кадра: {e}") from e
+
+
+def hello(role: str, **extra) -> bytes:
+    return encode_json(HELLO, {"role": role, **extra})
+
+
+def message(text: str, **extra) -> bytes:
+    return encode_json(MSG, {"text": text, **extra})
+
+
+def control(command: str, **extra) -> bytes:
+    return encode_json(CONTROL, {"command": command, **extra})
+
+
+def status(depth: int, **extra) -> bytes:
+    return encode_json(STATUS, {"depth": depth, **extra})
+
+
+def ack(msg_id: str, status: str, ts: dict, **extra) -> bytes:
+    return encode_json(ACK, {"id": msg_id, "status": status, "ts": ts, **extra})
+
+
+def ping(t: float, interval: float) -> bytes:
+    return encode_json(PING, {"t": t, "interval": interval})
+
+
+def pong(t) -> bytes:
+    return encode_json(PONG, {"t": t})
+
+
+def scenario(steps, **extra) -> bytes:
+    return encode_json(SCENARIO, {"steps": steps, **extra})
+
+
+def scenario_steps(obj):
+    # Шаги сценария после проверки: пустые строки выбрасываются,
+    # вид - phrase или me, пауза - от 0 до MAX_STEP_DELAY секунд
+    steps = obj.get("steps")
+    if not isinstance(steps, list) or len(steps) > MAX_STEPS:
+        raise ProtocolError("Некорректный сценарий: нужен список не больше чем из "
+                            f"{MAX_STEPS} шагов")
+    result = []
+    for step in steps:
+        if not isinstance(step, dict):
+            raise ProtocolError(f"Некорректный шаг сценария: {step!r}")
+        text = str(step.get("text", "")).strip()
+        if not text:
+            continue
+        delay = step.get("delay", 0)
+        if not isinstance(delay, (int, float)) or delay < 0:
+            delay = 0
+        kind = step.get("kind") if step.get("kind") in ("phrase", "me") else "phrase"
+        result.append({"text": text, "kind": kind, "delay": min(float(delay), MAX_STEP_DELAY)})
+    return result
+
+
+class FrameDecoder:
+    # Инкрементальный разбор: feed() принимает очередной кусок из recv и
+    # возвращает все кадры, которые в нём завершились. Недочитанный хвост
+    # остаётся в буфере, уже разобранные байты повторно не просматриваются.
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        buf = self.buffer
+        buf += data
+        frames = []
+        pos = 0
+        size = len(buf)
+        while size - pos >= HEADER.size:
+            magic, version, kind, length = HEADER.unpack_from(buf, pos)
+            if magic != MAGIC:
+                raise ProtocolError(f"Неверный маркер кадра: 0x{magic:02x}")
+            if version != VERSION:
+                raise ProtocolError(f"Неподдерживаемая версия протокола: {version}")
+            if length > MAX_PAYLOAD:
+                raise ProtocolError(f"Слишком большой кадр: {length} байт")
+            end = pos + HEADER.size + length
+            if end > size:
+                break
+            frames.append((kind, bytes(buf[pos + HEADER.size:end])))
+            pos = end
+        if pos:
+            del buf[:pos]
+        return frames
@@ -0,0 +1,322 @@
+"""Ограничение частоты и справедливая очередь отправителей ретранслятора.
+
+TokenBucket - rate реплик в секунду с запасом burst. Своя корзина у каждого
+отправителя и у каждого канала. Реплика, для которой есть токены и перед
+которой у этого отправителя никто не ждёт, рассылается сразу, без задержки.
+Иначе она встаёт в очередь своего отправителя (не больше backlog, лишние
+отбрасываются), и очереди разбираются по кругу с весами (deficit round
+robin): за круг отправитель с весом w отдаёт до w реплик. Флудящий
+отправитель копит очередь у себя, а реплики остальных идут как шли.
+
+Лимиты берутся из аргументов сервера и, если задан, из JSON-файла, который
+перечитывается при изменении - без перезапуска ретранслятора:
+
+    {"sender": {"rate": 5, "burst": 20}, "channel": {"rate": 20, "burst": 40},
+     "backlog": 50,
+     "senders": {"<client из HELLO>": {"rate": 20, "burst": 40, "weight": 2}},
+     "channels": {"ooc": {"rate": 0}}}
+
+rate 0 - без ограничения. В многопроцессном режиме лимиты у каждого воркера
+свои: отправитель живёт в одном воркере, а лимит канала делится на воркеров.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+SENDER_RATE = 10  # реплик в секунду на отправителя
+SENDER_BURST = 20
+CHANNEL_RATE = 0  # на канал, 0 - без ограничения
+CHANNEL_BURST = 50
+BACKLOG = 100  # реплик в очереди одного отправителя
+WEIGHT = 1
+MAX_SENDERS = 10000  # состояний отправителей без очереди, сверх - забываются старые
+MAX_CHANNELS = 1000  # корзин каналов, сверх - забываются давно не писавшие
+RELOAD_CHECK = 1.0  # как часто смотреть, не изменился ли файл лимитов
+# Допустимые значения полей лимита: (минимум, может ли быть равно минимуму)
+FIELD_MIN = {"rate": (0, True), "burst": (0, False), "weight": (1, True)}
+
+
+def _checked(limit, where):
+    # Копия лимита с проверенными числами; ValueError - если что-то не так
+    if not isinstance(limit, dict):
+        raise ValueError(f"{where}: ожидался объект, а не {limit!r}")
+    checked = dict(limit)
+    for key, (low, inclusive) in FIELD_MIN.items():
+        if key not in limit:
+            continue
+        value = limit[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) \
+                or value < low or (value == low and not inclusive):
+            bound = "не меньше" if inclusive else "больше"
+            raise ValueError(f"{where}.{key}: ожидалось число {bound} {low}, а не {value!r}")
+        checked[key] = float(value)
+    return checked
+
+
+def _checked_map(limits, where):
+    if not isinstance(limits, dict):
+        raise ValueError(f"{where}: ожидался объект, а не {limits!r}")
+    return {key: _checked(limit, f"{where}.{key}") for key, limit in limits.items()}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def configure(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def wait(self, now) -> float:
+        # Через сколько секунд будет токен; 0 - есть сейчас
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class Limits:
+    def __init__(self, sender_rate=SENDER_RATE, sender_burst=SENDER_BURST,
+                 channel_rate=CHANNEL_RATE, channel_burst=CHANNEL_BURST, backlog=BACKLOG, path=None):
+        self.defaults = {
+            "sender": {"rate": sender_rate, "burst": sender_burst, "weight": WEIGHT},
+            "channel": {"rate": channel_rate, "burst": channel_burst},
+            "backlog": backlog,
+        }
+        self.path = path
+        self.mtime = None
+        self.checked = 0.0
+        self.version = 0  # растёт при каждой загрузке файла
+        self.config = self.defaults
+        if path:
+            self.reload(force=True)
+
+    def reload(self, force=False) -> bool:
+        # True - лимиты поменялись. Ошибку в файле печатаем и оставляем прежние
+        now = time.monotonic()
+        if not self.path or (not force and now - self.checked < RELOAD_CHECK):
+            return False
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            with open(self.path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            if not isinstance(loaded, dict):
+                raise ValueError("ожидался объект JSON")
+            # Файл правят руками на живом сервере: неверное значение не должно
+            # дойти до корзин, иначе ошибка вылетит на каждой реплике
+            config = {
+                "sender": {**self.defaults["sender"], **_checked(loaded.get("sender", {}), "sender")},
+                "channel": {**self.defaults["channel"], **_checked(loaded.get("channel", {}), "channel")},
+                "backlog": loaded.get("backlog", self.defaults["backlog"]),
+                "senders": _checked_map(loaded.get("senders", {}), "senders"),
+                "channels": _checked_map(loaded.get("channels", {}), "channels"),
+            }
+            backlog = config["backlog"]
+            if isinstance(backlog, bool) or not isinstance(backlog, int) or backlog < 0:
+                raise ValueError(f"backlog: ожидалось целое не меньше 0, а не {backlog!r}")
+        except (OSError, ValueError) as e:
+            print(f"[Лимиты] Не удалось прочитать {self.path}, остаются прежние: {e}")
+            return False
+        self.config = config
+        self.version += 1
+        print(f"[Лимиты] Загружены из {self.path}: отправитель {config['sender']}, канал {config['channel']}")
+        return True
+
+    def sender(self, key):
+        # (rate, burst, weight) для отправителя
+        limit = {**self.config["sender"], **self.config.get("senders", {}).get(key, {})}
+        return float(limit["rate"]), float(limit["burst"]), max(1, int(limit.get("weight", WEIGHT)))
+
+    def channel(self, name):
+        limit = {**self.config["channel"], **self.config.get("channels", {}).get(name, {})}
+        return float(limit["rate"]), float(limit["burst"])
+
+    @property
+    def backlog(self):
+        return int(self.config["backlog"])
+
+
+class SenderState:
+    __slots__ = ("bucket", "queue", "weight", "deficit", "version")
+
+    def __init__(self, rate, burst, weight, version):
+        self.bucket = TokenBucket(rate, burst)
+        self.queue = deque()  # (канал, deliver)
+        self.weight = weight
+        self.deficit = 0
+        self.version = version
+
+
+class FairQueue:
+    # deliver() вызывается под self.lock: порядок реплик одного отправителя
+    # сохраняется и когда часть из них шла через очередь
+    def __init__(self, limits):
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.senders = OrderedDict()  # ключ -> SenderState
+        self.channels = OrderedDict()  # имя -> (TokenBucket, версия лимитов)
+        self.active = deque()  # ключи отправителей с непустой очередью, по кругу
+        self.wake = lambda: None  # будит разборщик (run / run_async)
+        self.stats = {"delayed": 0, "dropped": 0}
+
+    def _sender(self, key):
+        state = self.senders.get(key)
+        if state is None or state.version != self.limits.version:
+            rate, burst, weight = self.limits.sender(key)
+            if state is None:
+                state = self.senders[key] = SenderState(rate, burst, weight, self.limits.version)
+                self._evict()
+            else:
+                state.bucket.configure(rate, burst)
+                state.weight = weight
+                state.version = self.limits.version
+        self.senders.move_to_end(key)
+        return state
+
+    def _evict(self):
+        # Забываем самых давних отправителей, у которых ничего не ждёт
+        while len(self.senders) > MAX_SENDERS:
+            key, state = next(iter(self.senders.items()))
+            if state.queue:
+                break
+            del self.senders[key]
+
+    def _channel(self, name):
+        bucket, version = self.channels.get(name, (None, None))
+        if version != self.limits.version:
+            rate, burst = self.limits.channel(name)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+            else:
+                bucket.configure(rate, burst)
+            self.channels[name] = (bucket, self.limits.version)
+            while len(self.channels) > MAX_CHANNELS:
+                self.channels.popitem(last=False)
+        self.channels.move_to_end(name)
+        return bucket
+
+    def submit(self, key, channel, deliver) -> bool:
+        # False - очередь отправителя полна, реплика отброшена
+        with self.lock:
+            state = self._sender(key)
+            now = time.monotonic()
+            if not state.queue:
+                bucket = self._channel(channel)
+                if not state.bucket.wait(now) and not bucket.wait(now):
+                    state.bucket.take()
+                    bucket.take()
+                    deliver()
+                    return True
+            if len(state.queue) >= self.limits.backlog:
+                self.stats["dropped"] += 1
+                return False
+            state.queue.append((channel, deliver))
+            self.stats["delayed"] += 1
+            if len(state.queue) == 1:
+                self.active.append(key)
+        self.wake()
+        return True
+
+    def discard(self, key) -> int:
+        # Отправитель отменил ввод (CONTROL): его ждущие реплики не рассылаем
+        with self.lock:
+            state = self.senders.get(key)
+            if state is None or not state.queue:
+                return 0
+            count = len(state.queue)
+            state.queue.clear()
+            state.deficit = 0
+            self.active.remove(key)
+            return count
+
+    def drain(self):
+        # Раздаёт всё, на что есть токены, по кругу с весами. Возвращает,
+        # через сколько секунд появится следующий токен (None - очередь пуста)
+        with self.lock:
+            progress = True
+            while self.active and progress:
+                progress = False
+                now = time.monotonic()
+                wait = None
+                for _ in range(len(self.active)):
+                    key = self.active.popleft()
+                    state = self._sender(key)
+                    state.deficit += state.weight
+                    while state.queue and state.deficit >= 1:
+                        channel, deliver = state.queue[0]
+                        bucket = self._channel(channel)
+                        delay = max(state.bucket.wait(now), bucket.wait(now))
+                        if delay:
+                            wait = delay if wait is None else min(wait, delay)
+                            # Неиспользованный вес не копится, пока ждём токены
+                            state.deficit = min(state.deficit, state.weight)
+                            break
+                        state.bucket.take()
+                        bucket.take()
+                        state.queue.popleft()
+                        state.deficit -= 1
+                        try:
+                            deliver()
+                        except Exception as e:
+                            # Разборщик общий для всех: ошибка одной реплики его не останавливает
+                            print(f"[Лимиты] Ошибка рассылки из очереди: {e}")
+                        progress = True
+                    if state.queue:
+                        self.active.append(key)
+                    else:
+                        state.deficit = 0
+            return wait if self.active else None
+
+    def depth(self):
+        with self.lock:
+            return sum(len(self.senders[key].queue) for key in self.active)
+
+    def _drain_safely(self):
+        # Сбой одного прохода не должен остановить разборщик: в нём же
+        # перечитываются лимиты, и без него очередь не разберётся никогда
+        try:
+            return self.drain()
+        except Exception as e:
+            print(f"[Лимиты] Ошибка разбора очереди: {e}")
+            return RELOAD_CHECK
+
+    def run(self):
+        event = threading.Event()
+        self.wake = event.set
+        while True:
+            delay = self._drain_safely()
+            event.wait(RELOAD_CHECK if delay is None else min(delay, RELOAD_CHECK))
+            event.clear()
+            self.limits.reload()
+
+    async def run_async(self):
+        # В цикле событий: deliver трогает AsyncReceiver, они не потокобезопасны
+        event = asyncio.Event()
+        self.wake = event.set
+        while True:
+            delay = self._drain_safely()
+            try:
+                await asyncio.wait_for(event.wait(), RELOAD_CHECK if delay is None else min(delay, RELOAD_CHECK))
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+            self.limits.reload()
@@ -1,38 +1,94 @@
+import argparse
 import socket
-import keyboard  # pip install keyboard
 import time
 
+import output
+import protocol
+
 SERVER_IP = "109.73.204.176"
 SERVER_PORT = 12345
+CHANNELS = ["general"]  # каналы, реплики из которых нужно вводить
+BACKEND = "keys"  # keys - эмуляция клавиатуры (pip install keyboard), paste - буфер обмена (+ pyperclip)
+RATE = output.RATE  # символов в секунду для keys
+ENTER_DELAY = 0.2  # пауза перед нажатием Enter
+RECONNECT_DELAY = 2  # секунд до повторного подключения после обрыва
+RELAY_MISSED = 3  # сервер, молчащий дольше стольких интервалов его PING, считаем мёртвым
 
-def type_text_and_enter(text):
-    for ch in text:
-        keyboard.write(ch)
-        time.sleep(0.01)  # задержка между символами
-    time.sleep(0.2)  # пауза перед нажатием Enter
-    keyboard.press_and_release('enter')
-
-def receive_and_type(sock):
+def receive_and_type(sock, scheduler, cursor=None, uplink=None):
+    # Только разбор и постановка в очередь: вводит планировщик в своём потоке,
+    # поэтому сокет читается без задержек и ретранслятор не упирается в нас
+    decoder = protocol.FrameDecoder()
     try:
         while True:
-            data = sock.recv(1024)
+            data = sock.recv(4096)
             if not data:
                 print("[Приёмник] Соединение закрыто сервером")
                 break
-            text = data.decode("utf-8").strip()
-            print(f"[Приёмник] Получено для ввода: {text}")
-
-            type_text_and_enter(text)
+            # За один recv может прийти несколько кадров или кусок кадра
+            for kind, payload in decoder.feed(data):
+                if kind == protocol.PING and uplink is not None:
+                    ping = protocol.decode_json(payload)
+                    if isinstance(ping.get("interval"), (int, float)) and ping["interval"] > 0:
+                        sock.settimeout(ping["interval"] * RELAY_MISSED)
+                    uplink.pong(ping.get("t"))
+                    continue
+                text = output.dispatch_frame(scheduler, kind, payload, cursor)
+                if text:
+                    print(f"[Приёмник] Получено для ввода: {text}")
 
+    except TimeoutError:
+        print("[Приёмник] Сервер перестал отвечать")
     except Exception as e:
-        print(f"[Приёмник] Ошибка при приёме или вводе: {e}")
+        print(f"[Приёмник] Ошибка при приёме: {e}")
+
+def run_receiver(args):
+    backend = output.make_backend(args.backend, args.rate, enter_delay=args.enter_delay)
+    # Очередь ввода и место в журнале ретранслятора переживают переподключение:
+    # уже принятое допечатывается, пропущенное за обрыв ретранслятор дошлёт
+    scheduler = output.OutputScheduler(backend)
+    cursor = output.Cursor()
+    try:
+        while True:
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.connect((args.host, args.port))
+                    # сообщаем серверу, что это клиент-приёмник, и с какого места продолжить
+                    s.sendall(protocol.hello("receiver", channels=args.channel, heartbeat=True, **cursor.resume()))
+                    print("[Приёмник] Подключён к серверу, ожидаю сообщения...")
+                    # Глубина очереди ввода (STATUS) и подтверждения (ACK) уходят ретранслятору
+                    uplink = output.Uplink(s)
+                    uplink.attach(scheduler)
+                    try:
+                        receive_and_type(s, scheduler, cursor, uplink)
+                    finally:
+                        output.Uplink.detach(scheduler)
+            except OSError as e:
+                print(f"[Приёмник] Нет связи с сервером: {e}")
+            if not args.reconnect:
+                break
+            time.sleep(RECONNECT_DELAY)
+            print("[Приёмник] Переподключение...")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
+        for line in scheduler.latency.report():
+            print(f"[Приёмник] Задержка {line}")
 
-def run_receiver():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((SERVER_IP, SERVER_PORT))
-        s.sendall(b"receiver\n")  # сообщаем серверу, что это клиент-приёмник
-        print("[Приёмник] Подключён к серверу, ожидаю сообщения...")
-        receive_and_type(s)
+def parse_args(argv=None):
+    # Значения по умолчанию - константы выше, так что запуск без аргументов не изменился
+    parser = argparse.ArgumentParser(description="Приёмник: ввод реплик из каналов ретранслятора")
+    parser.add_argument("--host", default=SERVER_IP)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--channel", nargs="+", default=CHANNELS)
+    parser.add_argument("--backend", choices=output.BACKENDS, default=BACKEND,
+                        help="fake - ввод в память без клавиатуры, для замеров")
+    parser.add_argument("--rate", type=float, default=RATE,
+                        help="для keys и fake: символов в секунду, 0 - без ограничения")
+    parser.add_argument("--enter-delay", type=float, default=ENTER_DELAY)
+    parser.add_argument("--reconnect", action=argparse.BooleanOptionalAction, default=True,
+                        help="переподключаться после обрыва и продолжать с места остановки")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    run_receiver()
+    run_receiver(parse_args())
@@ -0,0 +1,160 @@
+"""Нечёткий поиск по каталогу реплик на триграммах.
+
+Текст приводится к casefold, "ё" считается "е". Индекс: триграмма -> множество
+ID фраз. Запрос ищется сначала как подстрока: кандидаты - постинг самой
+редкой его триграммы, при наборе по буквам следующий запрос проверяет
+только совпадения предыдущего. Если точных совпадений нет (опечатка),
+ищем нечёткие - по доле общих триграмм.
+
+Добавление и удаление фраз меняет только их постинги, индекс целиком не
+перестраивается.
+"""
+import heapq
+import math
+
+LIMIT = 50
+# Нечёткое совпадение: доля общих триграмм с запросом не меньше MIN_SHARE
+MIN_SHARE = 0.5
+# Больше стольких кандидатов за одно нажатие не проверяем: при частых
+# триграммах лучше показать часть совпадений сразу, следующая буква сузит поиск
+SCAN_MAX = 1500
+# Сколько точных совпадений ранжировать; если их больше, берём первые найденные
+RANK_MAX = 128
+# Сколько кандидатов максимум оценивать в нечётком поиске
+FUZZY_MAX = 300
+
+
+def fold(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def trigrams(folded: str):
+    # Для фраз: с границами слов, чтобы нечёткий поиск учитывал начало и конец строки
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_trigrams(folded: str):
+    # Для запроса: только внутренние триграммы - запрос может быть серединой слова
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}  # триграмма -> {id}
+        self.docs = {}  # id -> (сложенный текст, триграммы)
+        self._last = None  # (запрос, все его совпадения) для уточнения при наборе
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, text):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        folded = fold(text)
+        grams = trigrams(folded)
+        self.docs[doc_id] = (folded, grams)
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                self.postings[gram] = {doc_id}
+            else:
+                ids.add(doc_id)
+        self._last = None
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+        self._last = None
+
+    def sync(self, texts):
+        # texts: {id: текст}. Применяем только разницу с тем, что уже в индексе
+        for doc_id in [d for d in self.docs if d not in texts]:
+            self.remove(doc_id)
+        for doc_id, text in texts.items():
+            doc = self.docs.get(doc_id)
+            if doc is None or doc[0] != fold(text):
+                self.add(doc_id, text)
+
+    def _candidates(self, folded):
+        # Надмножество фраз, содержащих запрос подстрокой. Постинги не пересекаем:
+        # проверка подстрокой всё равно нужна, а пересечение больших множеств дороже
+        if len(folded) < 3:
+            # Триграмм нет - идём по каталогу подряд, совпадений у коротких запросов много
+            return None
+        last = self._last
+        if last is not None and folded.startswith(last[0]):
+            # Набор продолжился, а прошлый поиск нашёл все совпадения - уточняем их
+            return last[1]
+        empty = ()
+        return min((self.postings.get(g, empty) for g in query_trigrams(folded)), key=len)
+
+    def _exact(self, folded, limit):
+        docs = self.docs
+        cands = self._candidates(folded)
+        # Если совпадений много, дальше RANK_MAX не идём: на нажатие клавиши
+        # тратим ограниченное время
+        stop = max(limit, RANK_MAX)
+        hits = []
+        if cands is None:
+            cands = docs
+        scanned = 0
+        for doc_id in cands:
+            if folded in docs[doc_id][0]:
+                hits.append(doc_id)
+                if len(hits) >= stop:
+                    break
+            scanned += 1
+            if scanned >= SCAN_MAX:
+                break
+        # Полный список совпадений пригодится следующему нажатию
+        complete = len(hits) < stop and scanned < SCAN_MAX
+        self._last = (folded, hits) if complete and len(folded) >= 3 else None
+        return hits
+
+    def _fuzzy(self, folded, limit, exclude):
+        grams = trigrams(folded)
+        need = max(1, math.ceil(len(grams) * MIN_SHARE))
+        # Фраза с need общими триграммами обязана содержать одну из len - need + 1
+        # самых редких. Частые триграммы не берём: время на нажатие важнее полноты
+        empty = ()
+        ranked = sorted(grams, key=lambda g: len(self.postings.get(g, empty)))
+        candidates = set()
+        for gram in ranked[:len(grams) - need + 1]:
+            posting = self.postings.get(gram, empty)
+            if len(candidates) + len(posting) > FUZZY_MAX:
+                break
+            candidates.update(posting)
+        candidates -= exclude
+        docs = self.docs
+        scored = []
+        for doc_id in candidates:
+            common = len(grams & docs[doc_id][1])
+            if common >= need:
+                scored.append((common, -len(docs[doc_id][0]), doc_id))
+        return [doc_id for _, _, doc_id in heapq.nlargest(limit, scored)]
+
+    def search(self, query, limit=LIMIT):
+        folded = fold(query.strip())
+        if not folded:
+            return []
+        docs = self.docs
+        exact = self._exact(folded, limit)
+
+        def rank(doc_id):
+            # Выше - совпадение в начале фразы или слова, затем короткие фразы
+            text = docs[doc_id][0]
+            pos = text.find(folded)
+            return (pos != 0, pos > 0 and text[pos - 1] != " ", len(text))
+
+        result = heapq.nsmallest(limit, exact, key=rank)
+        if not result and len(folded) >= 3:
+            result = self._fuzzy(folded, limit, set())
+        return result
@@ -1,73 +1,1194 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
 import socket
+import sys
+import tempfile
 import threading
+import time
+from collections import OrderedDict, deque
+
+import bus
+import journal
+import latency
+import metrics
+import protocol
+import ratelimit
 
 HOST = "0.0.0.0"
 PORT = 12346
+BACKLOG = 1024
+RECV_SIZE = 4096
+
+# Очередь исходящих сообщений на каждого приёмника
+QUEUE_SIZE = 256
+SLOW_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+SLOW_POLICY = "drop_oldest"
+MAX_LAG_MS = 5000
+
+# Пачки кадров собираем сами, так что алгоритм Нейгла только добавил бы задержку
+TCP_NODELAY = True
+# Пачку до JOIN_MAX байт склеиваем и шлём одним буфером, больше - sendmsg
+# (writev) без склейки. Буферов в одном sendmsg - не больше IOV_MAX
+JOIN_MAX = 64 * 1024
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+DEFAULT_CHANNEL = "general"
+MAX_CHANNEL_LEN = 64
+
+# Маршруты ACK: id сообщения -> отправитель, не больше ACK_ROUTES и не дольше ACK_TTL секунд
+ACK_ROUTES = 10000
+ACK_TTL = 300
+
+# Повторы: id, уже пришедший от того же отправителя за DEDUP_WINDOW секунд,
+# не рассылается. Помним не больше DEDUP_SIZE id на отправителя и окна не
+# больше чем DEDUP_SENDERS отправителей
+DEDUP_WINDOW = 30
+DEDUP_SIZE = 1024
+DEDUP_SENDERS = 10000
+
+# Пульс (Heartbeat): каждому клиенту раз в HEARTBEAT_INTERVAL секунд - PING,
+# и молчащему, и активному (иначе клиент, который только шлёт, счёл бы
+# ретранслятор мёртвым); клиент, обещавший пульс, отключается после
+# IDLE_TIMEOUT секунд молчания.
+# Проверка - раз в REAP_TICK секунд одним проходом по всем соединениям
+HEARTBEAT_INTERVAL = 15
+IDLE_TIMEOUT = 45
+REAP_TICK = 1.0
+# TCP keepalive и TCP_USER_TIMEOUT: полуоткрытое соединение без пульса
+# (старый клиент) закрывает ядро - не отвечает на пробы или не подтверждает PING
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+TCP_USER_TIMEOUT = 30  # секунд; 0 - как в ядре (около 15 минут повторов)
+
+# Метрики: порт на 127.0.0.1 (0 - не отдавать) и выборка - замерять каждое N-е сообщение
+STATS_PORT = 0
+METRICS_SAMPLE = 1
+
+# Процессов-воркеров на одном порту (SO_REUSEPORT, только Linux); 1 - без шины
+WORKERS = 1
+# Воркер, упавший раньше, чем через столько секунд после запуска, не перезапускаем:
+# скорее всего, ошибка настройки (занят порт метрик и т. п.)
+RESPAWN_MIN = 5
+
+
+class OutboundQueue:
+    # Ограниченная очередь одного приёмника. Сама по себе не потокобезопасна,
+    # синхронизацию делает владелец (ThreadedReceiver / AsyncReceiver).
+    def __init__(self, maxsize=QUEUE_SIZE, policy=SLOW_POLICY, max_lag_ms=MAX_LAG_MS):
+        if policy not in SLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика медленного приёмника: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_lag = max_lag_ms / 1000
+        self.items = deque()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, data) -> bool:
+        # Возвращает False, если приёмник пора отключить
+        now = time.monotonic()
+        if self.policy == "disconnect":
+            if len(self.items) >= self.maxsize:
+                return False
+            if self.items and now - self.items[0][0] > self.max_lag:
+                return False
+        elif len(self.items) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return True
+            self.items.popleft()
+        self.items.append((now, data))
+        return True
+
+    def take(self):
+        batch = [data for _, data in self.items]
+        self.items.clear()
+        return batch
+
+
+def queue_settings(args):
+    return {"maxsize": args.queue_size, "policy": args.slow_policy, "max_lag_ms": args.max_lag_ms}
+
+
+def set_nodelay(sock, enabled):
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+    except OSError:
+        pass
+
+
+def set_keepalive(sock, args):
+    # Опции TCP_KEEP* и TCP_USER_TIMEOUT есть не везде - чего нет, пропускаем
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(args.keepalive_idle > 0))]
+    if args.keepalive_idle > 0:
+        options += [
+            (socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPIDLE", None), args.keepalive_idle),
+            (socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPINTVL", None), args.keepalive_interval),
+            (socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPCNT", None), args.keepalive_count),
+        ]
+    if args.tcp_user_timeout > 0:
+        options.append((socket.IPPROTO_TCP, getattr(socket, "TCP_USER_TIMEOUT", None),
+                        int(args.tcp_user_timeout * 1000)))
+    for level, name, value in options:
+        if name is None:
+            continue
+        try:
+            sock.setsockopt(level, name, value)
+        except OSError:
+            pass
+
+
+def send_batch(conn, batch, size, join_max=JOIN_MAX):
+    # Кадр собирается один раз и лежит в очередях всех подписчиков одним и
+    # тем же объектом bytes; пачка уходит одним системным вызовом.
+    # Реплики - сотни байт, и склейка их в один буфер обходится дешевле
+    # writev со множеством мелких буферов (bench/fanout.py), а пачку из
+    # одного кадра join возвращает без копии. Большой хвост медленного
+    # приёмника не копируем: sendmsg, при частичной записи - срез memoryview
+    if size <= join_max or not hasattr(conn, "sendmsg"):
+        conn.sendall(b"".join(batch))
+        return
+    pos = 0
+    while pos < len(batch):
+        sent = conn.sendmsg(batch[pos:pos + IOV_MAX])
+        while pos < len(batch) and sent >= len(batch[pos]):
+            sent -= len(batch[pos])
+            pos += 1
+        if sent:
+            batch[pos] = memoryview(batch[pos])[sent:]
+
+
+class ThreadedReceiver:
+    # Приёмник со своим потоком-писателем: рассылка только кладёт данные в очередь.
+    # Так же пишем отправителю подтверждения ввода
+    def __init__(self, conn, addr, settings):
+        self.conn = conn
+        self.addr = addr
+        self.queue = OutboundQueue(**settings)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.channels = set()
+        self.depth = 0  # глубина очереди ввода, по STATUS от приёмника
+        self.stats = None  # metrics.ClientStats; исходящие счётчики меняет только писатель
+        self.dedup = None  # DedupWindow, если это обратный канал отправителя
+        self.key = None  # отправитель для лимитов (limit_key)
+        self.last_seen = time.monotonic()  # когда от клиента что-то приходило
+        self.pinged = 0.0
+        self.heartbeat = False  # клиент обещал отвечать на PING
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def push(self, data) -> bool:
+        with self.cond:
+            if self.closed:
+                return False
+            ok = self.queue.put(data)
+            if ok:
+                self.cond.notify()
+        if not ok:
+            print(f"[Сервер] Приёмник {self.addr} не успевает, отключаем")
+            metrics.registry.event("receivers_removed")
+            self.close()
+        return ok
+
+    def write_loop(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                batch = self.queue.take()
+            size = sum(map(len, batch))
+            count = len(batch)
+            stats = self.stats
+            try:
+                send_batch(self.conn, batch, size)
+            except OSError as e:
+                print(f"[Сервер] Ошибка отправки приемнику {self.addr}: {e}")
+                if stats is not None:
+                    stats.send_errors += 1
+                self.close()
+                return
+            if stats is not None:
+                stats.messages_out += count
+                stats.bytes_out += size
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        # Будим читающий поток handle_client, он уберёт приёмник из списка
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ChannelIndex:
+    # Индекс канал -> подписчики: рассылка идёт только по подписчикам канала,
+    # а не по всем приёмникам. Заодно считает сообщения и байты по каналам.
+    def __init__(self):
+        self.subscribers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, receiver, names):
+        with self.lock:
+            for name in names:
+                self.subscribers.setdefault(name, set()).add(receiver)
+
+    def unsubscribe_many(self, receivers):
+        # Убрать сразу много приёмников (уборка мёртвых) - одна блокировка на всех
+        with self.lock:
+            for receiver in receivers:
+                for name in receiver.channels:
+                    subs = self.subscribers.get(name)
+                    if subs is None:
+                        continue
+                    subs.discard(receiver)
+                    if not subs:
+                        del self.subscribers[name]
+
+    def unsubscribe(self, receiver, names):
+        with self.lock:
+            for name in names:
+                subs = self.subscribers.get(name)
+                if subs is None:
+                    continue
+                subs.discard(receiver)
+                if not subs:
+                    del self.subscribers[name]
+
+    def publish(self, name, payload):
+        # Только раскладываем по очередям, сеть здесь не трогаем
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"messages": 0, "bytes": 0}
+            stat["messages"] += 1
+            stat["bytes"] += len(payload)
+            subs = self.subscribers.get(name)
+            if not subs:
+                return
+            dead = [r for r in subs if not r.push(payload)]
+            for r in dead:
+                subs.discard(r)
+
+    def report(self):
+        with self.lock:
+            return [
+                f"{name}: подписчиков {len(self.subscribers.get(name, ()))}, "
+                f"сообщений {stat['messages']}, байт {stat['bytes']}, "
+                f"ждут ввода {sum(r.depth for r in self.subscribers.get(name, ()))}"
+                for name, stat in sorted(self.stats.items())
+            ]
+
+
+channels = ChannelIndex()
+
+
+class AckRouter:
+    # Куда вернуть ACK. id сообщения выбирает клиент, и чужой отправитель с
+    # тем же id перехватил бы маршрут - поэтому в рассылку уходит id, который
+    # назначает ретранслятор (assign), а маршрут помнит отправителя и его id.
+    # Несколько приёмников могут подтвердить одно сообщение, поэтому маршрут
+    # живёт до ACK_TTL
+    def __init__(self, maxsize=ACK_ROUTES, ttl=ACK_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.routes = OrderedDict()  # id в рассылке -> (время, отправитель, его id или None)
+        self.lock = threading.Lock()
+        # Свой у процесса: id не совпадут у воркеров и с прошлым запуском (журнал)
+        self.prefix = secrets.token_hex(4)
+        self.counter = itertools.count(1)
+
+    def assign(self, msg_id, peer):
+        # id для рассылки сообщения отправителя peer с его id msg_id
+        with self.lock:
+            wire_id = f"{self.prefix}-{next(self.counter)}"
+        self.register(wire_id, peer, msg_id)
+        return wire_id
+
+    def register(self, wire_id, peer, msg_id=None):
+        # msg_id None - id в ACK не меняется (отправитель в другом воркере)
+        now = time.monotonic()
+        with self.lock:
+            self.routes[wire_id] = (now, peer, msg_id)
+            self.routes.move_to_end(wire_id)
+            while self.routes:
+                first = next(iter(self.routes.values()))
+                if len(self.routes) <= self.maxsize and now - first[0] <= self.ttl:
+                    break
+                self.routes.popitem(last=False)
+
+    def route(self, wire_id):
+        # (отправитель, его id или None) или None, если маршрута нет
+        with self.lock:
+            entry = self.routes.get(wire_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1], entry[2]
+
+
+acks = AckRouter()
+
+
+class DedupWindow:
+    # Недавние id одного отправителя. Повтор продлевает окно: id, который
+    # отправитель шлёт снова и снова (переподключения), остаётся в памяти
+    def __init__(self, maxsize=DEDUP_SIZE, ttl=DEDUP_WINDOW):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ids = OrderedDict()  # id -> когда встречался последний раз
+        self.lock = threading.Lock()
+
+    def seen(self, msg_id) -> bool:
+        # True - такой id уже был в окне, сообщение рассылать не нужно
+        now = time.monotonic()
+        with self.lock:
+            last = self.ids.get(msg_id)
+            self.ids[msg_id] = now
+            self.ids.move_to_end(msg_id)
+            while self.ids:
+                first = next(iter(self.ids.values()))
+                if len(self.ids) <= self.maxsize and now - first <= self.ttl:
+                    break
+                self.ids.popitem(last=False)
+        return last is not None and now - last <= self.ttl
+
+    def forget(self, msg_id):
+        # Сообщение не принято (лимит): честный повтор с тем же id - не дубль
+        with self.lock:
+            self.ids.pop(msg_id, None)
+
+
+class DedupIndex:
+    # Окна по отправителям. Отправитель с "client" в HELLO узнаётся и после
+    # переподключения, без него окно живёт, пока живо соединение
+    def __init__(self, ttl=DEDUP_WINDOW, size=DEDUP_SIZE, senders=DEDUP_SENDERS):
+        self.ttl = ttl
+        self.size = size
+        self.senders = senders
+        self.windows = OrderedDict()
+        self.lock = threading.Lock()
+
+    def configure(self, args):
+        self.ttl = args.dedup_window
+        self.size = args.dedup_size
+
+    def window(self, info, addr):
+        if self.ttl <= 0 or self.size <= 0:
+            return None
+        client = info.get("client")
+        if not isinstance(client, str) or not client:
+            return DedupWindow(self.size, self.ttl)
+        with self.lock:
+            window = self.windows.get(client)
+            if window is None:
+                window = self.windows[client] = DedupWindow(self.size, self.ttl)
+                while len(self.windows) > self.senders:
+                    self.windows.popitem(last=False)
+            self.windows.move_to_end(client)
+            return window
+
+
+dedup = DedupIndex()
+
+
+class Heartbeat:
+    # Все соединения клиентов (и приёмники, и обратные каналы отправителей).
+    # Раз в REAP_TICK один проход: каждому раз в interval - PING (по нему и
+    # клиент видит, что ретранслятор жив, даже когда сам только шлёт), а
+    # обещавших пульс и молчащих дольше idle_timeout убираем пачкой. PING на
+    # полуоткрытое соединение заодно запускает повторы TCP, и через
+    # TCP_USER_TIMEOUT его закроет ядро - так уходят и старые клиенты без пульса
+    def __init__(self, interval=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.peers = set()
+        self.lock = threading.Lock()
+        self.idle = 0  # молчащих дольше interval на последнем проходе
+
+    def configure(self, args):
+        self.interval = args.heartbeat
+        self.idle_timeout = args.idle_timeout
+
+    def add(self, peer, info):
+        peer.heartbeat = bool(info.get("heartbeat"))
+        with self.lock:
+            self.peers.add(peer)
+
+    def remove(self, peer):
+        with self.lock:
+            self.peers.discard(peer)
+
+    def check(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        with self.lock:
+            peers = list(self.peers)
+        dead = []
+        idle = 0
+        for peer in peers:
+            if peer.closed:
+                continue
+            silent = now - peer.last_seen
+            if peer.heartbeat and self.idle_timeout and silent > self.idle_timeout:
+                dead.append(peer)
+                continue
+            if silent >= self.interval:
+                idle += 1
+            if now - peer.pinged >= self.interval:
+                peer.pinged = now
+                peer.push(protocol.ping(time.time(), self.interval))
+        self.idle = idle
+        if dead:
+            self.reap(dead)
+
+    def reap(self, dead):
+        # Сначала разом убираем из каналов - рассылка сразу перестаёт тратить
+        # на них время; остальное доделает finally обработчика соединения
+        channels.unsubscribe_many(dead)
+        for peer in dead:
+            peer.close()
+        metrics.registry.event("reaped", len(dead))
+        print(f"[Сервер] Отключены молчащие дольше {self.idle_timeout:g} с: "
+              + ", ".join(str(peer.addr) for peer in dead))
+
+    def run(self):
+        while True:
+            time.sleep(REAP_TICK)
+            self.check()
+
+    async def run_async(self):
+        # В цикле событий: AsyncReceiver не потокобезопасны
+        while True:
+            await asyncio.sleep(REAP_TICK)
+            self.check()
+
+
+heartbeat = Heartbeat()
+# Лимиты частоты и справедливая очередь отправителей (ratelimit.py)
+fair = ratelimit.FairQueue(ratelimit.Limits())
+
+
+def configure_limits(args):
+    fair.limits = ratelimit.Limits(args.sender_rate, args.sender_burst, args.channel_rate, args.channel_burst,
+                                   args.sender_backlog, args.limits)
+
+
+def limit_key(info, addr):
+    # Как у окна повторов: постоянный id клиента, без него - адрес соединения
+    client = info.get("client")
+    if isinstance(client, str) and client:
+        return client
+    return f"{addr[0]}:{addr[1]}" if isinstance(addr, tuple) else str(addr)
+# Этапы доставки по ACK, прошедшим через ретранслятор
+latencies = latency.StageStats()
+# Шина к остальным воркерам (bus.Bus), только в многопроцессном режиме
+worker_bus = None
+# Журнал сообщений (journal.MessageLog), если задан --log-dir
+message_log = None
+
+
+def publish(channel, frame, msg_id=None):
+    # Своим подписчикам и, если воркеров несколько, - подписчикам в остальных
+    channels.publish(channel, frame)
+    if worker_bus is not None:
+        worker_bus.publish(channel, frame, msg_id)
+
+
+def start_replay(receiver, resume):
+    # Досылка с места, где приёмник остановился (resume в HELLO): файлы
+    # журнала читаются без его блокировки - рассылка остальным не ждёт.
+    # Асинхронный движок зовёт это в потоке, чтобы не стоял цикл событий
+    if message_log is None:
+        return None
+    if not isinstance(resume, dict):
+        resume = {}
+    # Место под HELLO: досылка не должна вытеснять сама себя из очереди
+    return message_log.replay(resume.get("log"), resume.get("seq"), receiver.channels,
+                              max(1, receiver.queue.maxsize - 1))
+
 
-clients_receivers = []
-clients_senders = []
+def attach_receiver(receiver, replay=None):
+    # Подписка приёмника. С журналом под его блокировкой дочитываем хвост
+    # после start_replay, отдаём досылку и HELLO ретранслятора и подписываем -
+    # ни одна реплика не теряется и не приходит дважды
+    if message_log is None:
+        channels.subscribe(receiver, receiver.channels)
+        return
+    with message_log.lock:
+        frames, skipped = message_log.replay_tail(replay)
+        for frame in frames:
+            receiver.push(frame)
+        receiver.push(protocol.hello("relay", log=message_log.log_id, seq=message_log.last_seq))
+        channels.subscribe(receiver, receiver.channels)
+    if frames or skipped:
+        print(f"[Сервер] Приёмнику {receiver.addr} дослано из журнала: {len(frames)}"
+              + (f", старых пропущено: {skipped}" if skipped else ""))
+        metrics.registry.event("replayed", len(frames))
 
-lock = threading.Lock()
 
-def handle_client(conn, addr):
+def bus_deliver(kind, origin, channel, msg_id, frame):
+    # Запись от другого воркера
+    if kind == bus.PUB:
+        if msg_id is not None:
+            acks.register(msg_id, bus.WorkerPeer(worker_bus, origin, msg_id))
+        channels.publish(channel, frame)
+    elif kind == bus.ACK:
+        forward_ack(msg_id, frame)
+
+
+def forward_ack(wire_id, frame, ack=None):
+    # ACK приёмника - отправителю сообщения, с его собственным id
+    route = acks.route(wire_id)
+    if route is None:
+        return
+    sender, msg_id = route
+    if msg_id is not None:
+        if ack is None:
+            ack = protocol.decode_json(frame[protocol.HEADER.size:])
+        frame = protocol.encode_json(protocol.ACK, {**ack, "id": msg_id})
+    sender.push(frame)
+
+
+def channel_name(value):
+    name = str(value or DEFAULT_CHANNEL).strip()
+    if not name or len(name) > MAX_CHANNEL_LEN:
+        raise protocol.ProtocolError(f"Некорректное имя канала: {value!r}")
+    return name
+
+
+def subscribed_channels(info):
+    # Приёмник перечисляет каналы в HELLO; без списка - канал по умолчанию
+    names = info.get("channels") or [DEFAULT_CHANNEL]
+    if isinstance(names, str):
+        names = [names]
+    return {channel_name(n) for n in names}
+
+
+def read_hello(frames):
+    # Первый кадр соединения - HELLO с ролью клиента
+    kind, payload = frames.pop(0)
+    if kind != protocol.HELLO:
+        raise protocol.ProtocolError(f"Ожидался HELLO, пришёл {protocol.KIND_NAMES.get(kind, kind)}")
+    info = protocol.decode_json(payload)
+    return str(info.get("role", "")).strip().lower(), info
+
+
+def relay_gauges():
+    # Считается при запросе метрик, а не на каждом сообщении
+    with channels.lock:
+        subscribers = {name: list(subs) for name, subs in channels.subscribers.items()}
+    samples = [("channel_subscribers", {"channel": name}, len(subs)) for name, subs in sorted(subscribers.items())]
+    for receiver in {r for subs in subscribers.values() for r in subs}:
+        client = {"client": f"{receiver.addr[0]}:{receiver.addr[1]}"}
+        samples.append(("outbound_queue_depth", client, len(receiver.queue)))
+        samples.append(("outbound_dropped", client, receiver.queue.dropped))
+        samples.append(("input_queue_depth", client, receiver.depth))
+    samples.append(("ack_routes", {}, len(acks.routes)))
+    samples.append(("dedup_senders", {}, len(dedup.windows)))
+    samples.append(("peers", {}, len(heartbeat.peers)))
+    samples.append(("fair_queued", {}, fair.depth()))
+    for name, value in fair.stats.items():
+        samples.append((f"fair_{name}", {}, value))
+    samples.append(("idle_peers", {}, heartbeat.idle))
+    if message_log is not None:
+        for name, value in message_log.stats().items():
+            samples.append((f"log_{name}", {}, value))
+    if worker_bus is not None:
+        samples.append(("bus_queue_depth", {}, worker_bus.depth()))
+        for name, value in worker_bus.stats.items():
+            samples.append((f"bus_{name}", {}, value))
+    return samples
+
+
+metrics.registry.add_gauges(relay_gauges)
+
+
+def start_stats(args):
+    if not args.stats_port and not args.stats_unix:
+        return
+    metrics.registry.sample_every = max(1, args.metrics_sample)
+    where = metrics.serve(lambda: metrics.registry.render(latencies),
+                          port=args.stats_port, unix_path=args.stats_unix)
+    print(f"[Сервер] Метрики: {where}")
+
+
+def relay_frame(kind, payload, addr, default_channel, sender=None, received=None):
+    # Разбираем кадр отправителя один раз и собираем кадр для всех подписчиков канала
+    if kind == protocol.PONG:
+        return  # пульс: время последней активности уже обновил обработчик
+    if kind not in (protocol.MSG, protocol.CONTROL, protocol.SCENARIO):
+        print(f"[Сервер] Неожиданный кадр {protocol.KIND_NAMES.get(kind, kind)} от {addr}")
+        return
+    msg = protocol.decode_json(payload)
+    channel = channel_name(msg["channel"]) if msg.get("channel") else default_channel
+    if kind == protocol.CONTROL:
+        # flush/cancel очереди ввода - всем приёмникам канала
+        command = msg.get("command")
+        if command in protocol.COMMANDS:
+            print(f"[Сервер] Отправитель {addr}: {command} в {channel}")
+            # Реплики отправителя, ждущие в его очереди лимита, тоже отменяются
+            dropped = fair.discard(sender.key) if sender is not None else 0
+            if dropped:
+                print(f"[Сервер] Отправитель {addr}: из очереди лимита убрано {dropped}")
+            publish(channel, protocol.control(command, channel=channel))
+        return
+    extra = {}
+    if kind == protocol.SCENARIO:
+        # Весь сценарий - один кадр; шаги проверяем здесь, проигрывает приёмник
+        steps = protocol.scenario_steps(msg)
+        if not steps:
+            return
+        text = f"сценарий из {len(steps)} шагов"
+    else:
+        text = str(msg.get("text", "")).strip()
+        if not text:
+            return
+        # Вид и приоритет нужны планировщику ввода приёмника
+        if msg.get("kind") in ("phrase", "me"):
+            extra["kind"] = msg["kind"]
+        if isinstance(msg.get("priority"), int):
+            extra["priority"] = msg["priority"]
+    msg_id = msg.get("id")
+    if not isinstance(msg_id, str):
+        msg_id = None
+    window = getattr(sender, "dedup", None)
+    if msg_id is not None and window is not None and window.seen(msg_id):
+        # Повторная отправка (двойной клик, переотправка после обрыва)
+        print(f"[Сервер] Отправитель {addr}: повтор {msg_id} не разослан")
+        metrics.registry.event("dedup_hits")
+        return
+    wire_id = None
+    if msg_id is not None and sender is not None:
+        # Трассировка: добавляем свои отметки и запоминаем, кому вернуть ACK
+        # ts задаёт клиент: оставляем известные числовые отметки, иначе
+        # ACK с ними уронит разбор этапов у ретранслятора и отправителя
+        ts = latency.clean_stamps(msg.get("ts"))
+        ts["relay_in"] = received or time.time()
+        extra["id"] = wire_id = acks.assign(msg_id, sender)
+        extra["ts"] = ts
+    print(f"[Сервер] Отправитель {addr} отправил в {channel}: {text}")
+
+    def build(**more):
+        if kind == protocol.SCENARIO:
+            return protocol.scenario(steps, channel=channel, **extra, **more)
+        return protocol.message(text, channel=channel, **extra, **more)
+
+    def deliver():
+        # Сразу или позже, из очереди лимита - relay_out ставим при рассылке
+        if "ts" in extra:
+            extra["ts"]["relay_out"] = time.time()
+        if message_log is None:
+            timed_publish(channel, build(), wire_id)
+            return
+        # Номер в журнале и рассылка под одной блокировкой: в очередях приёмников
+        # тот же порядок seq, что в журнале, и досылка при подключении с ним сходится
+        with message_log.lock:
+            frame = message_log.append(channel, kind, lambda seq: build(seq=seq))
+            timed_publish(channel, frame, wire_id)
+
+    if sender is None:
+        deliver()
+    elif not fair.submit(sender.key, channel, deliver):
+        print(f"[Сервер] Отправитель {addr} превысил лимит, реплика отброшена: {text}")
+        metrics.registry.event("rate_limited")
+        if msg_id is not None and window is not None:
+            window.forget(msg_id)
+        if msg_id is not None:
+            sender.push(protocol.ack(msg_id, "limited", extra["ts"]))
+
+
+def timed_publish(channel, frame, msg_id):
+    if not metrics.registry.sample():
+        publish(channel, frame, msg_id)
+        return
+    started = time.perf_counter()
+    publish(channel, frame, msg_id)
+    metrics.registry.fanout.observe((time.perf_counter() - started) * 1000)
+
+
+def receiver_frame(receiver, kind, payload):
+    # От приёмника: STATUS с глубиной его очереди ввода и ACK для отправителя
+    if kind == protocol.STATUS:
+        depth = protocol.decode_json(payload).get("depth")
+        if isinstance(depth, int) and depth >= 0:
+            receiver.depth = depth
+    elif kind == protocol.ACK:
+        ack = protocol.decode_json(payload)
+        if isinstance(ack.get("ts"), dict) and ack.get("status") == "typed" and metrics.registry.sample():
+            latencies.observe_stamps(ack["ts"])
+        forward_ack(ack.get("id"), protocol.encode_frame(protocol.ACK, payload), ack)
+
+
+def handle_client(conn, addr, settings):
     print(f"[Сервер] Подключился {addr}")
+    receiver = None
+    sender = None
+    stats = None
+    decoder = protocol.FrameDecoder()
     try:
-        # Ожидаем первый пакет - тип клиента
-        client_type = conn.recv(1024).decode("utf-8").strip().lower()
+        # Ожидаем первый кадр - тип клиента
+        frames = []
+        while not frames:
+            data = conn.recv(RECV_SIZE)
+            if not data:
+                return
+            frames = decoder.feed(data)
+        client_type, info = read_hello(frames)
         print(f"[Сервер] Клиент {addr} тип: {client_type}")
 
         if client_type == "receiver":
-            with lock:
-                clients_receivers.append(conn)
+            receiver = ThreadedReceiver(conn, addr, settings)
+            receiver.stats = stats = metrics.registry.client(addr, client_type)
+            receiver.channels = subscribed_channels(info)
+            heartbeat.add(receiver, info)
+            attach_receiver(receiver, start_replay(receiver, info.get("resume")))
+            print(f"[Сервер] Приёмник {addr} подписан на: {', '.join(sorted(receiver.channels))}")
+            stats.messages_in += len(frames)
+            for kind, payload in frames:
+                receiver_frame(receiver, kind, payload)
             while True:
-                data = conn.recv(1024)
+                data = conn.recv(RECV_SIZE)
                 if not data:
                     break
-                # Здесь можно обработать данные от приемника, если нужно
+                receiver.last_seen = time.monotonic()
+                stats.bytes_in += len(data)
+                for kind, payload in decoder.feed(data):
+                    stats.messages_in += 1
+                    receiver_frame(receiver, kind, payload)
         elif client_type == "sender":
-            with lock:
-                clients_senders.append(conn)
+            channel = channel_name(info.get("channel"))
+            # Обратный канал отправителю - для ACK
+            sender = ThreadedReceiver(conn, addr, settings)
+            sender.stats = stats = metrics.registry.client(addr, client_type)
+            sender.dedup = dedup.window(info, addr)
+            sender.key = limit_key(info, addr)
+            heartbeat.add(sender, info)
+            received = time.time()
             while True:
-                data = conn.recv(1024)
+                # Пересылаем подписчикам канала
+                stats.messages_in += len(frames)
+                for kind, payload in frames:
+                    relay_frame(kind, payload, addr, channel, sender, received)
+                data = conn.recv(RECV_SIZE)
                 if not data:
                     break
-                text = data.decode("utf-8").strip()
-                print(f"[Сервер] Отправитель {addr} отправил: {text}")
-
-                # Пересылаем всем приемникам
-                with lock:
-                    to_remove = []
-                    for r in clients_receivers:
-                        try:
-                            r.sendall((text + "\n").encode("utf-8"))
-                        except Exception as e:
-                            print(f"[Сервер] Ошибка отправки приемнику: {e}")
-                            to_remove.append(r)
-                    for r in to_remove:
-                        clients_receivers.remove(r)
+                received = time.time()
+                sender.last_seen = time.monotonic()
+                stats.bytes_in += len(data)
+                frames = decoder.feed(data)
         else:
             print(f"[Сервер] Неизвестный тип клиента от {addr}: {client_type}")
 
     except Exception as e:
         print(f"[Сервер] Ошибка с клиентом {addr}: {e}")
+        if isinstance(e, protocol.ProtocolError):
+            metrics.registry.event("protocol_errors")
     finally:
-        with lock:
-            if conn in clients_receivers:
-                clients_receivers.remove(conn)
-            if conn in clients_senders:
-                clients_senders.remove(conn)
+        if stats is not None:
+            metrics.registry.release(stats)
+        if receiver:
+            heartbeat.remove(receiver)
+            channels.unsubscribe(receiver, receiver.channels)
+            receiver.close()
+        if sender:
+            heartbeat.remove(sender)
+            sender.close()
         conn.close()
         print(f"[Сервер] Клиент {addr} отключился")
 
-def start_server():
-    print(f"[Сервер] Запуск на {HOST}:{PORT}")
+def start_server(args):
+    print(f"[Сервер] Запуск на {args.host}:{args.port}")
+    settings = queue_settings(args)
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Ключевая строка для переиспользования порта
-        s.bind((HOST, PORT))
-        s.listen()
+        if args.workers > 1:
+            # Каждый воркер слушает тот же порт, ядро делит входящие соединения
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((args.host, args.port))
+        s.listen(BACKLOG)
+        if worker_bus is not None:
+            worker_bus.start_reader()
+        threading.Thread(target=heartbeat.run, daemon=True).start()
+        threading.Thread(target=fair.run, daemon=True).start()
         while True:
             conn, addr = s.accept()
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+            set_nodelay(conn, args.tcp_nodelay)
+            set_keepalive(conn, args)
+            threading.Thread(target=handle_client, args=(conn, addr, settings), daemon=True).start()
+
+
+# --- asyncio-движок: все соединения обслуживаются одним циклом событий ---
+
+class AsyncReceiver:
+    # То же, что ThreadedReceiver, но писатель - задача в цикле событий
+    def __init__(self, writer, addr, settings):
+        self.writer = writer
+        self.addr = addr
+        self.queue = OutboundQueue(**settings)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.channels = set()
+        self.depth = 0  # глубина очереди ввода, по STATUS от приёмника
+        self.stats = None
+        self.dedup = None
+        self.key = None
+        self.last_seen = time.monotonic()
+        self.pinged = 0.0
+        self.heartbeat = False
+        self.task = asyncio.create_task(self.write_loop())
+
+    def push(self, data) -> bool:
+        if self.closed:
+            return False
+        if not self.queue.put(data):
+            print(f"[Сервер] Приёмник {self.addr} не успевает, отключаем")
+            metrics.registry.event("receivers_removed")
+            self.close()
+            return False
+        self.ready.set()
+        return True
+
+    async def write_loop(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.closed:
+                    return
+                batch = self.queue.take()
+                size = sum(map(len, batch))
+                # Как send_batch: большую пачку транспорт отдаёт ядру без
+                # склейки там, где умеет sendmsg (Python 3.12+)
+                if size <= JOIN_MAX:
+                    self.writer.write(b"".join(batch))
+                else:
+                    self.writer.writelines(batch)
+                if self.stats is not None:
+                    self.stats.messages_out += len(batch)
+                    self.stats.bytes_out += size
+                await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"[Сервер] Ошибка отправки приемнику {self.addr}: {e}")
+            if self.stats is not None:
+                self.stats.send_errors += 1
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.ready.set()
+        # abort, а не close: у медленного приёмника не ждём дописывания буфера
+        self.writer.transport.abort()
+
+
+async def handle_client_async(reader, writer, settings):
+    addr = writer.get_extra_info("peername")
+    print(f"[Сервер] Подключился {addr}")
+    receiver = None
+    sender = None
+    stats = None
+    decoder = protocol.FrameDecoder()
+    try:
+        # Ожидаем первый кадр - тип клиента
+        frames = []
+        while not frames:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                return
+            frames = decoder.feed(data)
+        client_type, info = read_hello(frames)
+        print(f"[Сервер] Клиент {addr} тип: {client_type}")
+
+        if client_type == "receiver":
+            receiver = AsyncReceiver(writer, addr, settings)
+            receiver.stats = stats = metrics.registry.client(addr, client_type)
+            receiver.channels = subscribed_channels(info)
+            heartbeat.add(receiver, info)
+            attach_receiver(receiver, await asyncio.to_thread(start_replay, receiver, info.get("resume")))
+            print(f"[Сервер] Приёмник {addr} подписан на: {', '.join(sorted(receiver.channels))}")
+            stats.messages_in += len(frames)
+            for kind, payload in frames:
+                receiver_frame(receiver, kind, payload)
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                receiver.last_seen = time.monotonic()
+                stats.bytes_in += len(data)
+                for kind, payload in decoder.feed(data):
+                    stats.messages_in += 1
+                    receiver_frame(receiver, kind, payload)
+        elif client_type == "sender":
+            channel = channel_name(info.get("channel"))
+            sender = AsyncReceiver(writer, addr, settings)
+            sender.stats = stats = metrics.registry.client(addr, client_type)
+            sender.dedup = dedup.window(info, addr)
+            sender.key = limit_key(info, addr)
+            heartbeat.add(sender, info)
+            received = time.time()
+            while True:
+                stats.messages_in += len(frames)
+                for kind, payload in frames:
+                    relay_frame(kind, payload, addr, channel, sender, received)
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                received = time.time()
+                sender.last_seen = time.monotonic()
+                stats.bytes_in += len(data)
+                frames = decoder.feed(data)
+        else:
+            print(f"[Сервер] Неизвестный тип клиента от {addr}: {client_type}")
+
+    except asyncio.CancelledError:
+        # Остановка сервера: просто закрываем соединение
+        pass
+    except Exception as e:
+        print(f"[Сервер] Ошибка с клиентом {addr}: {e}")
+        if isinstance(e, protocol.ProtocolError):
+            metrics.registry.event("protocol_errors")
+    finally:
+        if stats is not None:
+            metrics.registry.release(stats)
+        if receiver:
+            heartbeat.remove(receiver)
+            channels.unsubscribe(receiver, receiver.channels)
+            receiver.close()
+        if sender:
+            heartbeat.remove(sender)
+            sender.close()
+        writer.close()
+        print(f"[Сервер] Клиент {addr} отключился")
+
+async def serve_async(args):
+    print(f"[Сервер] Запуск (asyncio) на {args.host}:{args.port}")
+    settings = queue_settings(args)
+
+    def on_connect(reader, writer):
+        # asyncio сам включает TCP_NODELAY; здесь - чтобы работал и --no-tcp-nodelay
+        set_nodelay(writer.get_extra_info("socket"), args.tcp_nodelay)
+        set_keepalive(writer.get_extra_info("socket"), args)
+        return handle_client_async(reader, writer, settings)
+
+    server = await asyncio.start_server(
+        on_connect,
+        args.host, args.port, reuse_address=True, reuse_port=args.workers > 1, backlog=BACKLOG,
+    )
+    if worker_bus is not None:
+        worker_bus.start_reader(asyncio.get_running_loop())
+    # Ссылки на задачи держим сами: цикл событий хранит только слабые
+    tasks = [asyncio.create_task(heartbeat.run_async()), asyncio.create_task(fair.run_async())]
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+def start_server_async(args):
+    try:
+        asyncio.run(serve_async(args))
+    except KeyboardInterrupt:
+        pass
+
+
+ENGINES = {
+    "threaded": start_server,
+    "asyncio": start_server_async,
+}
+
+
+def print_report(who="Сервер"):
+    for line in channels.report():
+        print(f"[{who}] Канал {line}")
+    for line in latencies.report():
+        print(f"[{who}] Задержка {line}")
+
+
+def run_worker(args, index, directory):
+    # Процесс-воркер: тот же сервер плюс шина к остальным воркерам.
+    # Метрики у каждого свои: порт --stats-port + номер, сокет --stats-unix.номер
+    global worker_bus
+    parent = os.getppid()
+
+    def watch_parent():
+        # Воркер не переживает родителя, иначе порт остаётся занят сиротами
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(1)
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    worker_bus = bus.Bus(directory, index, args.workers, bus_deliver)
+    if args.stats_port:
+        args.stats_port += index
+    if args.stats_unix:
+        args.stats_unix = f"{args.stats_unix}.{index}"
+    dedup.configure(args)
+    heartbeat.configure(args)
+    configure_limits(args)
+    try:
+        start_stats(args)
+        ENGINES[args.engine](args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_report(f"Воркер {index}")
+
+
+def start_workers(args):
+    # Родитель только запускает воркеров и перезапускает упавших
+    directory = tempfile.mkdtemp(prefix="rp-bus-")
+    context = multiprocessing.get_context("fork")
+    workers = {}
+
+    def spawn(index):
+        process = context.Process(target=run_worker, args=(args, index, directory), name=f"worker-{index}")
+        process.start()
+        workers[index] = (process, time.monotonic())
+
+    # SIGTERM - как Ctrl+C: воркеры останавливаются и каталог шины удаляется.
+    # Воркеры наследуют обработчик и тоже завершаются через finally
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"[Сервер] Воркеров: {args.workers}, шина: {directory}")
+    try:
+        for index in range(args.workers):
+            spawn(index)
+        while True:
+            time.sleep(1)
+            for index, (process, started) in list(workers.items()):
+                if process.is_alive():
+                    continue
+                if time.monotonic() - started < RESPAWN_MIN:
+                    print(f"[Сервер] Воркер {index} упал сразу после запуска (код {process.exitcode}), остановка")
+                    return
+                print(f"[Сервер] Воркер {index} завершился (код {process.exitcode}), перезапуск")
+                spawn(index)
+    finally:
+        for process, _ in workers.values():
+            process.terminate()
+        for process, _ in workers.values():
+            process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ретранслятор реплик от отправителей к приёмникам")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="threaded",
+                        help="threaded - поток на соединение, asyncio - один цикл событий")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="сколько сообщений держать в очереди одного приёмника")
+    parser.add_argument("--slow-policy", choices=SLOW_POLICIES, default=SLOW_POLICY,
+                        help="что делать с переполненной очередью медленного приёмника")
+    parser.add_argument("--max-lag-ms", type=int, default=MAX_LAG_MS,
+                        help="для disconnect: отключать приёмник, отставший больше чем на N мс")
+    parser.add_argument("--tcp-nodelay", action=argparse.BooleanOptionalAction, default=TCP_NODELAY,
+                        help="TCP_NODELAY на соединениях клиентов: пачки и так собираются в очереди")
+    parser.add_argument("--dedup-window", type=float, default=DEDUP_WINDOW,
+                        help="не рассылать id, уже пришедший от отправителя за N секунд (0 - не проверять)")
+    parser.add_argument("--dedup-size", type=int, default=DEDUP_SIZE,
+                        help="сколько последних id помнить на отправителя")
+    parser.add_argument("--heartbeat", type=float, default=HEARTBEAT_INTERVAL,
+                        help="PING клиенту, молчащему N секунд (0 - без пульса и уборки)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="отключать клиента с пульсом, молчащего N секунд (0 - не отключать)")
+    parser.add_argument("--keepalive-idle", type=int, default=KEEPALIVE_IDLE,
+                        help="TCP keepalive: первая проба после N секунд тишины (0 - без keepalive)")
+    parser.add_argument("--keepalive-interval", type=int, default=KEEPALIVE_INTERVAL,
+                        help="TCP keepalive: секунд между пробами")
+    parser.add_argument("--keepalive-count", type=int, default=KEEPALIVE_COUNT,
+                        help="TCP keepalive: проб без ответа до разрыва")
+    parser.add_argument("--tcp-user-timeout", type=float, default=TCP_USER_TIMEOUT,
+                        help="разрывать соединение, если отправленное не подтверждено N секунд (0 - как в ядре)")
+    parser.add_argument("--sender-rate", type=float, default=ratelimit.SENDER_RATE,
+                        help="реплик в секунду на отправителя, сверх - в его очередь (0 - без ограничения)")
+    parser.add_argument("--sender-burst", type=float, default=ratelimit.SENDER_BURST,
+                        help="сколько реплик отправитель может прислать подряд без ожидания")
+    parser.add_argument("--channel-rate", type=float, default=ratelimit.CHANNEL_RATE,
+                        help="реплик в секунду на канал (0 - без ограничения)")
+    parser.add_argument("--channel-burst", type=float, default=ratelimit.CHANNEL_BURST)
+    parser.add_argument("--sender-backlog", type=int, default=ratelimit.BACKLOG,
+                        help="реплик в очереди лимита одного отправителя, сверх - отбрасываются")
+    parser.add_argument("--limits", default=None,
+                        help="JSON с лимитами (см. ratelimit.py), перечитывается при изменении")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT,
+                        help="отдавать метрики Prometheus на 127.0.0.1:PORT (0 - нет)")
+    parser.add_argument("--stats-unix", default=None,
+                        help="отдавать метрики через Unix-сокет по этому пути")
+    parser.add_argument("--metrics-sample", type=int, default=METRICS_SAMPLE,
+                        help="замерять время рассылки и этапы доставки у каждого N-го сообщения")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="процессов на одном порту (SO_REUSEPORT, Linux), связанных шиной; "
+                             "метрики воркера N - на --stats-port + N")
+    parser.add_argument("--log-dir", default=None,
+                        help="вести журнал сообщений в этом каталоге: переподключившийся приёмник "
+                             "получает пропущенное (только с --workers 1)")
+    parser.add_argument("--log-segment-mb", type=float, default=journal.SEGMENT_BYTES / 2**20,
+                        help="размер сегмента журнала, МБ")
+    parser.add_argument("--log-retention-mb", type=float, default=journal.RETENTION_BYTES / 2**20,
+                        help="хранить не больше N МБ журнала")
+    parser.add_argument("--log-retention-hours", type=float, default=journal.RETENTION_SECONDS / 3600,
+                        help="хранить сегменты журнала не дольше N часов")
+    parser.add_argument("--log-fsync-ms", type=int, default=int(journal.FSYNC_INTERVAL * 1000),
+                        help="дописывать журнал на диск и делать fsync раз в N мс")
+    args = parser.parse_args(argv)
+    if args.log_dir and args.workers > 1:
+        # У каждого воркера были бы свои номера seq, а приёмник после
+        # переподключения может попасть в другой воркер
+        parser.error("--log-dir работает только с --workers 1")
+    return args
+
+
+def open_log(args):
+    global message_log
+    if not args.log_dir:
+        return
+    message_log = journal.MessageLog(
+        args.log_dir,
+        segment_bytes=int(args.log_segment_mb * 2**20),
+        retention_bytes=int(args.log_retention_mb * 2**20),
+        retention_seconds=args.log_retention_hours * 3600,
+        fsync_interval=args.log_fsync_ms / 1000,
+    )
+    print(f"[Сервер] Журнал: {args.log_dir} ({message_log.log_id}), последний seq {message_log.last_seq}")
 
 if __name__ == "__main__":
-    start_server()
+    args = parse_args()
+    if args.workers > 1:
+        try:
+            start_workers(args)
+        except KeyboardInterrupt:
+            pass
+    else:
+        dedup.configure(args)
+        heartbeat.configure(args)
+        configure_limits(args)
+        open_log(args)
+        try:
+            start_stats(args)
+            ENGINES[args.engine](args)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if message_log is not None:
+                message_log.close()
+            print_report()
@@ -0,0 +1,129 @@
+"""Шаблоны реплик с подстановками вида {org}, {rang:nomn}, {name:datv}.
+
+Каждая фраза разбирается один раз в список токенов: строки-литералы и
+подстановки (поле, падеж). Отрисовка - один проход по токенам без
+str.replace/str.format. Renderer держит скомпилированные шаблоны и кэш
+готовых строк, кэш сбрасывается только при смене профиля. Падежные формы
+берутся из таблицы profile["forms"], которую заранее считает declension.py.
+"""
+import re
+
+# Падежи в обозначениях граммем (как в rp.json) и их длинные названия из настроек
+CASES = ("nomn", "gent", "datv", "accs", "ablt", "loct")
+CASE_ALIASES = {
+    "nominative": "nomn",
+    "genitive": "gent",
+    "dative": "datv",
+    "accusative": "accs",
+    "instrumental": "ablt",
+    "prepositional": "loct",
+}
+
+_PLACEHOLDER = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)(?::([A-Za-z]+))?\}")
+
+
+def normalize_case(case):
+    if not case:
+        return None
+    case = case.lower()
+    case = CASE_ALIASES.get(case, case)
+    return case if case in CASES else None
+
+
+class Template:
+    __slots__ = ("source", "parts", "fields")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = []
+        self.fields = set()
+        literal = []
+        pos = 0
+        for m in _PLACEHOLDER.finditer(source):
+            literal.append(source[pos:m.start()])
+            pos = m.end()
+            token = m.group(0)
+            if token in ("{{", "}}"):
+                literal.append(token[0])
+                continue
+            field, case = m.group(1), m.group(2)
+            if case and normalize_case(case) is None:
+                # Неизвестный падеж - оставляем как есть, это не наша подстановка
+                literal.append(token)
+                continue
+            if literal:
+                self.parts.append("".join(literal))
+                literal = []
+            self.parts.append((field, normalize_case(case), token))
+            self.fields.add(field)
+        literal.append(source[pos:])
+        tail = "".join(literal)
+        if tail:
+            self.parts.append(tail)
+
+    def render(self, lookup) -> str:
+        # lookup(field, case) -> строка или None, если поля нет в профиле
+        out = []
+        for part in self.parts:
+            if part.__class__ is str:
+                out.append(part)
+            else:
+                value = lookup(part[0], part[1])
+                out.append(part[2] if value is None else value)
+        return "".join(out)
+
+
+class Renderer:
+    def __init__(self, profile=None):
+        self.templates = {}
+        self.rendered = {}
+        self.values = {}
+        self.forms = {}
+        self.default_case = None
+        if profile:
+            self.set_profile(profile)
+
+    def compile(self, text: str) -> Template:
+        template = self.templates.get(text)
+        if template is None:
+            template = self.templates[text] = Template(text)
+        return template
+
+    def compile_catalog(self, node):
+        # Обходим дерево фраз один раз при загрузке и компилируем все строки
+        if isinstance(node, dict):
+            for value in node.values():
+                self.compile_catalog(value)
+        elif isinstance(node, list):
+            for value in node:
+                self.compile_catalog(value)
+        elif isinstance(node, str):
+            self.compile(node)
+
+    def set_profile(self, profile) -> bool:
+        values = {k: v for k, v in profile.items() if isinstance(v, str)}
+        forms = profile.get("forms") or {}
+        # Падеж из настроек применяется к подстановкам без явного падежа
+        default_case = normalize_case(profile.get("declension"))
+        if values == self.values and forms == self.forms and default_case == self.default_case:
+            return False
+        self.values = values
+        self.forms = forms
+        self.default_case = default_case
+        self.rendered.clear()
+        return True
+
+    def lookup(self, field, case):
+        # Чистый поиск по таблице: никакой морфологии на пути отправки
+        table = self.forms.get(field)
+        if table:
+            form = table.get(case or self.default_case or "nomn")
+            if form is not None:
+                return form
+        return self.values.get(field)
+
+    def render(self, text: str) -> str:
+        result = self.rendered.get(text)
+        if result is None:
+            result = self.rendered[text] = self.compile(text).render(self.lookup)
+        return result
@@ -0,0 +1,121 @@
+import copy
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import catalog  # noqa: E402
+
+PHRASES = {
+    "Бой": {
+        "Фразы": ["Атакую", "Атакую"],
+        "/me": ["достаёт меч"],
+        "Оборона": {"Фразы": ["Защищаюсь"], "/me": ["поднимает щит"]},
+    },
+    "Работа": {
+        "РП остановка": {
+            "Фразы": ["Стоять!"],
+            "Досмотр": {"Фразы": ["Руки на капот"], "/me": ["осматривает"]},
+        },
+    },
+}
+FORMATS = {
+    "Работа": {
+        "prefix": "[раб] ",
+        "РП остановка": {"suffix": " (ПД)", "/me": {"prefix": "/me "}},
+    },
+}
+
+
+def texts(index, path):
+    return [(e.kind, e.prefix + e.text + e.suffix) for e in index.category(path)]
+
+
+class CatalogIndexTest(unittest.TestCase):
+    def test_formats_inherited(self):
+        index = catalog.CatalogIndex(PHRASES, FORMATS)
+        self.assertEqual(texts(index, ("Бой", "Оборона")),
+                         [("phrase", "Защищаюсь"), ("me", "поднимает щит")])
+        # prefix - с самого глубокого узла, где задан; suffix - свой у узла
+        self.assertEqual(texts(index, ("Работа", "РП остановка")), [("phrase", "[раб] Стоять! (ПД)")])
+        # /me наследуется подкатегориями, обычный формат на /me не действует
+        self.assertEqual(texts(index, ("Работа", "РП остановка", "Досмотр")),
+                         [("phrase", "[раб] Руки на капот (ПД)"), ("me", "/me осматривает")])
+
+    def test_children_and_ids(self):
+        index = catalog.CatalogIndex(PHRASES, FORMATS)
+        self.assertEqual(index.children[()], ["Бой", "Работа"])
+        self.assertEqual(index.children[("Бой",)], ["Оборона"])
+        ids = index.categories[("Бой",)]
+        # Одинаковые строки в одной категории - разные фразы
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids, catalog.CatalogIndex(PHRASES, FORMATS).categories[("Бой",)])
+        self.assertEqual(len(index), 8)
+
+    def test_bad_nodes_ignored(self):
+        index = catalog.CatalogIndex({"A": {"Фразы": ["x", 5, None], "B": "не категория"}, "C": []}, {})
+        self.assertEqual(texts(index, ("A",)), [("phrase", "x")])
+        self.assertEqual(index.children[()], ["A"])
+        self.assertEqual(index.children[("A",)], [])
+
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.old = catalog.CatalogIndex(PHRASES, FORMATS)
+
+    def edited(self):
+        tree = copy.deepcopy(PHRASES)
+        tree["Бой"]["Оборона"]["Фразы"][0] = "Держу строй"  # правка фразы
+        del tree["Работа"]["РП остановка"]["Досмотр"]  # удалена ветка
+        tree["Новая"] = {"Фразы": ["привет"]}  # новая ветка
+        return tree
+
+    def test_no_changes(self):
+        self.assertFalse(catalog.diff(self.old, catalog.CatalogIndex(PHRASES, FORMATS)))
+
+    def test_changes(self):
+        new = catalog.CatalogIndex(self.edited(), FORMATS)
+        changes = catalog.diff(self.old, new)
+        self.assertEqual(changes.children, [(), ("Работа", "РП остановка")])
+        self.assertEqual(changes.categories, {("Бой", "Оборона"), ("Новая",)})
+        removed = self.old.categories[("Работа", "РП остановка", "Досмотр")] + \
+            [self.old.categories[("Бой", "Оборона")][0]]
+        self.assertEqual(set(changes.removed), set(removed))
+        self.assertEqual(set(changes.added), {new.categories[("Бой", "Оборона")][0],
+                                              *new.categories[("Новая",)]})
+
+    def test_format_only_change(self):
+        formats = copy.deepcopy(FORMATS)
+        formats["Работа"]["prefix"] = "[служба] "
+        changes = catalog.diff(self.old, catalog.CatalogIndex(PHRASES, formats))
+        self.assertIn(("Работа", "РП остановка"), changes.categories)
+        self.assertNotIn(("Бой",), changes.categories)
+        self.assertEqual(changes.added, [])
+
+    def test_patched_matches_rebuild(self):
+        tree = self.edited()
+        tree["Бой"]["Фразы"].append("Отступаем")
+        patched, changes = self.old.patched(PHRASES, tree, FORMATS)
+        rebuilt = catalog.CatalogIndex(tree, FORMATS)
+        full = catalog.diff(self.old, rebuilt)
+        self.assertEqual(patched.categories, rebuilt.categories)
+        self.assertEqual(patched.children, rebuilt.children)
+        self.assertEqual({i: texts(patched, e.path) for i, e in patched.entries.items()},
+                         {i: texts(rebuilt, e.path) for i, e in rebuilt.entries.items()})
+        self.assertEqual(changes.categories, full.categories)
+        self.assertEqual(changes.children, full.children)
+        self.assertEqual(set(changes.added), set(full.added))
+        self.assertEqual(set(changes.removed), set(full.removed))
+        # Старый индекс читает окно - patched его не трогает
+        self.assertEqual(self.old.categories, catalog.CatalogIndex(PHRASES, FORMATS).categories)
+        self.assertEqual(len(self.old), 8)
+
+    def test_patched_unchanged_tree(self):
+        patched, changes = self.old.patched(PHRASES, copy.deepcopy(PHRASES), FORMATS)
+        self.assertFalse(changes)
+        self.assertEqual(patched.categories, self.old.categories)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import catalog  # noqa: E402
+import catalog_cache  # noqa: E402
+
+
+class CacheReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        root = Path(self.dir.name)
+        self.phrases = root / "rp_phrases.json"
+        self.formats = root / "formats.json"
+        self.cache = root / "rp_catalog.bin"
+        self.formats.write_text("{}", encoding="utf-8")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def compile(self, text):
+        tree = {"Бой": {catalog.PHRASES_KEY: [text]}}
+        self.phrases.write_text(json.dumps(tree, ensure_ascii=False), encoding="utf-8")
+        paths = (self.phrases, self.formats)
+        return catalog_cache.compile_index(catalog.CatalogIndex(tree, {}), self.cache,
+                                           catalog_cache.source_digest(*paths),
+                                           catalog_cache.source_stamps(*paths))
+
+    def open_text(self):
+        compiled = catalog_cache.open_cache(self.phrases, self.formats, self.cache)
+        self.assertIsNotNone(compiled)
+        return compiled, compiled.category(("Бой",))[0].text
+
+    def test_recompile_while_mapped(self):
+        # Как в Windows: файл, открытый через mmap, нельзя заменить или удалить
+        self.compile("первая")
+        opened, text = self.open_text()
+        self.assertEqual(text, "первая")
+        mapped = {Path(p).resolve() for p, _ in catalog_cache.cache_versions(self.cache)}
+
+        replace, unlink = os.replace, Path.unlink
+
+        def locked_replace(src, dst):
+            if Path(dst).resolve() in mapped:
+                raise PermissionError(dst)
+            replace(src, dst)
+
+        def locked_unlink(path, missing_ok=False):
+            if path.resolve() in mapped:
+                raise PermissionError(path)
+            unlink(path, missing_ok=missing_ok)
+
+        with mock.patch("os.replace", locked_replace), mock.patch.object(Path, "unlink", locked_unlink):
+            self.compile("вторая")
+        self.assertEqual(self.open_text()[1], "вторая")
+        self.assertEqual(len(catalog_cache.cache_versions(self.cache)), 2)
+        self.assertEqual(opened.category(("Бой",))[0].text, "первая")
+
+        # Старая версия больше не занята - уходит при следующей записи
+        self.compile("третья")
+        self.assertEqual(self.open_text()[1], "третья")
+        self.assertEqual(len(catalog_cache.cache_versions(self.cache)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
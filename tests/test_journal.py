@@ -0,0 +1,107 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import journal  # noqa: E402
+import protocol  # noqa: E402
+
+
+class MessageLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            log.close()
+        self.dir.cleanup()
+
+    def open(self, **kwargs):
+        # Фоновая запись не мешает: буфер на диск сбрасывает сам тест
+        log = journal.MessageLog(self.dir.name, fsync_interval=3600, **kwargs)
+        self.logs.append(log)
+        return log
+
+    def append(self, log, channel, count):
+        for _ in range(count):
+            log.append(channel, protocol.MSG, lambda seq: protocol.message(
+                f"{channel}{seq}", channel=channel, seq=seq, ts={"relay_in": 1.0}))
+
+    def replay(self, log, after, channels=("c",), limit=1000):
+        frames, skipped = log.replay_tail(log.replay(log.log_id, after, set(channels), limit))
+        return [protocol.decode_json(frame[protocol.HEADER.size:]) for frame in frames], skipped
+
+    def test_replay_from_files_and_buffer(self):
+        log = self.open(segment_bytes=300)
+        # Новый сегмент начинается с пачки записи: пишем несколькими пачками
+        for _ in range(5):
+            self.append(log, "c", 2)
+            log._write_pending(sync=False)
+        self.append(log, "other", 5)
+        log._write_pending(sync=False)
+        self.append(log, "c", 3)  # ещё в буфере
+        self.assertGreater(len(log.segments), 1)
+        messages, skipped = self.replay(log, 4)
+        self.assertEqual([m["seq"] for m in messages], [5, 6, 7, 8, 9, 10, 16, 17, 18])
+        self.assertEqual(skipped, 0)
+        # Отметки доставки в журнале устарели и при досылке убираются
+        self.assertTrue(all("ts" not in m for m in messages))
+
+    def test_up_to_date_receiver_gets_only_new(self):
+        log = self.open()
+        self.append(log, "c", 3)
+        log._write_pending(sync=False)
+        cursor = log.replay(log.log_id, 3, {"c"}, 100)
+        # Дописано между replay и подпиской - приходит из replay_tail
+        self.append(log, "c", 2)
+        log._write_pending(sync=False)
+        self.append(log, "c", 1)
+        frames, _ = log.replay_tail(cursor)
+        self.assertEqual([protocol.decode_json(f[protocol.HEADER.size:])["seq"] for f in frames], [4, 5, 6])
+
+    def test_limit_keeps_newest(self):
+        log = self.open()
+        self.append(log, "c", 10)
+        messages, skipped = self.replay(log, 0, limit=4)
+        self.assertEqual([m["seq"] for m in messages], [7, 8, 9, 10])
+        self.assertEqual(skipped, 6)
+
+    def test_foreign_log_or_bad_seq(self):
+        log = self.open()
+        self.append(log, "c", 2)
+        self.assertIsNone(log.replay("other", 0, {"c"}, 10))
+        self.assertIsNone(log.replay(log.log_id, "1", {"c"}, 10))
+        self.assertEqual(log.replay_tail(None), ([], 0))
+
+    def test_reopen_continues_numbering(self):
+        log = self.open()
+        self.append(log, "c", 5)
+        log.close()
+        self.logs.remove(log)
+        # Недописанная при падении строка обрезается
+        segment = log._path(log.segments[-1])
+        with open(segment, "ab") as f:
+            f.write(b'{"seq":6,"t":1')
+        log = self.open()
+        self.assertEqual(log.last_seq, 5)
+        self.append(log, "c", 1)
+        messages, _ = self.replay(log, 3)
+        self.assertEqual([m["seq"] for m in messages], [4, 5, 6])
+
+    def test_retention_drops_old_segments(self):
+        log = self.open(segment_bytes=200, retention_bytes=600)
+        for _ in range(20):
+            self.append(log, "c", 2)
+            log._write_pending(sync=False)
+        self.assertLessEqual(log.stats()["bytes"], 600 + 400)
+        messages, _ = self.replay(log, 0)
+        seqs = [m["seq"] for m in messages]
+        self.assertEqual(seqs, list(range(seqs[0], 41)))
+        self.assertGreater(seqs[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
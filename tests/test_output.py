@@ -0,0 +1,118 @@
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import output  # noqa: E402
+
+
+class GatedBackend:
+    # Ввод строки ждёт release: тест решает, что происходит, пока она вводится
+    def __init__(self):
+        self.lines = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def type_line(self, text, cancel=None):
+        self.started.release()
+        while not self.release.wait(0.01):
+            if cancel is not None and cancel.is_set():
+                return False
+        self.lines.append(text)
+        return True
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = GatedBackend()
+        self.acks = []
+        self.scheduler = output.OutputScheduler(
+            self.backend, on_done=lambda msg_id, status, ts: self.acks.append((msg_id, status)))
+
+    def tearDown(self):
+        self.backend.release.set()
+        self.scheduler.close()
+        self.scheduler.thread.join(5)
+
+    def wait_typing(self):
+        self.assertTrue(self.backend.started.acquire(timeout=5))
+
+    def settle(self):
+        # Ввод идёт в своём потоке: ждём, пока очередь опустеет
+        deadline = time.monotonic() + 5
+        while (self.scheduler.depth() or self.scheduler.typing) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+    def scenario(self):
+        return [{"text": "first", "kind": "phrase", "delay": 0},
+                {"text": "second", "kind": "phrase", "delay": 0}]
+
+    def test_flush_during_scenario_step_drops_rest(self):
+        self.scheduler.play(self.scenario(), "sc1")
+        self.wait_typing()
+        self.assertEqual(self.scheduler.flush(), 1)
+        self.backend.release.set()
+        self.settle()
+        self.assertEqual(self.backend.lines, ["first"])
+        self.assertEqual(self.acks, [("sc1", "flushed")])
+
+    def test_cancel_during_scenario_step(self):
+        self.scheduler.play(self.scenario(), "sc1")
+        self.wait_typing()
+        self.scheduler.cancel()
+        self.settle()
+        self.backend.release.set()
+        self.settle()
+        self.assertEqual(self.backend.lines, [])
+        self.assertEqual(self.acks, [("sc1", "cancelled")])
+
+    def test_priority_and_coalescing(self):
+        self.scheduler.put("busy")
+        self.wait_typing()
+        # Пока вводится первая строка, очередь копится
+        self.assertTrue(self.scheduler.put("emote", kind="me", msg_id="m1"))
+        self.assertTrue(self.scheduler.put("hello", msg_id="p1"))
+        self.assertFalse(self.scheduler.put("hello", msg_id="p2"))
+        self.assertEqual(self.scheduler.depth(), 2)
+        self.assertEqual(self.acks, [("p2", "coalesced")])
+        self.backend.release.set()
+        self.settle()
+        # Речь раньше /me, повтор ждущей строки не вводится второй раз
+        self.assertEqual(self.backend.lines, ["busy", "hello", "emote"])
+        self.assertEqual(self.acks, [("p2", "coalesced"), ("p1", "typed"), ("m1", "typed")])
+        self.assertEqual(self.scheduler.stats["coalesced"], 1)
+
+    def test_flush_drops_queue_not_current_line(self):
+        self.scheduler.put("busy", msg_id="b")
+        self.wait_typing()
+        self.scheduler.put("one", msg_id="1")
+        self.scheduler.play([{"text": "later", "kind": "phrase", "delay": 60}], "sc")
+        self.assertEqual(self.scheduler.flush(), 2)
+        self.assertEqual(self.scheduler.depth(), 0)
+        # Тот же текст после flush снова встаёт в очередь
+        self.assertTrue(self.scheduler.put("one", msg_id="2"))
+        self.backend.release.set()
+        self.settle()
+        self.assertEqual(self.backend.lines, ["busy", "one"])
+        self.assertCountEqual(self.acks, [("1", "flushed"), ("sc", "flushed"), ("b", "typed"), ("2", "typed")])
+
+    def test_scenario_steps_interleave(self):
+        self.backend.release.set()
+        self.scheduler.play([{"text": "a", "kind": "phrase", "delay": 0},
+                             {"text": "b", "kind": "phrase", "delay": 0.2}], "sc")
+        deadline = time.monotonic() + 5
+        while self.backend.lines != ["a"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # В паузе между шагами вводятся другие строки
+        self.scheduler.put("between")
+        self.settle()
+        self.assertEqual(self.backend.lines, ["a", "between", "b"])
+        self.assertEqual(self.acks, [("sc", "typed")])
+
+
+if __name__ == "__main__":
+    unittest.main()
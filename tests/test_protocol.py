@@ -0,0 +1,88 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import protocol  # noqa: E402
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_frames_split_at_every_byte(self):
+        # Русский текст: граница recv попадает и внутрь символа UTF-8
+        data = protocol.message("привет, мир", id="a") + protocol.hello("sender", channel="ooc")
+        decoder = protocol.FrameDecoder()
+        frames = []
+        for i in range(len(data)):
+            frames += decoder.feed(data[i:i + 1])
+        self.assertEqual([kind for kind, _ in frames], [protocol.MSG, protocol.HELLO])
+        self.assertEqual(protocol.decode_json(frames[0][1]), {"text": "привет, мир", "id": "a"})
+        self.assertEqual(decoder.buffer, b"")
+
+    def test_many_frames_in_one_chunk(self):
+        data = b"".join(protocol.message(str(i)) for i in range(100))
+        frames = protocol.FrameDecoder().feed(data)
+        self.assertEqual([protocol.decode_json(p)["text"] for _, p in frames], [str(i) for i in range(100)])
+
+    def test_partial_tail_is_kept(self):
+        frame = protocol.ack("a", "typed", {"sent": 1.0})
+        decoder = protocol.FrameDecoder()
+        self.assertEqual(decoder.feed(frame + frame[:5]), [(protocol.ACK, frame[protocol.HEADER.size:])])
+        self.assertEqual(len(decoder.feed(frame[5:])), 1)
+
+    def test_bad_header(self):
+        good = protocol.message("x")
+        for name, data in (
+                ("magic", b"hello\n" + good),
+                ("version", bytes([protocol.MAGIC, protocol.VERSION + 1]) + good[2:]),
+                ("length", protocol.HEADER.pack(protocol.MAGIC, protocol.VERSION, protocol.MSG,
+                                                protocol.MAX_PAYLOAD + 1))):
+            with self.subTest(name), self.assertRaises(protocol.ProtocolError):
+                protocol.FrameDecoder().feed(data)
+
+    def test_oversized_payload_not_encoded(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.encode_frame(protocol.MSG, b"x" * (protocol.MAX_PAYLOAD + 1))
+
+    def test_bad_json_body(self):
+        for payload in (b"{", b"\xff\xfe"):
+            with self.subTest(payload=payload), self.assertRaises(protocol.ProtocolError):
+                protocol.decode_json(payload)
+
+
+class ScenarioStepsTest(unittest.TestCase):
+    def test_steps_normalized(self):
+        steps = protocol.scenario_steps({"steps": [
+            {"text": "  первый  "},
+            {"text": "", "delay": 1},
+            {"text": "второй", "kind": "me", "delay": 2},
+            {"text": "третий", "kind": "shout", "delay": -5},
+            {"text": "четвёртый", "delay": "soon"},
+            {"text": "пятый", "delay": protocol.MAX_STEP_DELAY * 2},
+        ]})
+        self.assertEqual(steps, [
+            {"text": "первый", "kind": "phrase", "delay": 0.0},
+            {"text": "второй", "kind": "me", "delay": 2.0},
+            {"text": "третий", "kind": "phrase", "delay": 0.0},
+            {"text": "четвёртый", "kind": "phrase", "delay": 0.0},
+            {"text": "пятый", "kind": "phrase", "delay": protocol.MAX_STEP_DELAY},
+        ])
+
+    def test_empty_scenario(self):
+        self.assertEqual(protocol.scenario_steps({"steps": [{"text": " "}]}), [])
+
+    def test_invalid_scenario(self):
+        for obj in ({}, {"steps": "abc"}, {"steps": [{"text": "x"}] * (protocol.MAX_STEPS + 1)},
+                    {"steps": ["x"]}):
+            with self.subTest(obj=str(obj)[:40]), self.assertRaises(protocol.ProtocolError):
+                protocol.scenario_steps(obj)
+
+    def test_round_trip(self):
+        steps = [{"text": "а", "kind": "phrase", "delay": 0.5}]
+        (kind, payload), = protocol.FrameDecoder().feed(protocol.scenario(steps, channel="c", id="s"))
+        self.assertEqual(kind, protocol.SCENARIO)
+        self.assertEqual(protocol.scenario_steps(protocol.decode_json(payload)), steps)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ratelimit  # noqa: E402
+
+
+class LimitsReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name) / "limits.json"
+        self.write({"sender": {"rate": 5, "burst": 20}})
+        self.limits = ratelimit.Limits(path=self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, config):
+        self.path.write_text(json.dumps(config), encoding="utf-8")
+        # mtime меняется и при записи в ту же наносекунду
+        stamp = time.time_ns() + getattr(self, "tick", 0)
+        self.tick = getattr(self, "tick", 0) + 10**9
+        os.utime(self.path, ns=(stamp, stamp))
+
+    def test_valid_file_loaded(self):
+        self.assertEqual(self.limits.sender("a"), (5.0, 20.0, 1))
+
+    def test_type_invalid_reload_keeps_previous(self):
+        for bad in ({"sender": {"rate": "fast"}},
+                    {"sender": {"burst": 0}},
+                    {"channel": {"rate": float("inf")}},
+                    {"senders": {"a": {"weight": 0}}},
+                    {"channels": {"ooc": "off"}},
+                    {"backlog": "many"}):
+            with self.subTest(bad=bad):
+                self.write(bad)
+                self.assertFalse(self.limits.reload(force=True))
+                self.assertEqual(self.limits.version, 1)
+                self.assertEqual(self.limits.sender("a"), (5.0, 20.0, 1))
+                self.assertEqual(self.limits.channel("ooc"), (0.0, 50.0))
+
+    def test_drain_failure_does_not_stop_loop(self):
+        fair = ratelimit.FairQueue(self.limits)
+        fair.drain = lambda: 1 / 0
+        self.assertEqual(fair._drain_safely(), ratelimit.RELOAD_CHECK)
+
+
+if __name__ == "__main__":
+    unittest.main()
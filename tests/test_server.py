@@ -0,0 +1,188 @@
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import protocol  # noqa: E402
+import server  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    def __init__(self, port, role, **hello):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.decoder = protocol.FrameDecoder()
+        self.frames = []
+        self.sock.sendall(protocol.hello(role, **hello))
+
+    def send(self, frame):
+        self.sock.sendall(frame)
+
+    def wait(self, match, timeout=5.0):
+        # Первый кадр (тип, тело), для которого match истинно; None - не дождались
+        deadline = time.monotonic() + timeout
+        while True:
+            for i, (kind, msg) in enumerate(self.frames):
+                if match(kind, msg):
+                    del self.frames[:i + 1]
+                    return kind, msg
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            self.sock.settimeout(left)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                return None
+            self.frames += [(kind, protocol.decode_json(payload)) for kind, payload in self.decoder.feed(data)]
+
+    def close(self):
+        self.sock.close()
+
+
+def text(value):
+    return lambda kind, msg: kind == protocol.MSG and msg.get("text") == value
+
+
+def ack(msg_id):
+    return lambda kind, msg: kind == protocol.ACK and msg.get("id") == msg_id
+
+
+class RelayTest:
+    engine = None
+
+    def setUp(self):
+        self.port = free_port()
+        self.server = subprocess.Popen(
+            [sys.executable, str(ROOT / "server.py"), "--engine", self.engine,
+             "--host", "127.0.0.1", "--port", str(self.port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.clients = []
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.terminate()
+        self.server.wait()
+
+    def connect(self, role, **hello):
+        client = Client(self.port, role, **hello)
+        self.clients.append(client)
+        return client
+
+    def pair(self):
+        receiver = self.connect("receiver", channels=["c"])
+        sender = self.connect("sender", channel="c", client="s1")
+        # HELLO приёмника обрабатывается в своём потоке: ждём, пока подпишется
+        deadline = time.monotonic() + 5
+        while True:
+            sender.send(protocol.message("ping", channel="c"))
+            if receiver.wait(text("ping"), timeout=0.2) or time.monotonic() > deadline:
+                return sender, receiver
+
+    def test_bad_stamps_do_not_drop_receiver(self):
+        sender, receiver = self.pair()
+        sender.send(protocol.message("a", channel="c", id="m1",
+                                     ts={"sent": "oops", "recv": True, "extra": 1.0}))
+        _, msg = receiver.wait(text("a"))
+        self.assertEqual(set(msg["ts"]), {"relay_in", "relay_out"})
+        # Приёмник возвращает отметки как есть, и с испорченными тоже
+        receiver.send(protocol.ack(msg["id"], "typed", {**msg["ts"], "sent": "oops", "typed": [1]}))
+        self.assertIsNotNone(sender.wait(ack("m1")))
+        sender.send(protocol.message("b", channel="c"))
+        self.assertIsNotNone(receiver.wait(text("b")))
+
+    def test_ack_goes_to_sender_of_id(self):
+        sender, receiver = self.pair()
+        other = self.connect("sender", channel="c", client="s2")
+        sender.send(protocol.message("mine", channel="c", id="same"))
+        _, mine = receiver.wait(text("mine"))
+        other.send(protocol.message("theirs", channel="c", id="same"))
+        _, theirs = receiver.wait(text("theirs"))
+        self.assertNotEqual(mine["id"], theirs["id"])
+        receiver.send(protocol.ack(mine["id"], "typed", mine["ts"]))
+        self.assertIsNotNone(sender.wait(ack("same")))
+        self.assertIsNone(other.wait(ack("same"), timeout=0.3))
+        receiver.send(protocol.ack(theirs["id"], "typed", theirs["ts"]))
+        self.assertIsNotNone(other.wait(ack("same")))
+        self.assertIsNone(sender.wait(ack("same"), timeout=0.3))
+
+
+class DedupWindowTest(unittest.TestCase):
+    def test_repeat_within_window(self):
+        window = server.DedupWindow(maxsize=10, ttl=30)
+        self.assertFalse(window.seen("a"))
+        self.assertTrue(window.seen("a"))
+        self.assertFalse(window.seen("b"))
+
+    def test_forget_allows_retry(self):
+        window = server.DedupWindow(maxsize=10, ttl=30)
+        window.seen("a")
+        window.forget("a")
+        self.assertFalse(window.seen("a"))
+
+    def test_expired_and_evicted(self):
+        window = server.DedupWindow(maxsize=2, ttl=0.05)
+        window.seen("a")
+        time.sleep(0.1)
+        self.assertFalse(window.seen("a"))
+        window.seen("b")
+        window.seen("c")
+        self.assertEqual(list(window.ids), ["b", "c"])
+
+    def test_window_per_client(self):
+        index = server.DedupIndex(ttl=30, size=10)
+        first = index.window({"client": "x"}, ("127.0.0.1", 1))
+        self.assertIs(index.window({"client": "x"}, ("127.0.0.1", 2)), first)
+        self.assertIsNot(index.window({"client": "y"}, ("127.0.0.1", 1)), first)
+        self.assertIsNone(server.DedupIndex(ttl=0).window({"client": "x"}, None))
+
+
+class AckRouterTest(unittest.TestCase):
+    def test_same_client_id_routed_apart(self):
+        router = server.AckRouter()
+        first = router.assign("same", "sender-1")
+        second = router.assign("same", "sender-2")
+        self.assertNotEqual(first, second)
+        self.assertEqual(router.route(first), ("sender-1", "same"))
+        self.assertEqual(router.route(second), ("sender-2", "same"))
+        self.assertIsNone(router.route("same"))
+
+    def test_routes_bounded(self):
+        router = server.AckRouter(maxsize=2, ttl=30)
+        ids = [router.assign(str(i), "s") for i in range(3)]
+        self.assertIsNone(router.route(ids[0]))
+        self.assertEqual(router.route(ids[2]), ("s", "2"))
+
+
+class ThreadedRelayTest(RelayTest, unittest.TestCase):
+    engine = "threaded"
+
+
+class AsyncioRelayTest(RelayTest, unittest.TestCase):
+    engine = "asyncio"
+
+
+if __name__ == "__main__":
+    unittest.main()